@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact index of the asset database used by generate_vary_m_n.py.
+
+Parsing the 1.5 MB asset-database.json on every start is most of the startup
+time of a short run, while only the object type and bounding box of each asset
+are used. The index keeps just those: asset ids, a type id per asset into the
+list of object types, and the bounding boxes as a float array (strings are
+stored as UTF-8 bytes), in an
+uncompressed .npz file next to the database. It is loaded on first use and
+rebuilt automatically when the database's size or modification time changes
+(or INDEX_VERSION is bumped). Build it ahead of a batch of jobs with:
+
+    python asset_index.py databases/asset-database.json
+"""
+
+import argparse
+import json
+import os
+from collections.abc import Mapping
+
+import numpy as np
+
+INDEX_VERSION = 1
+
+
+def default_index_path(source):
+    return os.path.splitext(source)[0] + '.index.npz'
+
+
+def source_signature(source):
+    stat = os.stat(source)
+    return np.array([INDEX_VERSION, stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def compile_index(source):
+    """Return the index arrays of an asset database JSON file."""
+    signature = source_signature(source)
+    with open(source) as file:
+        asset_database = json.load(file)
+    asset_ids, type_ids, bounding_boxes = [], [], []
+    for type_id, candidates in enumerate(asset_database.values()):
+        for candidate in candidates:
+            asset_ids.append(candidate['assetId'])
+            type_ids.append(type_id)
+            bounding_boxes.append([candidate['boundingBox'][axis] for axis in 'xyz'])
+    return {
+        'signature': signature,
+        'types': np.array([object_type.encode() for object_type in asset_database]),
+        'asset_ids': np.array([asset_id.encode() for asset_id in asset_ids]),
+        'type_ids': np.array(type_ids, dtype=np.int32),
+        'bounding_boxes': np.array(bounding_boxes, dtype=np.float64).reshape(len(asset_ids), 3),
+    }
+
+
+def write_index(arrays, path):
+    # Write then rename, so jobs starting together never read a partial index
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_index(source, path):
+    """Return the index arrays, rebuilding the index file if it is missing or out of date."""
+    if os.path.exists(path):
+        with np.load(path) as index:
+            if np.array_equal(index['signature'], source_signature(source)):
+                return {name: index[name] for name in index.files}
+    arrays = compile_index(source)
+    try:
+        write_index(arrays, path)
+    except OSError as error:
+        print(f"asset index not saved ({error}); using it in memory")
+    return arrays
+
+
+class AssetIndex:
+    """Object types and bounding boxes of the assets of `source`, loaded on first use."""
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or default_index_path(source)
+        self.arrays = None
+
+    def __getstate__(self):
+        # Pool workers load the index file themselves instead of receiving the arrays
+        return {'source': self.source, 'path': self.path, 'arrays': None}
+
+    def load(self):
+        if self.arrays is None:
+            self.arrays = load_index(self.source, self.path)
+            types = [object_type.decode() for object_type in self.arrays['types'].tolist()]
+            self.object_types = [types[type_id] for type_id in self.arrays['type_ids'].tolist()]
+            self.bounding_boxes = self.arrays['bounding_boxes'].tolist()
+            self.rows = {asset_id.decode(): row for row, asset_id in enumerate(self.arrays['asset_ids'].tolist())}
+        return self
+
+    def signature(self):
+        """[INDEX_VERSION, size, mtime] of the database the loaded index was built from."""
+        return self.load().arrays['signature'].tolist()
+
+    def row(self, asset_id):
+        return self.load().rows.get(asset_id)
+
+
+class AssetTypes(Mapping):
+    """assetId -> object type, like build_asset_mapping."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, asset_id):
+        row = self.index.row(asset_id)
+        if row is None:
+            raise KeyError(asset_id)
+        return self.index.object_types[row]
+
+    def __iter__(self):
+        return iter(self.index.load().rows)
+
+    def __len__(self):
+        return len(self.index.load().rows)
+
+
+class AssetBoundingBoxes(Mapping):
+    """assetId -> {'x', 'y', 'z'} bounding box, like build_boundingBox_mapping."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def __getitem__(self, asset_id):
+        row = self.index.row(asset_id)
+        if row is None:
+            raise KeyError(asset_id)
+        return dict(zip('xyz', self.index.bounding_boxes[row]))
+
+    def __iter__(self):
+        return iter(self.index.load().rows)
+
+    def __len__(self):
+        return len(self.index.load().rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the compact index of an asset database.")
+    parser.add_argument('source', nargs='?', default='./databases/asset-database.json', help="Path of the asset database JSON file.")
+    parser.add_argument('--output', type=str, default=None, help="Path of the index (default: next to the database, as .index.npz).")
+    args = parser.parse_args()
+
+    path = args.output or default_index_path(args.source)
+    arrays = compile_index(args.source)
+    write_index(arrays, path)
+    print(f"{len(arrays['asset_ids'])} assets of {len(arrays['types'])} types -> {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bounded-queue asyncio pipeline used by generate_vary_m_n.py --pipeline async.
+
+Items flow through a chain of stages connected by asyncio queues of at most
+`queue_size` items, so a slow stage holds back the ones before it instead of
+letting work pile up in memory. A stage function may be a plain function, run
+on the event loop (for cheap steps), or a coroutine function, typically one
+awaiting a process or thread pool with loop.run_in_executor. Each stage runs
+`workers` copies of its loop, so as many items as that can be in flight in it.
+
+Stage.stats records the time each stage spent working, waiting for input and
+blocked on a full output queue; utilization is work time over the wall time
+available to its workers.
+"""
+
+import asyncio
+import inspect
+import time
+
+# Marks the end of a stage's input; each worker of the stage consumes one
+DONE = object()
+
+
+class StageStats:
+    def __init__(self):
+        self.items = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+
+
+class Stage:
+    """One pipeline step: `fn(item)` returns the item passed on to the next stage."""
+
+    def __init__(self, name, fn, workers=1):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.stats = StageStats()
+
+    async def apply(self, item):
+        result = self.fn(item)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+
+class Pipeline:
+    def __init__(self, stages, queue_size=8):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.wall = 0.0
+
+    async def run(self, items):
+        """Feed `items` through all stages; the results of the last stage are discarded."""
+        queues = [asyncio.Queue(self.queue_size) for stage in self.stages]
+        start = time.perf_counter()
+
+        async def feed():
+            for item in items:
+                await queues[0].put(item)
+            for _ in range(self.stages[0].workers):
+                await queues[0].put(DONE)
+
+        async def work(index):
+            stage = self.stages[index]
+            output = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                started = time.perf_counter()
+                item = await queues[index].get()
+                stage.stats.starved += time.perf_counter() - started
+                if item is DONE:
+                    return
+                started = time.perf_counter()
+                result = await stage.apply(item)
+                stage.stats.busy += time.perf_counter() - started
+                stage.stats.items += 1
+                if output is not None:
+                    started = time.perf_counter()
+                    await output.put(result)
+                    stage.stats.blocked += time.perf_counter() - started
+
+        async def run_stage(index):
+            await asyncio.gather(*(work(index) for _ in range(self.stages[index].workers)))
+            if index + 1 < len(queues):
+                for _ in range(self.stages[index + 1].workers):
+                    await queues[index + 1].put(DONE)
+
+        tasks = [asyncio.create_task(feed())] + [asyncio.create_task(run_stage(index)) for index in range(len(self.stages))]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            self.wall += time.perf_counter() - start
+
+    def utilization(self):
+        """Return {stage name: fraction of its workers' wall time spent working}."""
+        return {stage.name: stage.stats.busy / (self.wall * stage.workers) if self.wall else 0.0 for stage in self.stages}
+
+    def report(self):
+        lines = [f"pipeline: {self.wall:.2f}s wall, queue size {self.queue_size}"]
+        utilization = self.utilization()
+        for stage in self.stages:
+            stats = stage.stats
+            lines.append(
+                f"  {stage.name:<8} {stats.items:>6} items, {stage.workers} workers, busy {stats.busy:.2f}s ({utilization[stage.name]:.0%}), "
+                f"waiting for input {stats.starved:.2f}s, blocked on output {stats.blocked:.2f}s"
+            )
+        return '\n'.join(lines)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Parametric solver benchmark over n, m, domain size and fact variant.
+
+Fact sets are built from random scenes with the same code path as
+generate_vary_m_n.py, so every solver change can be measured offline.
+"""
+
+import argparse
+import json
+import platform
+import random
+import time
+from generate_vary_m_n import read_json_file, build_asset_mapping, build_boundingBox_mapping, generate_example_descriptions, build_variant_examples, discretize_positions, VARIANTS
+from solver import solve_all_candidates, solve_single_candidate, LatencyStats, SOLVER_BACKENDS
+
+ROOM_TYPES = ['Bedroom', 'LivingRoom', 'Kitchen', 'Bathroom']
+RELATION_CANDIDATES = ['north', 'south', 'east', 'west', 'north-west', 'north-east', 'south-west', 'south-east']
+
+
+def generate_random_scene(rng, asset_database, n):
+    """Generate a square room with n randomly placed assets, some of them sharing a type."""
+    room_dimensions = rng.choice([4.0, 5.0, 6.0, 7.0])
+    object_types = [object_type for object_type, candidates in asset_database.items() if candidates]
+    chosen_types = rng.sample(object_types, n)
+    # Repeat a few types so that numbered object names appear as in real scenes
+    for k in range(rng.randint(0, n // 2)):
+        chosen_types[-(k + 1)] = chosen_types[k]
+
+    objects = []
+    for object_type in chosen_types:
+        asset = rng.choice(asset_database[object_type])
+        objects.append({
+            'assetId': asset['assetId'],
+            'position': {'x': rng.uniform(0.1, room_dimensions - 0.1), 'y': 0.5, 'z': rng.uniform(0.1, room_dimensions - 0.1)},
+            'rotation': {'x': 0, 'y': rng.choice([0, 90, 180, 270]), 'z': 0},
+        })
+    return {
+        'rooms': [{'roomType': rng.choice(ROOM_TYPES)}],
+        'doors': [{'wall0': f'wall|0|0.00|0.00|{room_dimensions:.2f}|0.00'}],
+        'objects': objects,
+    }
+
+
+def generate_problems(rng, asset_database, asset_mapping, boundingBox_mapping, n, m, domain_size, samples):
+    """Return (variant, example) pairs for `samples` random scenes."""
+    problems = []
+    for sample in range(samples):
+        scene = generate_random_scene(rng, asset_database, n)
+        descriptions, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query, positions = generate_example_descriptions(scene, asset_mapping, boundingBox_mapping, n, m)
+        tests = build_variant_examples(sample, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query, discretize_positions(positions, domain_size))
+        problems.extend((variant, tests[variant]) for variant in VARIANTS)
+    return problems
+
+
+def benchmark_backend(problems, domain_size, options, yn_relations):
+    """Solve every problem with one backend; return latency stats and the answers."""
+    stats = LatencyStats()
+    answers = []
+    start_time = time.perf_counter()
+    for (variant, example), yn_relation in zip(problems, yn_relations):
+        t = time.perf_counter()
+        result, _ = solve_all_candidates(example, domain_size, **options)
+        elapsed = time.perf_counter() - t
+        stats.record('fr', elapsed)
+        stats.record(f'fr_{variant}', elapsed)
+
+        t = time.perf_counter()
+        answer, _ = solve_single_candidate(example, yn_relation, domain_size, **options)
+        stats.record('yn', time.perf_counter() - t)
+        answers.append((result, answer))
+    total_time = time.perf_counter() - start_time
+    return stats.summary(), answers, total_time
+
+
+def print_comparison(results, baseline_file):
+    """Print throughput ratios against a previous report."""
+    baseline = {
+        (r['backend'], r['n'], r['m'], tuple(r['domain_size'])): r
+        for r in read_json_file(baseline_file)['results']
+    }
+    for r in results:
+        key = (r['backend'], r['n'], r['m'], tuple(r['domain_size']))
+        if key in baseline:
+            speedup = r['throughput'] / baseline[key]['throughput']
+            print(f"{r['backend']:>20} n={r['n']} m={r['m']} d={r['domain_size']}: {speedup:.2f}x throughput, "
+                  f"p95 fr {baseline[key]['latency']['fr']['p95']:.4f}s -> {r['latency']['fr']['p95']:.4f}s")
+
+
+def main(args):
+    asset_database = read_json_file(args.asset_database)
+    asset_mapping = build_asset_mapping(asset_database)
+    boundingBox_mapping = build_boundingBox_mapping(asset_database)
+    domain_sizes = [tuple(d) for d in args.domain_size] if args.domain_size else [(8, 8), (12, 12)]
+    backends = args.backends or list(SOLVER_BACKENDS)
+
+    results = []
+    for domain_size in domain_sizes:
+        for n in args.n_range:
+            m_range = args.m_range or range(n - 1, n * (n - 1) // 2)
+            for m in m_range:
+                # Same problems and yes/no relations for every backend
+                rng = random.Random(f"{args.seed}_{n}_{m}_{domain_size[0]}x{domain_size[1]}")
+                problems = generate_problems(rng, asset_database, asset_mapping, boundingBox_mapping, n, m, domain_size, args.samples)
+                yn_relations = [rng.choice(RELATION_CANDIDATES) for _ in problems]
+
+                reference = None
+                for backend in backends:
+                    latency, answers, total_time = benchmark_backend(problems, domain_size, SOLVER_BACKENDS[backend], yn_relations)
+                    if reference is None:
+                        reference = answers
+                    mismatches = sum(a != b for a, b in zip(answers, reference))
+                    results.append({
+                        'backend': backend,
+                        'n': n,
+                        'm': m,
+                        'domain_size': list(domain_size),
+                        'problems': len(problems),
+                        'total_time': total_time,
+                        'throughput': len(problems) / total_time,
+                        'latency': latency,
+                        'mismatches': mismatches,
+                    })
+                    print(f"d={domain_size} n={n} m={m} {backend}: {len(problems) / total_time:.2f} problems/s, "
+                          f"p95 fr {latency['fr']['p95']:.4f}s, mismatches {mismatches}")
+
+    report = {
+        'config': {
+            'seed': args.seed,
+            'samples': args.samples,
+            'backends': backends,
+            'variants': VARIANTS,
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as outfile:
+        json.dump(report, outfile, indent=4)
+    print(f"Benchmark report written to '{args.output}'.")
+
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the spatial constraint solver.")
+    parser.add_argument('--n_range', type=int, nargs='+', default=[3, 4, 5], help="Numbers of objects to benchmark.")
+    parser.add_argument('--m_range', type=int, nargs='+', default=None, help="Numbers of object pairs (default: n-1 up to the largest m used by generate_vary_m_n.py).")
+    parser.add_argument('--domain_size', type=int, nargs=2, action='append', help="Domain size as two integers (repeatable, default: 8 8 and 12 12).")
+    parser.add_argument('--backends', type=str, nargs='+', choices=list(SOLVER_BACKENDS), default=None, help="Solver backends to run (default: all).")
+    parser.add_argument('--samples', type=int, default=5, help="Random scenes per (n, m, domain size) cell.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for scene generation.")
+    parser.add_argument('--asset_database', type=str, default='./databases/asset-database.json', help="Path of the asset database.")
+    parser.add_argument('--output', type=str, default='solver_benchmark.json', help="Path of the JSON report.")
+    parser.add_argument('--compare', type=str, default=None, help="Previous report to compare throughput against.")
+
+    args = parser.parse_args()
+    main(args)
@@ -8,13 +8,29 @@ Created on Thu Apr 18, 2024
 
 import json
 import os
+import time
+import fnmatch
 import re
 import random
-import inflect
 import argparse
 from pathlib import Path
 from collections import Counter
-from solver import solve_single_candidate, solve_all_candidates
+from typing import NamedTuple
+from solver import solve_single_candidate, solve_all_candidates, solve_any_candidate
+from replay_solver import WorkloadRecorder, WorkloadBuffer, make_record
+from sweep_scheduler import estimate_cell_costs, schedule_cells, SweepProgress
+from stream_output import JsonlWriter, CheckpointLog, read_checkpoint, truncate_outputs
+from results_store import ResultsStore, AGGREGATED_FILES
+from work_queue import WorkQueue, default_worker_id
+from stage_store import StageStore, stage_key
+from async_pipeline import Stage, Pipeline
+from scene_relations import SceneRelations
+from asset_index import AssetIndex, AssetTypes, AssetBoundingBoxes
+from lexicon import Lexicon
+import run_metrics
+from run_metrics import RunMetrics, stage_times, merge_times, enable_progress, example_done, enable_profiling, new_profile, merge_profiles, write_profile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import asyncio
 
 def read_json_file(file_path):
     """Read and return the content of a JSON file."""
@@ -40,8 +56,11 @@ def read_and_concatenate_json_files(directory, data_version):
             all_data.append(json.load(file))
     
     output_file.parent.mkdir(parents=True, exist_ok=True)
-    with output_file.open('w') as outfile:
+    # Write then rename, so shards starting together never read a partial file
+    tmp_file = output_file.with_name(f'{output_file.name}.{os.getpid()}.tmp')
+    with tmp_file.open('w') as outfile:
         json.dump(all_data, outfile, indent=4)
+    os.replace(tmp_file, output_file)
     
     print(f"Concatenation complete. Data written to '{output_file.name}'.")
 
@@ -61,10 +80,6 @@ def generate_abbreviation(direction):
     return abbreviation
 
 
-def number_to_word(number):
-    p = inflect.engine()
-    return p.number_to_words(number)
-
 def build_asset_mapping(asset_database):
     """Create a mapping from assetId to objectType."""
     return {
@@ -159,7 +174,8 @@ def get_room_connect(x, y, rx, ry, object_type, boundingBox, room_dimensions):
 
     
 def describe_object_room(item, asset_mapping, room_dimensions, object_ids, object_counts, object_ids_up, object_counts_up):
-    object_type = format_object_type(item.get('assetId'), asset_mapping)
+    words = get_lexicon(asset_mapping).entry(item.get('assetId'))
+    object_type = words.name
     position = item.get('position', {})
     x, z, y = position.get('x', 0), position.get('y', 0), position.get('z', 0)
 
@@ -180,7 +196,7 @@ def describe_object_room(item, asset_mapping, room_dimensions, object_ids, objec
     	object_name = f"{object_type} {object_counts_up[object_type]}"
     	if object_counts_up[object_type] == 1:
     	    #description = f"{object_counts[object_type] } {object_type}: "
-    	    description = f"some {object_type}s: "
+    	    description = f"some {words.plural}: "
     	else:
     	    description = ''
     	pos_text = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
@@ -188,7 +204,7 @@ def describe_object_room(item, asset_mapping, room_dimensions, object_ids, objec
     else:
         object_counts[object_type] = 1
         object_name = f"{object_type}"
-        article = 'an' if object_type[0] in 'aeiou' else 'a'
+        article = words.article
         # article = 'one'
         pos_text = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
         description += f"{article} {object_name} {pos_text}, "        
@@ -197,8 +213,59 @@ def describe_object_room(item, asset_mapping, room_dimensions, object_ids, objec
     return description, fact
 
 
+class ObjectClause(NamedTuple):
+    """What the room descriptions say about one object; rendered by render_object_clause."""
+    name: str
+    plural: str
+    article: str  # None for objects named with a number ("chair 2")
+    group_start: bool  # first object named with a number of its type, which opens "some chairs: "
+    spatial: str
+    tpp_text: str
+    painting: bool
+
+
+def render_object_clause(clause, variant):
+    """Text of an object in the 'object', 'layout' or 'tpp' summary, without its separator."""
+    if clause.article is None:
+        header = ''
+        if clause.group_start:
+            header = f"some {clause.plural} hanging on the wall: " if variant == 'tpp' and clause.painting else f"some {clause.plural}: "
+        if variant == 'object':
+            return f"{header}{clause.name}"
+        if variant == 'layout':
+            return f"{header}{clause.name} placed in the {clause.spatial}"
+        if clause.painting:
+            return f"{header}{clause.name} in the {clause.spatial} of the room"
+        return f"{header}{clause.name} placed in the {clause.spatial}, {clause.tpp_text}"
+
+    if variant == 'object':
+        return f"{clause.article} {clause.name}"
+    if variant == 'layout':
+        return f"{clause.article} {clause.name} placed in the {clause.spatial}"
+    if clause.painting:
+        return f"{clause.article} {clause.name} hanging on the wall, in the {clause.spatial} of the room"
+    return f"{clause.article} {clause.name} placed in the {clause.spatial}, {clause.tpp_text}"
+
+
+def clause_separator(clause, variant):
+    """
+    Separator after an object's clause: '; ' between tpp clauses, which contain commas
+    themselves, ', ' otherwise. As in the published datasets, numbered paintings are
+    followed by ', ' in the tpp summary too.
+    """
+    return '; ' if variant == 'tpp' and not (clause.article is None and clause.painting) else ', '
+
+
+def join_clauses(prefix, clauses, separators, last_and=False):
+    """`prefix` and the clauses, each followed by its separator and the last by a full stop; "and " before the last if `last_and`."""
+    if last_and and len(clauses) > 1:
+        clauses = clauses[:-1] + [f"and {clauses[-1]}"]
+    return prefix + ''.join(clause + separator for clause, separator in zip(clauses, separators[:-1] + ['.']))
+
+
 def describe_object_room_tpp(item, asset_mapping, boundingBox_mapping, room_dimensions, object_ids, object_counts, object_ids_up, object_counts_up):
-    object_type = format_object_type(item.get('assetId'), asset_mapping)
+    words = get_lexicon(asset_mapping).entry(item.get('assetId'))
+    object_type = words.name
     boundingBox = format_bounding_box(item.get('assetId'), boundingBox_mapping)
     position = item.get('position', {})
     x, z, y = position.get('x', 0), position.get('y', 0), position.get('z', 0)
@@ -213,9 +280,6 @@ def describe_object_room_tpp(item, asset_mapping, boundingBox_mapping, room_dime
     if len(spatial_fact) > 3:
         spatial_fact = spatial_fact[0].upper() + 'R'
         
-    pure_object_description = ''
-    description = ''
-    description_tpp = ''
     # Calculate TPP/NTPP
     connect = get_room_connect(x, y, rx, ry, object_type, boundingBox, room_dimensions)
     if connect == '':
@@ -225,97 +289,61 @@ def describe_object_room_tpp(item, asset_mapping, boundingBox_mapping, room_dime
         tpp_text = 'against the wall'
         tpp_fact = 'TPP'
     
-
-    
     # Generate the object name
     if object_counts[object_type] > 1:
-    	update_object_counts(object_type, object_ids_up, object_counts_up) 
-    	
-    	object_name = f"{object_type} {object_counts_up[object_type]}"
-    	if object_counts_up[object_type] == 1:
-            pure_object_description = f"some {object_type}s: "
-            description = f"some {object_type}s: "
-    	    #description = f"{object_counts[object_type] } {object_type}: "
-            if 'painting' in object_name: 
-                description_tpp = f"some {object_type}s hanging on the wall: "
-            else:
-                description_tpp = f"some {object_type}s: "
-    	else:
-    	    description_tpp = ''
-    	    description = ''
-    	    pure_object_description = ''
-            
-    	pos_text = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
-    	description += f"{object_name} {pos_text}, "
-    	pure_object_description += f"{object_name}, "
-        
-    	if 'painting' in object_name: 
-            pos_text_tpp = f"in the {spatial_description} of the room" #at coordinate ({x}, {y}, {z})
-            description_tpp += f"{object_name} {pos_text_tpp}, "
-    	else:
-            pos_text_tpp = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
-            description_tpp += f"{object_name} {pos_text_tpp}, {tpp_text}; "
+        update_object_counts(object_type, object_ids_up, object_counts_up) 
+        object_name = f"{object_type} {object_counts_up[object_type]}"
+        article = None
+        group_start = object_counts_up[object_type] == 1
     else:
         object_counts[object_type] = 1
         object_name = f"{object_type}"
-        article = 'an' if object_type[0] in 'aeiou' else 'a'
-        # article = 'one'
-        
-        pos_text = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
-        description += f"{article} {object_name} {pos_text}, "  
-        pure_object_description += f"{article} {object_name}, " 
-        
-        if 'painting' in object_name: 
-            pos_text_tpp = f"in the {spatial_description}"
-            description_tpp += f"{article} {object_name} hanging on the wall, {pos_text_tpp} of the room; " 
-        else:
-            pos_text_tpp = f"placed in the {spatial_description}" #at coordinate ({x}, {y}, {z})
-            description_tpp += f"{article} {object_name} {pos_text_tpp}, {tpp_text}; "        
+        article = words.article
+        group_start = False
+    clause = ObjectClause(object_name, words.plural, article, group_start, spatial_description, tpp_text, 'painting' in object_name)
+
     fact_direction = (object_name, spatial_fact, 'room')
     fact_object = (object_name, 'INR', 'room')
     fact_tpp = (object_name, tpp_fact, 'room')
-    return pure_object_description, fact_object, description, fact_direction, description_tpp, fact_tpp, 
+    return clause, fact_object, fact_direction, fact_tpp
 
 
 
 def describe_objects(objects, asset_mapping, boundingBox_mapping, room_dimensions):
+    lexicon = get_lexicon(asset_mapping)
     facts_object = []
     facts = []
     facts_tpp = []
+    clauses = []
     object_ids, object_counts = {}, {}  # Dictionary to store object counts
     object_ids_up, object_counts_up = {}, {}  # Dictionary to store object counts
 
     for obj in objects:
         # Count objects
-        object_type = format_object_type(obj.get('assetId'), asset_mapping)
+        object_type = lexicon.name(obj.get('assetId'))
         if object_type in object_counts:
             update_object_counts(object_type, object_ids, object_counts)
         else:
             update_object_counts(object_type, object_ids, object_counts)
     
-    summary_object_description = "This room contains a collection of furniture, including "
-    summary_layout_description = "This room contains a collection of furniture, including "
-    summary_layout_tpp_description = "This room contains a collection of furniture, including "
-    
     for obj in objects:
-        # Generate the detailed description for each object
-        pure_object_description, fact_object, object_description, fact_direction, object_description_tpp, fact_tpp = describe_object_room_tpp(obj, asset_mapping, boundingBox_mapping, room_dimensions, object_ids, object_counts, object_ids_up, object_counts_up)
-        
-        summary_object_description = summary_object_description + pure_object_description
-        summary_layout_description = summary_layout_description + object_description
-        summary_layout_tpp_description = summary_layout_tpp_description + object_description_tpp
-        
+        # Collect what to say about each object; the three summaries are rendered from these below
+        clause, fact_object, fact_direction, fact_tpp = describe_object_room_tpp(obj, asset_mapping, boundingBox_mapping, room_dimensions, object_ids, object_counts, object_ids_up, object_counts_up)
+        clauses.append(clause)
         facts_object.append(fact_object)      
         facts.append(fact_direction)
         facts_tpp.append(fact_tpp)
-        
-    summary_object_description = summary_object_description[:-2] +'.'
-    summary_layout_description = summary_layout_description[:-2] +'.'
-    summary_layout_tpp_description = summary_layout_tpp_description[:-2] +'.'
     
-    last_comma_index = summary_object_description.rfind(',')
-    if last_comma_index != -1:
-        summary_object_description = summary_object_description[:last_comma_index + 1] + ' and' + summary_object_description[last_comma_index + 1:]
+    prefix = "This room contains a collection of furniture, including "
+    summary_object_description, summary_layout_description, summary_layout_tpp_description = (
+        join_clauses(
+            prefix,
+            [render_object_clause(clause, variant) for clause in clauses],
+            [clause_separator(clause, variant) for clause in clauses],
+            last_and=variant == 'object',
+        )
+        for variant in ('object', 'layout', 'tpp')
+    )
         
     return summary_object_description, facts_object, summary_layout_description, facts, summary_layout_tpp_description, facts_tpp
 
@@ -391,9 +419,48 @@ def select_combinations(khop, object_list):
 
     return selected_combinations
 
-def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m):
-    """Generate descriptions for spatial relations between every two objects."""
-    descriptions, object_positions = {}, {}
+class PairRelation(NamedTuple):
+    """Relations of a selected object pair; distances are (text, fact) tuples."""
+    name1: str
+    name2: str
+    symbol: str
+    sd: str
+    td: str
+    distance_3: tuple
+    distance_2: tuple
+    distance_2_sd: tuple
+
+
+def group_pairs(pair_relations, key):
+    """Group pairs by `key`, in order of first appearance; returns [(first pair, [name2, ...])]."""
+    groups = {}
+    for p in pair_relations:
+        group = groups.setdefault(key(p), (p, []))
+        group[1].append(p.name2)
+    return list(groups.values())
+
+
+def capitalize_first(text):
+    return text[0].upper() + text[1:]
+
+
+def join_sentences(sentences, prefix=None):
+    """Join sentences with spaces, capitalized except the one right after `prefix`."""
+    if prefix is None:
+        return ' '.join(capitalize_first(sentence) for sentence in sentences)
+    return ' '.join([prefix] + sentences[:1] + [capitalize_first(sentence) for sentence in sentences[1:]])
+
+
+def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m, relations=None):
+    """
+    Generate descriptions for spatial relations between every two objects.
+
+    `relations` is the SceneRelations of `objects`, which is computed here if not given.
+    """
+    if relations is None:
+        relations = object_relations(objects, room_dimensions)
+    lexicon = get_lexicon(asset_mapping)
+    descriptions, object_positions, object_index = {}, {}, {}
     object_ids, object_counts = {}, {}
     facts =[]
     facts_d2 = []
@@ -401,11 +468,11 @@ def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m):
     query = []
     
     for obj in objects:
-        object_type = format_object_type(obj.get('assetId'), asset_mapping)
+        object_type = lexicon.name(obj.get('assetId'))
         object_counts[object_type] = object_counts.get(object_type, 0) + 1
             
-    for obj in objects:
-        object_type = format_object_type(obj.get('assetId'), asset_mapping)
+    for k, obj in enumerate(objects):
+        object_type = lexicon.name(obj.get('assetId'))
         if object_counts[object_type] > 1:
             object_ids[object_type] = object_ids.get(object_type, 0) + 1
             object_name = f"{object_type} {object_ids[object_type]}"
@@ -414,13 +481,8 @@ def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m):
 
         position = tuple(obj.get('position', {}).values())
         object_positions[object_name] = position
+        object_index[object_name] = k
 
-    relation_descriptions_sd = {}
-    relation_descriptions_td = {}
-    relation_descriptions_sd_d = {}
-    relation_descriptions_td_d = {}
-    
-    
     # Randomly choose a pair for the question if there are at least two objects
     object_items = list(object_positions.items())
     
@@ -428,146 +490,49 @@ def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m):
         obj1 = object_items[0]
         obj2 = object_items[-1]
         
-        question_fact = symbol_spatial_relationship(obj1[1], obj2[1])
-        answer_fr_config_sd = answer_spatial_relationship_sd(obj1[1], obj2[1])
-        answer_fr_config_td = analyze_spatial_relationship_td(obj1[1], obj2[1])     
+        pair = object_index[obj1[0]], object_index[obj2[0]]
+        question_fact = relations.symbol(*pair)
+        answer_fr_config_sd = relations.answer_sd(*pair)
+        answer_fr_config_td = relations.td(*pair)
 
     khop = m
 
-    all_combinations = [((obj_name1, pos1), (obj_name2, pos2)) 
-                        for i, (obj_name1, pos1) in enumerate(object_positions.items())
-                        for j, (obj_name2, pos2) in enumerate(object_positions.items())
-                        if i < j and not ((obj_name1 == obj1[0] and obj_name2 == obj2[0]) or (obj_name1 == obj2[0] and obj_name2 == obj1[0]))]
-
-
-    # Randomly select khop number of combinations
-    # selected_combinations = random.sample(all_combinations, khop)
-    
     # Convert the dictionary to a list of tuples
     object_list = list(object_positions.items())
-    
-    # Create the consecutive pairings
-    initial_combinations = [(object_list[i], object_list[i+1]) for i in range(len(object_list)-1)]
-    
-    # if khop == len(initial_combinations):
-    #     selected_combinations = initial_combinations    
     selected_combinations = select_combinations(khop, object_list)
-    # print(selected_combinations)
-    
-    for i in range(len(selected_combinations)):
-        (obj_name1, pos1), (obj_name2, pos2) = selected_combinations[i]
-
-        relation_facts = symbol_spatial_relationship(pos1, pos2)
-
-        
-        #sd
-        relation_sd = analyze_spatial_relationship_sd(pos1, pos2)
-        key_sd = (obj_name1, relation_sd, relation_facts)
-        if key_sd not in relation_descriptions_sd:
-            relation_descriptions_sd[key_sd] = []
-        relation_descriptions_sd[key_sd].append(obj_name2)
-        
-        #td
-        relation_td = analyze_spatial_relationship_td(pos1, pos2)
-        key_td = (obj_name1, relation_td, relation_facts)
-        if key_td not in relation_descriptions_td:
-            relation_descriptions_td[key_td] = []
-        relation_descriptions_td[key_td].append(obj_name2)                    
-
-        #sd_d
-        distance_3_relation_sd, distance_3_fact= get_distance_relation_3_sd(pos1, pos2, room_dimensions)  
-        distance_2_relation_sd, distance_2_fact = get_distance_relation_2_sd(pos1, pos2, room_dimensions) 
-        relation_sd = analyze_spatial_relationship_sd(pos1, pos2)
-        key_sd_d = (obj_name1, relation_sd, distance_3_relation_sd, distance_2_relation_sd, relation_facts, distance_3_fact, distance_2_fact)
-        if key_sd_d not in relation_descriptions_sd_d:
-            relation_descriptions_sd_d[key_sd_d] = []
-        relation_descriptions_sd_d[key_sd_d].append(obj_name2)
-
-        #td_d
-        distance_3_relation, distance_3_fact= get_distance_relation_3(pos1, pos2, room_dimensions)  
-        distance_2_relation, distance_2_fact = get_distance_relation_2(pos1, pos2, room_dimensions) 
-        relation_sd = analyze_spatial_relationship_sd(pos1, pos2)
-        key_td_d = (obj_name1, relation_td, distance_3_relation, distance_2_relation, relation_facts, distance_3_fact, distance_2_fact)
-        if key_td_d not in relation_descriptions_td_d:
-            relation_descriptions_td_d[key_td_d] = []
-        relation_descriptions_td_d[key_td_d].append(obj_name2)                    
-                    
     
-    # generate objects relations -- south door
-    relation_description_all_sd = "Imagine yourself at the southern wall's door, looking inwards. From this perspective,"
-    i = 0
-    for (obj_name1, relation_sd, relation_facts), obj_names2 in relation_descriptions_sd.items():
+    # One fragment per selected pair; every description variant below is rendered from them
+    pair_relations = []
+    for (obj_name1, pos1), (obj_name2, pos2) in selected_combinations:
+        pair = object_index[obj_name1], object_index[obj_name2]
+        pair_relations.append(PairRelation(
+            obj_name1, obj_name2, relations.symbol(*pair), relations.sd(*pair), relations.td(*pair),
+            relations.distance_relation_3(*pair), relations.distance_relation_2(*pair), relations.distance_relation_2_sd(*pair),
+        ))
+
+    # Pairs sharing the first object and relations are described in one sentence
+    groups_sd = group_pairs(pair_relations, lambda p: (p.name1, p.sd, p.symbol))
+    groups_td = group_pairs(pair_relations, lambda p: (p.name1, p.td, p.symbol))
+    groups_sd_d = group_pairs(pair_relations, lambda p: (p.name1, p.sd, p.distance_3, p.distance_2_sd, p.symbol))
+    groups_td_d = group_pairs(pair_relations, lambda p: (p.name1, p.td, p.distance_3, p.distance_2, p.symbol))
+
+    for p, obj_names2 in groups_sd:
         for obj_names2_each in obj_names2:
-            facts.append((obj_name1.replace('the ', ''), relation_facts, obj_names2_each.replace('the ', '')))
-        # obj_list = " and the ".join(obj_names2)
-        obj_list = " and ".join(obj_names2)
-        relation_description = f"{obj_name1} is {relation_sd} {obj_list}."
-        if i == 0:
-            relation_description_all_sd = relation_description_all_sd + ' ' + relation_description
-        else:
-            relation_description_all_sd = relation_description_all_sd + ' ' + relation_description[0].upper() + relation_description[1:]   
-        i += 1
-    
-    # generate objects relations -- top down
-    relation_description_all_td = "" 
-    i = 0
-    for (obj_name1, relation_td, relation_facts), obj_names2 in relation_descriptions_td.items():
-        # obj_list = " and the ".join(obj_names2)
-        obj_list = " and ".join(obj_names2)
-        relation_description = f"{obj_name1} is placed to the {relation_td} of {obj_list}."
-        if i == 0:
-            relation_description_all_td = relation_description[0].upper() + relation_description[1:]   
-        else:
-            relation_description_all_td = relation_description_all_td + ' ' + relation_description[0].upper() + relation_description[1:]   
-        i += 1
-        
-    # generate objects relations -- south door + distance
-    relation_description_all_sd_d2 = "Imagine yourself at the southern wall's door, looking inwards. From this perspective,"
-    relation_description_all_sd_d3 = "Imagine yourself at the southern wall's door, looking inwards. From this perspective,"
-    i = 0
-    for (obj_name1, relation_sd_d, distance_3_relation_sd, distance_2_relation_sd, relation_facts, distance_3_fact, distance_2_fact), obj_names2 in relation_descriptions_sd_d.items():
+            facts.append((p.name1.replace('the ', ''), p.symbol, obj_names2_each.replace('the ', '')))
+    for p, obj_names2 in groups_sd_d:
         for obj_names2_each in obj_names2:
-            facts_d2.append((obj_name1.replace('the ', ''), distance_2_fact, obj_names2_each.replace('the ', '')))
-            facts_d3.append((obj_name1.replace('the ', ''), distance_3_fact, obj_names2_each.replace('the ', '')))
-            
-        # obj_list = " and the ".join(obj_names2)
-        obj_list = " and ".join(obj_names2)
-        relation_d2_description = f"{obj_name1} is {relation_sd_d} {obj_list}, {distance_2_relation_sd}."
-        relation_d3_description = f"{obj_name1} is {relation_sd_d} {obj_list}, {distance_3_relation_sd}."
-        if i == 0:
-            relation_description_all_sd_d2 = relation_description_all_sd_d2 + ' ' + relation_d2_description
-            relation_description_all_sd_d3 = relation_description_all_sd_d3 + ' ' + relation_d3_description
-        else:
-            relation_description_all_sd_d2 = relation_description_all_sd_d2 + ' ' + relation_d2_description[0].upper() + relation_d2_description[1:]   
-            relation_description_all_sd_d3 = relation_description_all_sd_d3 + ' ' + relation_d3_description[0].upper() + relation_d3_description[1:]   
-        i += 1
-    
-    # generate objects relations -- top down + distance
-    relation_description_all_td_d2 = ""
-    relation_description_all_td_d3 = ""
-    i = 0
-    for (obj_name1, relation_td_d, distance_3_relation, distance_2_relation, relation_facts, distance_3_fact, distance_2_fact), obj_names2 in relation_descriptions_td_d.items():
-        # obj_list = " and the ".join(obj_names2)
-        obj_list = " and ".join(obj_names2)
-        relation_d2_description = f"{obj_name1} is placed to the {relation_td_d} of {obj_list}, {distance_2_relation}."
-        relation_d3_description = f"{obj_name1} is placed to the {relation_td_d} of {obj_list}, {distance_3_relation}."
-        if i == 0:
-            relation_description_all_td_d2 = relation_d2_description[0].upper() + relation_d2_description[1:]   
-            relation_description_all_td_d3 = relation_d3_description[0].upper() + relation_d3_description[1:]   
-        
-        else:
-            relation_description_all_td_d2 = relation_description_all_td_d2 + ' ' + relation_d2_description[0].upper() + relation_d2_description[1:]   
-            relation_description_all_td_d3 = relation_description_all_td_d3 + ' ' + relation_d3_description[0].upper() + relation_d3_description[1:]   
-        i += 1
-        
-          
-    descriptions['objects_td'] = relation_description_all_td      
-    descriptions['objects_sd'] = relation_description_all_sd
+            facts_d2.append((p.name1.replace('the ', ''), p.distance_2_sd[1], obj_names2_each.replace('the ', '')))
+            facts_d3.append((p.name1.replace('the ', ''), p.distance_3[1], obj_names2_each.replace('the ', '')))
+
+    # generate objects relations -- south door and top down, without and with distances
+    south_door = "Imagine yourself at the southern wall's door, looking inwards. From this perspective,"
+    descriptions['objects_td'] = join_sentences([f"{p.name1} is placed to the {p.td} of {' and '.join(names)}." for p, names in groups_td])
+    descriptions['objects_sd'] = join_sentences([f"{p.name1} is {p.sd} {' and '.join(names)}." for p, names in groups_sd], south_door)
     
-    descriptions['objects_td_d2'] = relation_description_all_td_d2 
-    descriptions['objects_sd_d2'] = relation_description_all_sd_d2    
-    descriptions['objects_td_d3'] = relation_description_all_td_d3      
-    descriptions['objects_sd_d3'] = relation_description_all_sd_d3  
+    descriptions['objects_td_d2'] = join_sentences([f"{p.name1} is placed to the {p.td} of {' and '.join(names)}, {p.distance_2[0]}." for p, names in groups_td_d])
+    descriptions['objects_sd_d2'] = join_sentences([f"{p.name1} is {p.sd} {' and '.join(names)}, {p.distance_2_sd[0]}." for p, names in groups_sd_d], south_door)
+    descriptions['objects_td_d3'] = join_sentences([f"{p.name1} is placed to the {p.td} of {' and '.join(names)}, {p.distance_3[0]}." for p, names in groups_td_d])
+    descriptions['objects_sd_d3'] = join_sentences([f"{p.name1} is {p.sd} {' and '.join(names)}, {p.distance_3[0]}." for p, names in groups_sd_d], south_door)
     
     descriptions['image_fr_o2_sd'] = answer_fr_config_sd
     descriptions['image_fr_o2_td'] = answer_fr_config_td
@@ -577,20 +542,20 @@ def describe_two_objects_relations(objects, room_dimensions, asset_mapping, m):
     
     return descriptions, facts, facts_d2, facts_d3, query 
 
-# Helper functions
-def format_object_type(asset_id, asset_mapping):
-    """Format object type from assetId."""
-    exceptions = {'tvstand': 'TV stand', 'cd': 'CD', 'tabletopdecor': 'tabletop decor'}  # Add more exceptions if needed
+def object_relations(objects, room_dimensions):
+    """Pairwise relations of `objects` in the order of the list (see scene_relations.py)."""
+    return SceneRelations([tuple(obj.get('position', {}).values()) for obj in objects], room_dimensions)
 
-    object_type = asset_mapping.get(asset_id, asset_id)
-
-    # Check if object_type is in exceptions
-    if object_type.lower() in exceptions:
-        return exceptions[object_type.lower()]
-    else:
-        # Split object_type using regular expressions and add spaces
-        words = re.findall('[A-Z][a-z]*', object_type)
-        return ' '.join(words).lower()
+# Helper functions
+# Lexicons of the asset mappings in use, each built once (see lexicon.py)
+lexicons = {}
+
+def get_lexicon(asset_mapping):
+    key = id(asset_mapping)
+    if key not in lexicons:
+        # The mapping is kept alongside, so its id cannot be reused by another object
+        lexicons[key] = (asset_mapping, Lexicon(asset_mapping))
+    return lexicons[key][1]
     
 def format_bounding_box(asset_id, boundingBox_mapping):
     """Format object type from assetId."""
@@ -617,679 +582,883 @@ def abbreviate_direction(direction):
     abbreviation = ''.join(part[0].upper() for part in parts)
     return abbreviation
 
-def analyze_spatial_relationship_sd(pos1, pos2):
+def build_example_context(example, asset_mapping, boundingBox_mapping, n):
     """
-    For generating stor
+    Build the m-independent part of an example's descriptions and facts.
+
+    Returns None if the example has fewer than n objects.
     """
-    x1, y1, z1 = pos1
-    x2, y2, z2 = pos2
-
-    horizontal_relation = ""
-    if x1 < x2:
-        horizontal_relation = "to the left of"
-    elif x1 > x2:
-        horizontal_relation = "to the right of"
-
-    vertical_relation = ""
-    if z1 < z2:
-        vertical_relation = "behind"
-    elif z1 > z2:
-        vertical_relation = "in front of" #"front" typically refers to the direction you are facing
-
-    if horizontal_relation and vertical_relation:
-        return f"{vertical_relation} and {horizontal_relation}"
-    elif horizontal_relation or vertical_relation:
-        return horizontal_relation if horizontal_relation else vertical_relation
-    else:
-        return "at the same position"
+    descriptions = {}
+
+    # Describe rooms, doors, walls, and windows
+    for room in example.get('rooms', []):
+        descriptions['room'] = describe_room(room)
+
+    # Extract maximum dimensions for the room
+    parts = example.get('doors', [])[0]["wall0"].split('|')
+    room_dimensions = max([float(part) for part in parts[-4:]])
+
+    # Describe objects
+    objects_all = list(example.get('objects', []))  # sorted below; the example itself is left untouched
+    objects = []
+    object_ids, object_counts = {}, {}  # Dictionary to store object counts
     
-def analyze_spatial_relationship_td(pos1, pos2):
-    """
-    For generating stor
-    """
-    x1, y1, z1 = pos1
-    x2, y2, z2 = pos2
-
-    horizontal_relation = ""
-    if x1 < x2:
-        horizontal_relation = "west"
-    elif x1 > x2:
-        horizontal_relation = "east"
-
-    vertical_relation = ""
-    if z1 < z2:
-        vertical_relation = "south"
-    elif z1 > z2:
-        vertical_relation = "north" #"front" typically refers to the direction you are facing
-
-    if horizontal_relation and vertical_relation:
-        return f"{vertical_relation}-{horizontal_relation}"
-    elif horizontal_relation or vertical_relation:
-        return horizontal_relation if horizontal_relation else vertical_relation
-    else:
-        return "at the same position"
+    lexicon = get_lexicon(asset_mapping)
+    for obj in objects_all:
+        # Count objects
+        object_type = lexicon.name(obj.get('assetId'))
+        if object_type in object_counts:
+            update_object_counts(object_type, object_ids, object_counts)
+        else:
+            update_object_counts(object_type, object_ids, object_counts)
+    
+    objects_all.sort(key=lambda obj: object_counts[lexicon.name(obj.get('assetId'))])
+
+    if len(objects_all) < n:
+        return None
+
+    # objects = random.sample(objects_all, n)
+    objects = objects_all[:n]
+    objects.sort(key=lambda obj: object_counts[lexicon.name(obj.get('assetId'))])
+    object_descriptions, object_facts, object_room_relations_descriptions, object_room_facts, object_room_relations_descriptions_tpp, object_room_facts_tpp = describe_objects(objects, asset_mapping, boundingBox_mapping, room_dimensions)
 
+    descriptions['object'] = object_descriptions
+    descriptions['object_room'] = object_room_relations_descriptions
+    descriptions['object_room_tpp'] = object_room_relations_descriptions_tpp
 
-def answer_spatial_relationship_sd(pos1, pos2):
+    # Ground-truth positions as fractions of the room, keyed by fact name
+    positions = {fact[0]: (obj['position']['x'] / room_dimensions, obj['position']['z'] / room_dimensions)
+                 for fact, obj in zip(object_facts, objects)}
+
+    return {
+        'descriptions': descriptions,
+        'objects': objects,
+        'room_dimensions': room_dimensions,
+        'facts_object': object_facts,
+        'facts_layout': object_room_facts,
+        'facts_tpp': object_room_facts_tpp,
+        'positions': positions,
+        'relations': object_relations(objects, room_dimensions),
+    }
+
+
+# Contexts of recently processed (example_id, n), shared by the m values handled in this process
+EXAMPLE_CONTEXT_CACHE_SIZE = 10000
+example_contexts = {}
+
+def get_example_context(example_id, example, asset_mapping, boundingBox_mapping, n):
+    """Return the cached context of (example_id, n), building it on first use."""
+    key = (example_id, n)
+    if key not in example_contexts:
+        if len(example_contexts) >= EXAMPLE_CONTEXT_CACHE_SIZE:
+            del example_contexts[next(iter(example_contexts))]
+        example_contexts[key] = build_example_context(example, asset_mapping, boundingBox_mapping, n)
+    return example_contexts[key]
+
+# Solver answers of recently processed (example_id, n), reused across m (see solve_example)
+solver_memos = {}
+
+def get_solver_memo(example_id, n):
+    key = (example_id, n)
+    if key not in solver_memos:
+        if len(solver_memos) >= EXAMPLE_CONTEXT_CACHE_SIZE:
+            del solver_memos[next(iter(solver_memos))]
+        solver_memos[key] = {}
+    return solver_memos[key]
+
+# Digests of the examples and asset mappings seen by this process, and its open stage caches
+example_digests = {}
+asset_digests = {}
+stage_stores = {}
+
+def example_digest(example_id, example):
+    if example_id not in example_digests:
+        example_digests[example_id] = stage_key(example)
+    return example_digests[example_id]
+
+def asset_digest(asset_mapping):
+    key = id(asset_mapping)
+    if key not in asset_digests:
+        # Mappings read from the asset index stand for the database signature, others for their content
+        digest = asset_mapping.index.signature() if isinstance(asset_mapping, AssetTypes) else stage_key(dict(asset_mapping))
+        asset_digests[key] = (asset_mapping, digest)
+    return asset_digests[key][1]
+
+def get_stage_store(path):
+    if path not in stage_stores:
+        stage_stores[path] = StageStore(path)
+    return stage_stores[path]
+
+
+def generate_example_descriptions(example, asset_mapping, boundingBox_mapping, n, m, context=None):
+    """Generate descriptions for all components in an example, including spatial relations between objects."""
+    if context is None:
+        context = build_example_context(example, asset_mapping, boundingBox_mapping, n)
+    if context is None:
+        return '', '', '', '', '', '', '', '', ''
+
+    descriptions = dict(context['descriptions'])
+    objects_relations_descriptions, facts_o2, facts_d2, facts_d3, query = describe_two_objects_relations(context['objects'], context['room_dimensions'], asset_mapping, m, context['relations'])
+    descriptions.update(objects_relations_descriptions)
+
+    return descriptions, list(context['facts_object']), list(context['facts_layout']), list(context['facts_tpp']), facts_o2, facts_d2, facts_d3, query, context['positions']
+    
+
+def discretize_positions(positions, domain_size):
+    """Map room-fraction positions onto the solver grid."""
+    return {
+        name: (min(int(fx * domain_size[0]), domain_size[0] - 1), min(int(fy * domain_size[1]), domain_size[1] - 1))
+        for name, (fx, fy) in positions.items()
+    }
+    
+
+# Fact variants solved for each example (all of them unless --variants/--outputs select fewer), in the order used by the answers/times lists
+VARIANTS = ['layout', 'layout_tpp', 'o2', 'o2_d2', 'o2_d3', 'layout_o2', 'layout_o2_d2', 'layout_o2_d3']
+# Variants whose facts and query do not depend on m
+M_INDEPENDENT_VARIANTS = ('layout', 'layout_tpp')
+
+def variant_fact_lists(facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3):
+    """Facts of every fact variant."""
+    return {
+        'layout': facts_object + facts_layout,
+        'layout_tpp': facts_object + facts_layout + facts_tpp,
+        'o2': facts_object + facts_o2,
+        'o2_d2': facts_object + facts_o2 + facts_d2,
+        'o2_d3': facts_object + facts_o2 + facts_d3,
+        'layout_o2': facts_object + facts_layout + facts_o2,
+        'layout_o2_d2': facts_object + facts_layout + facts_o2 + facts_d2,
+        'layout_o2_d3': facts_object + facts_layout + facts_o2 + facts_d3,
+    }
+
+def build_variant_examples(example_id, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query, positions=None):
+    """Build the solver example dict of every fact variant."""
+    variant_facts = variant_fact_lists(facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3)
+    return {
+        variant: {'example_id': example_id, 'facts': facts, 'query': query, 'positions': positions}
+        for variant, facts in variant_facts.items()
+    }
+
+
+# Solver answer keys of the descriptions: (key, variant, view of the relation names)
+SOLVER_FR_KEYS = [
+    ('solver_fr_layout', 'layout', 'td'),
+    ('solver_fr_layout_tpp', 'layout_tpp', 'td'),
+    ('solver_fr_o2_td', 'o2', 'td'),
+    ('solver_fr_o2_sd', 'o2', 'sd'),
+    ('solver_fr_o2_d2', 'o2_d2', 'td'),
+    ('solver_fr_o2_d2_sd', 'o2_d2', 'sd'),
+    ('solver_fr_o2_d3', 'o2_d3', 'td'),
+    ('solver_fr_o2_d3_sd', 'o2_d3', 'sd'),
+    ('solver_fr_layout_o2', 'layout_o2', 'td'),
+    ('solver_fr_layout_o2_sd', 'layout_o2', 'sd'),
+    ('solver_fr_layout_o2_d2', 'layout_o2_d2', 'td'),
+    ('solver_fr_layout_o2_d2_sd', 'layout_o2_d2', 'sd'),
+    ('solver_fr_layout_o2_d3', 'layout_o2_d3', 'td'),
+    ('solver_fr_layout_o2_d3_sd', 'layout_o2_d3', 'sd'),
+]
+
+# Answer keys of the yes/no question asked of every variant
+ANSWER_YN_KEYS = [
+    ('answer_yn_uni_layout', 'layout'),
+    ('answer_yn_uni_layout_tpp', 'layout_tpp'),
+    ('answer_yn_uni_o2_td', 'o2'),
+    ('answer_yn_uni_o2_d2', 'o2_d2'),
+    ('answer_yn_uni_o2_d3', 'o2_d3'),
+    ('answer_yn_uni_layout_o2_td', 'layout_o2'),
+    ('answer_yn_uni_layout_o2_d2', 'layout_o2_d2'),
+    ('answer_yn_uni_layout_o2_d3', 'layout_o2_d3'),
+]
+
+# Questions comparing variants: the variants each one needs and the keys it writes
+COMPARISONS = {
+    'layout_tpp': (['layout', 'layout_tpp'], ['question_yn_layout', 'answer_yn_layout', 'answer_yn_layout_tpp']),
+    'd2': (['o2', 'o2_d2'], ['question_use_d2', 'question_use_d2_sd', 'answer_use_d2', 'answer_use_d2_sd', 'answer_without_use_d2', 'answer_without_use_d2_sd']),
+    'd3': (['o2', 'o2_d3'], ['question_use_d3', 'question_use_d3_sd', 'answer_use_d3', 'answer_use_d3_sd', 'answer_without_use_d3', 'answer_without_use_d3_sd']),
+    'layout_o2': (['layout', 'o2', 'layout_o2'], [
+        'question_use_layout_o2', 'question_use_layout_o2_sd', 'answer_use_layout_o2', 'answer_use_layout_o2_sd',
+        'answer_with_layout_without_o2', 'answer_with_layout_without_o2_sd', 'answer_without_layout_with_o2', 'answer_without_layout_with_o2_sd',
+    ]),
+    'layout_o2_d2': (['layout', 'o2_d2', 'layout_o2_d2'], [
+        'question_use_layout_o2_d2', 'question_use_layout_o2_d2_sd', 'answer_use_layout_o2_d2', 'answer_use_layout_o2_d2_sd',
+        'answer_without_layout_with_o2_d2', 'answer_without_layout_with_o2_d2_sd', 'answer_with_layout_without_o2_d2', 'answer_with_layout_without_o2_d2_sd',
+    ]),
+    'layout_o2_d3': (['layout', 'o2_d3', 'layout_o2_d3'], [
+        'question_use_layout_o2_d3', 'question_use_layout_o2_d3_sd', 'answer_use_layout_o2_d3', 'answer_use_layout_o2_d3_sd',
+        'answer_without_layout_with_o2_d3', 'answer_without_layout_with_o2_d3_sd', 'answer_with_layout_without_o2_d3', 'answer_with_layout_without_o2_d3_sd',
+    ]),
+}
+
+def build_output_variants():
+    """Output key -> variants whose solver results it needs; keys not listed (scene descriptions, questions) need none."""
+    output_variants = {}
+    for variant in VARIANTS:
+        for key in (f'facts_{variant}', f'solver_fr_{variant}', f'answers_length_{variant}', f'time_{variant}', f'time_{variant}_yn'):
+            output_variants[key] = {variant}
+    # As in the published datasets, answers_length_layout_o2 holds the number of o2 answers
+    output_variants['answers_length_layout_o2'] = {'o2', 'layout_o2'}
+    for key, variant, view in SOLVER_FR_KEYS:
+        output_variants[key] = {variant}
+    for key, variant in ANSWER_YN_KEYS:
+        output_variants[key] = {variant}
+    for variants, keys in COMPARISONS.values():
+        for key in keys:
+            output_variants[key] = set(variants)
+    return output_variants
+
+OUTPUT_VARIANTS = build_output_variants()
+
+def output_selected(key, outputs):
+    return outputs is None or any(fnmatch.fnmatchcase(key, pattern) for pattern in outputs)
+
+def select_variants(variants=None, outputs=None):
+    """Variants to solve, in VARIANTS order: `variants`, else those the `outputs` patterns need, else all."""
+    if variants:
+        needed = set(variants)
+    elif outputs:
+        needed = set().union(*(needed for key, needed in OUTPUT_VARIANTS.items() if output_selected(key, outputs)))
+    else:
+        return VARIANTS
+    return [variant for variant in VARIANTS if variant in needed]
+
+def variant_values(values, variants):
     """
-    For generating stor
+    Per-variant values of an example in the aggregated outputs: a list in VARIANTS order
+    when all variants are solved, else {variant: value} of the solved `variants` only.
     """
-    x1, y1, z1 = pos1
-    x2, y2, z2 = pos2
-
-    horizontal_relation = ""
-    if x1 < x2:
-        horizontal_relation = "left"
-    elif x1 > x2:
-        horizontal_relation = "right"
-
-    vertical_relation = ""
-    if z1 < z2:
-        vertical_relation = "behind"
-    elif z1 > z2:
-        vertical_relation = "front" #"front" typically refers to the direction you are facing
-
-    if horizontal_relation and vertical_relation:
-        return f"{vertical_relation}-{horizontal_relation}"
-    elif horizontal_relation or vertical_relation:
-        return horizontal_relation if horizontal_relation else vertical_relation
-    else:
-        return "at the same position"
+    if variants == VARIANTS:
+        return [values[variant] for variant in VARIANTS]
+    return {variant: values[variant] for variant in variants}
+
+def select_outputs(record, outputs):
+    """`record` without the keys that match none of the `outputs` patterns; example_id is always kept."""
+    if outputs is None:
+        return record
+    return {key: value for key, value in record.items() if key == 'example_id' or output_selected(key, outputs)}
+
+
+def example_rng(seed, example_id, n, m):
+    """Random stream of one example, independent of processing order and worker count."""
+    return random.Random(f"{seed}_{example_id}_{n}_{m}")
+
+
+# Bump a stage's version when its code changes; its stored outputs and those of later stages are then recomputed
+FACTS_STAGE_VERSION = 2
+SOLVE_STAGE_VERSION = 2
+
+# Relations asked about by the yes/no questions
+YN_RELATION_CANDIDATES = ['north', 'south', 'east', 'west','north-west', 'north-east', 'south-west', 'south-east']
+
+# Fact lists and query of a facts stage output, in build_variant_examples order
+FACT_FIELDS = ['facts_object', 'facts_layout', 'facts_tpp', 'facts_o2', 'facts_d2', 'facts_d3', 'query']
+
+def build_example_facts(i, example, asset_mapping, boundingBox_mapping, n, m):
+    """Stage 1: scene -> base descriptions, facts of every kind, the query and room-fraction positions."""
+    context = get_example_context(i, example, asset_mapping, boundingBox_mapping, n)
+    descriptions, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query, positions = generate_example_descriptions(example, asset_mapping, boundingBox_mapping, n, m, context)
+    if not descriptions:
+        return {'skipped': True}
+    facts = {'skipped': False, 'descriptions': descriptions}
+    facts.update(zip(FACT_FIELDS, [facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query]))
+    facts['positions'] = positions
+    return facts
+
+def restore_fact_tuples(facts):
+    """Turn the fact triples, query and positions of a stored facts stage output back into tuples."""
+    if facts['skipped']:
+        return facts
+    for field in FACT_FIELDS:
+        facts[field] = [tuple(fact) for fact in facts[field]]
+    facts['positions'] = {obj: tuple(position) for obj, position in facts['positions'].items()}
+    return facts
+
+
+def probe_variants(tests, memo, m, domain_size, solver_options, options_key, variants):
+    """
+    Check that each of the `variants` has a feasible relation, those with the fewest facts first.
 
+    Returns (the first variant without one, or None; {variant: (relation found feasible, probe time)}).
+    Results memoized for the example are used instead of probing where they settle the question.
+    """
+    probes = {}
+    for variant in sorted(variants, key=lambda variant: len(tests[variant]['facts'])):
+        if variant in M_INDEPENDENT_VARIANTS and ('fr', variant, options_key) in memo:
+            if not memo['fr', variant, options_key][0]:
+                return variant, probes
+            continue
+        # No relation feasible for a smaller m stays feasible with its facts extended
+        feasible = memo.get(('fr_feasible', variant, options_key))
+        if feasible and feasible[0] <= m and not feasible[1]:
+            return variant, probes
+        with stage_times.timer('probe'):
+            relation, probe_time = solve_any_candidate(tests[variant], domain_size, **solver_options)
+        probes[variant] = relation, probe_time
+        if relation is None:
+            if variant in M_INDEPENDENT_VARIANTS:
+                memo['fr', variant, options_key] = [], probe_time
+            else:
+                memo['fr_feasible', variant, options_key] = m, []
+            return variant, probes
+    return None, probes
 
-def get_distance_relation_3(pos1, pos2, room_dimensions):
-    # Calculate Euclidean distance between two objects
-    x1, _, z1 = pos1
-    x2, _, z2 = pos2
 
-    # Calculate Euclidean distance between two objects on the x-z plane
-    distance = ((x1 - x2)**2 + (z1 - z2)**2)**0.5
+def solve_example(i, facts, n, m, domain_size, solver_options, relation_uni, record_workload=False, variants=VARIANTS, early_abort=False, reuse_feasible=False):
+    """
+    Stage 2: facts -> feasible relations of the `variants`, and solver times of the fr and yn questions.
 
-    # Max distance as the diagonal of the room on the x-z plane
-    max_distance = (room_dimensions**2 + room_dimensions**2)**0.5
-    # max_distance = room_dimensions
+    With `early_abort`, a single solve per variant first checks that the example will be valid;
+    at the first variant without feasible relations nothing else is solved and solved['dropped']
+    names that variant. Probe times are kept apart from the solve times, in solved['times_probe'].
+    With `reuse_feasible`, the fr questions only re-check the relations still feasible at the
+    largest smaller m solved in this process, so their times are those of the narrowed solves.
+    """
+    tests = build_variant_examples(i, *(facts[field] for field in FACT_FIELDS), discretize_positions(facts['positions'], domain_size))
+    memo = get_solver_memo(i, n)
+    solved = {'results': {}, 'times': {}, 'times_yn': {}, 'records': []}
+    options_key = (domain_size, tuple(sorted(solver_options.items())))
+    probes = {}
+    if early_abort:
+        dropped, probes = probe_variants(tests, memo, m, domain_size, solver_options, options_key, variants)
+        solved['times_probe'] = {variant: probe_time for variant, (relation, probe_time) in probes.items()}
+        if record_workload:
+            for variant, (relation, probe_time) in probes.items():
+                solved['records'].append(make_record('probe', variant, tests[variant], n, m, domain_size, solver_options, relation, probe_time))
+        if dropped:
+            solved['dropped'] = dropped
+            return solved
+    for variant in variants:
+        if variant in M_INDEPENDENT_VARIANTS and ('fr', variant, options_key) in memo:
+            solved['results'][variant], solved['times'][variant] = memo['fr', variant, options_key]
+            continue
+        # Facts for m extend those for any smaller m, so only relations still feasible there need re-checking
+        feasible = memo.get(('fr_feasible', variant, options_key))
+        candidates = feasible[1] if reuse_feasible and feasible and feasible[0] <= m else None
+        # The relation found by the validity probe is not solved again
+        relation, probe_time = probes.get(variant, (None, 0.0))
+        with stage_times.timer(f'solve_{variant}'):
+            solved['results'][variant], solved['times'][variant] = solve_all_candidates(tests[variant], domain_size, candidates=candidates, feasible=[relation] if relation else (), **solver_options)
+        if variant in M_INDEPENDENT_VARIANTS:
+            memo['fr', variant, options_key] = solved['results'][variant], solved['times'][variant]
+        else:
+            memo['fr_feasible', variant, options_key] = m, solved['results'][variant]
+        if record_workload:
+            # The probe is recorded on its own; this record is the restricted solve alone
+            solved['records'].append(make_record('fr', variant, tests[variant], n, m, domain_size, solver_options, solved['results'][variant], solved['times'][variant], candidates=candidates, feasible=[relation] if relation else ()))
+
+    for variant in variants:
+        if variant in M_INDEPENDENT_VARIANTS and ('yn', variant, relation_uni, options_key) in memo:
+            answer_yn, solved['times_yn'][variant] = memo['yn', variant, relation_uni, options_key]
+            continue
+        with stage_times.timer(f'solve_{variant}_yn'):
+            answer_yn, solved['times_yn'][variant] = solve_single_candidate(tests[variant], relation_uni, domain_size, **solver_options)
+        if variant in M_INDEPENDENT_VARIANTS:
+            memo['yn', variant, relation_uni, options_key] = answer_yn, solved['times_yn'][variant]
+        if record_workload:
+            solved['records'].append(make_record('yn', variant, tests[variant], n, m, domain_size, solver_options, answer_yn, solved['times_yn'][variant], relation_uni))
+    return solved
 
-    # Determine the thresholds for 'close', 'medium', and 'far'
-    close_threshold = max_distance / 3
-    medium_threshold = 2 * max_distance / 3
 
-    if distance <= close_threshold:
-        return "at a short distance", "CL3"  #, at a short distance , closely situated  , very close  , nearby
-    elif close_threshold < distance <= medium_threshold:
-        return "at a moderate distance", "MD3"
-    elif distance > medium_threshold:
-        # print(distance, close_threshold, medium_threshold)
-        return "at a far distance", "FR3"
+# Relation names of the solver answers ('N', 'NE', ...) in the top-down (td) and south-door (sd) views
+RELATION_NAMES = {
+    'td': {'N': 'north', 'S': 'south', 'E': 'east', 'W': 'west', 'O': 'overlap'},
+    'sd': {'N': 'front', 'S': 'behind', 'E': 'right', 'W': 'left', 'O': 'overlap'},
+}
 
+def relation_names(result, conversion):
+    return [conversion[k] if len(k) == 1 else f"{conversion[k[0]]}-{conversion[k[1]]}" for k in result]
 
-def get_distance_relation_2(pos1, pos2, room_dimensions):
-    # Calculate Euclidean distance between two objects
-    x1, _, z1 = pos1
-    x2, _, z2 = pos2
 
-    # Calculate Euclidean distance between two objects on the x-z plane
-    distance = ((x1 - x2)**2 + (z1 - z2)**2)**0.5
+def render_example(i, facts, solved, relation_uni, rng, variants=VARIANTS, outputs=None):
+    """
+    Stage 3: facts and solver results -> questions, answers and the Text/Logic records of one example.
 
-    # Max distance as the diagonal of the room on the x-z plane
-    # max_distance = (room_dimensions**2 + room_dimensions**2)**0.5
-    max_distance = room_dimensions
+    Only keys of the solved `variants` are written, and of those only the ones matching
+    the `outputs` patterns. Questions comparing variants that were not all solved are
+    not asked, so later questions of the example draw different random relations than
+    in a run of all variants.
+    """
+    result = {'example_id': i, 'skipped': False, 'valid': False, 'descriptions': None, 'facts': None, 'records': solved.get('records', []), 'timings': {}}
+    if solved.get('dropped'):
+        # Dropped by the validity probes of solve_example: only the probes ran, and the example is listed in dropped_id
+        result['skipped'] = True
+        result['dropped'] = solved['dropped']
+        return result
+    selected = set(variants)
+    results = solved['results']
+
+    descriptions = dict(facts['descriptions'])
+    facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query = (facts[field] for field in FACT_FIELDS)
+
+    restory = not all(len(results[variant]) > 0 for variant in variants)
+
+    result['valid'] = descriptions and restory == False
+    if descriptions:  # Check if descriptions is not empty
+        result['answers_length'] = variant_values({variant: len(results[variant]) for variant in variants}, variants)
+        result['times'] = variant_values(solved['times'], variants)
+
+        relation_candidates = YN_RELATION_CANDIDATES
+        names = {(variant, view): relation_names(results[variant], RELATION_NAMES[view]) for key, variant, view in SOLVER_FR_KEYS if variant in selected}
+        # The layout answers are left out when o2 has none
+        if 'layout' in selected and 'o2' in selected and len(results['o2']) == 0:
+            names['layout', 'td'] = []
+        descriptions['question_fr'] = f"Where is the {query[0][0]} positioned in relation to the {query[0][2]}?"                
+        for key, variant, view in SOLVER_FR_KEYS:
+            if variant in selected:
+                descriptions[key] = names[variant, view]
+
+        replacements = {
+            'north-east': 'in front of and to the right of',
+            'east': 'to the right of',
+            'west': 'to the left of',
+            'north-west': 'in front of and to the left of',
+            'south-east': 'behind and to the right of',
+            'south-west': 'behind and to the left of',
+            'north': 'in front of',
+            'south': 'behind'
+        }
 
-    # Determine the thresholds for 'close', 'medium', and 'far'
-    close_threshold = max_distance / 2
+        descriptions['question_yn_uni'] = f"Could the {query[0][0]} be placed to the {relation_uni} of the {query[0][2]}?" if relation_uni != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
+        descriptions['question_yn_uni_sd'] = f"Could the {query[0][0]} be positioned {replacements[relation_uni]} of the {query[0][2]}?" if relation_uni != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
+        for key, variant in ANSWER_YN_KEYS:
+            if variant in selected:
+                descriptions[key] = "Yes" if relation_uni in names[variant, 'td'] else "No"
 
-    # Determine the distance relation
-    if distance < close_threshold:
-        return "at a short distance", "CL2"  #, at a short distance , closely situated  , very close  , nearby
-    elif distance >= close_threshold:
-        return "at a far distance", "FR2" # , at a far distance.
-    
+        query_yn_uni_logic = [(query[0][0], abbreviate_direction(relation_uni) ,query[0][2])]
 
+        result['times_yn'] = variant_values(solved['times_yn'], variants)
 
+        results_list_layout, results_list_layout_tpp, results_list_o2_td, results_list_o2_d2, results_list_o2_d3, results_list_layout_o2, results_list_layout_o2_d2, results_list_layout_o2_d3 = (names.get((variant, 'td')) for variant in VARIANTS)
+        asked = {name for name, (needed, keys) in COMPARISONS.items() if selected.issuperset(needed)}
 
-def get_distance_relation_3_sd(pos1, pos2, room_dimensions):
-    # Calculate Euclidean distance between two objects
-    x1, _, z1 = pos1
-    x2, _, z2 = pos2
+        # for comparing wether can take full use of tpp
+        if 'layout_tpp' in asked and len(results_list_layout_tpp) != len(results_list_layout) and len(results_list_layout_tpp) > 0:
+            answer_ = 'Yes' if len(results_list_layout) == 9 else rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_layout, k =1)
+            else:
+                filtered_candidates = [item for item in relation_candidates if item not in results_list_layout]
+                relation_ =  rng.sample(filtered_candidates, k =1)
+            descriptions['question_yn_layout'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                               
+            descriptions['answer_yn_layout'] = answer_
+            descriptions['answer_yn_layout_tpp'] = "Yes" if relation_[0] in results_list_layout_tpp else "No"                                
+
+        # for comparing distance info with pure o2
+        if 'd2' in asked and len(results_list_o2_d2) != len(results_list_o2_td) and len(results_list_o2_d2) > 0:
+            answer_ = rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_o2_d2, k =1)
+            else:
+                unique_elements_list = [item for item in results_list_o2_td if item not in results_list_o2_d2]
+                relation_ =  rng.sample(unique_elements_list, k =1)
+            relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
+            descriptions['question_use_d2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
+            descriptions['question_use_d2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
+            descriptions['answer_use_d2'] = answer_
+            descriptions['answer_use_d2_sd'] = answer_
+            descriptions['answer_without_use_d2'] = "Yes" if relation_[0] in results_list_o2_td else "No"
+            descriptions['answer_without_use_d2_sd'] = "Yes" if relation_[0] in results_list_o2_td else "No"
+
+        # for comparing distance info with pure o3
+        if 'd3' in asked and len(results_list_o2_d3) != len(results_list_o2_td) and len(results_list_o2_d3) > 0:
+            answer_ = rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_o2_d3, k =1)
+            else:
+                unique_elements_list = sorted(set(results_list_o2_td) - set(results_list_o2_d3))
+                relation_ =  rng.sample(unique_elements_list, k =1)
+            relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
+            descriptions['question_use_d3'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"   if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                             
+            descriptions['question_use_d3_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
+            descriptions['answer_use_d3'] = answer_
+            descriptions['answer_use_d3_sd'] = answer_
+            descriptions['answer_without_use_d3'] = "Yes" if relation_[0] in results_list_o2_td else "No"
+            descriptions['answer_without_use_d3_sd'] = "Yes" if relation_[0] in results_list_o2_td else "No"
+
+        # for comparing wether can take full use of layout and o2
+        if 'layout_o2' in asked and Counter(results_list_layout_o2) != Counter(results_list_layout) and Counter(results_list_layout_o2) != Counter(results_list_o2_td)  and len(results_list_layout_o2) > 0:
+            answer_ = rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_layout_o2, k =1)
+            else:
+                unique_elements_list = sorted((set(results_list_layout) | set(results_list_o2_td)) - set(results_list_layout_o2))
+                relation_ =  rng.sample(unique_elements_list, k =1) 
+            relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
+            descriptions['question_use_layout_o2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
+            descriptions['question_use_layout_o2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
+            descriptions['answer_use_layout_o2'] = answer_ 
+            descriptions['answer_use_layout_o2_sd'] = answer_ 
+            descriptions['answer_with_layout_without_o2'] =  "Yes" if relation_[0] in results_list_layout else "No"
+            descriptions['answer_with_layout_without_o2_sd'] = "Yes" if relation_[0] in results_list_layout else "No"       
+            descriptions['answer_without_layout_with_o2'] =  "Yes" if relation_[0] in results_list_o2_td else "No"
+            descriptions['answer_without_layout_with_o2_sd'] =  "Yes" if relation_[0] in results_list_o2_td else "No"
+
+        # for comparing distance_2 info with and without layout                    
+        if 'layout_o2_d2' in asked and Counter(results_list_layout_o2_d2) != Counter(results_list_layout) and Counter(results_list_layout_o2_d2) != Counter(results_list_o2_d2) and len(results_list_layout_o2_d2) > 0:
+            answer_ = rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_layout_o2_d2, k =1)
+            else:
+                unique_elements_list = sorted((set(results_list_layout) | set(results_list_o2_d2)) - set(results_list_layout_o2_d2))
+                relation_ =  rng.sample(unique_elements_list, k =1)
+            relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
+            descriptions['question_use_layout_o2_d2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                               
+            descriptions['question_use_layout_o2_d2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
+            descriptions['answer_use_layout_o2_d2'] = answer_
+            descriptions['answer_use_layout_o2_d2_sd'] = answer_
+            descriptions['answer_without_layout_with_o2_d2'] = "Yes" if relation_[0] in results_list_layout_o2_d2 else "No"
+            descriptions['answer_without_layout_with_o2_d2_sd'] = "Yes" if relation_[0] in results_list_layout_o2_d2 else "No"
+            descriptions['answer_with_layout_without_o2_d2'] = "Yes" if relation_[0] in results_list_layout else "No"
+            descriptions['answer_with_layout_without_o2_d2_sd'] = "Yes" if relation_[0] in results_list_layout else "No"                
+
+        # for comparing distance_3 info with and without layout                    
+        if 'layout_o2_d3' in asked and Counter(results_list_layout_o2_d3) != Counter(results_list_layout) and Counter(results_list_layout_o2_d3) != Counter(results_list_o2_d3) and len(results_list_layout_o2_d3) > 0:
+            answer_ = rng.sample(['Yes', 'No'], k =1)[0]
+            if answer_ == 'Yes':
+                relation_ =  rng.sample(results_list_layout_o2_d3, k =1)
+            else:
+                unique_elements_list = sorted((set(results_list_layout) | set(results_list_o2_d3)) - set(results_list_layout_o2_d3))
+                relation_ =  rng.sample(unique_elements_list, k =1)
+            relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
+            descriptions['question_use_layout_o2_d3'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
+            descriptions['question_use_layout_o2_d3_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
+            descriptions['answer_use_layout_o2_d3'] = answer_
+            descriptions['answer_use_layout_o2_d3_sd'] = answer_
+            descriptions['answer_without_layout_with_o2_d3'] = "Yes" if relation_[0] in results_list_layout_o2_d3 else "No"
+            descriptions['answer_without_layout_with_o2_d3_sd'] = "Yes" if relation_[0] in results_list_layout_o2_d3 else "No"
+            descriptions['answer_with_layout_without_o2_d3'] = "Yes" if relation_[0] in results_list_layout else "No"
+            descriptions['answer_with_layout_without_o2_d3_sd'] = "Yes" if relation_[0] in results_list_layout else "No"   
+
+
+        result['descriptions'] = {
+            'example_id': i,
+            'descriptions': select_outputs(descriptions, outputs),
+        }
 
-    # Calculate Euclidean distance between two objects on the x-z plane
-    distance = ((x1 - x2)**2 + (z1 - z2)**2)**0.5
+    if facts_object and restory == False:  # Check if descriptions is not empty
+        variant_facts = variant_fact_lists(facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3)
+        record = {
+            'example_id': i,
 
-    # Max distance as the diagonal of the room on the x-z plane
-    max_distance = (room_dimensions**2 + room_dimensions**2)**0.5
-    # max_distance = room_dimensions
+            'query_o2': [(tup[0], tup[-1]) for tup in query],  ##    
+            'query_o2_yn': query_yn_uni_logic, ## 
+        }
+        for variant in variants:
+            record[f'facts_{variant}'] = variant_facts[variant]
+            record[f'solver_fr_{variant}'] = results[variant]
+        for variant in variants:
+            # As in the published datasets, answers_length_layout_o2 counts the o2 answers
+            counted = 'o2' if variant == 'layout_o2' else variant
+            if counted in selected:
+                record[f'answers_length_{variant}'] = len(results[counted])
+        for variant in variants:
+            record[f'time_{variant}'] = solved['times'][variant]
+        for variant in variants:
+            record[f'time_{variant}_yn'] = solved['times_yn'][variant]
+        for variant, probe_time in solved.get('times_probe', {}).items():
+            record[f'time_{variant}_probe'] = probe_time
+        result['facts'] = select_outputs(record, outputs)
+
+    return result
+
+
+def load_example_facts(i, example, asset_mapping, boundingBox_mapping, n, m, stages=None):
+    """Return (facts_key, facts) of an example, from the stage cache `stages` when stored there."""
+    store = get_stage_store(stages) if stages else None
+    # Facts do not depend on the domain size, so all domain sizes share them; object names and
+    # bounding boxes come from the asset database, so a changed database gives new keys
+    facts_key = stage_key(FACTS_STAGE_VERSION, asset_digest(asset_mapping), example_digest(i, example), n, m)
+    with stage_times.timer('describe'):
+        facts = store.get('facts', facts_key) if store else None
+        if facts is None:
+            facts = build_example_facts(i, example, asset_mapping, boundingBox_mapping, n, m)
+            if store:
+                store.put('facts', facts_key, facts)
+        else:
+            facts = restore_fact_tuples(facts)
+    return facts_key, facts
 
-    # Determine the thresholds for 'close', 'medium', and 'far'
-    close_threshold = max_distance / 3
-    medium_threshold = 2 * max_distance / 3
 
-    # Determine the distance relation
-    if distance <= close_threshold:
-        return "at a short distance", "CL3"  #, at a short distance , closely situated  , very close  , nearby
-    elif close_threshold < distance <= medium_threshold:
-        return "at a moderate distance", "MD3"
-    elif distance > medium_threshold:
-        return "at a far distance", "FR3"
+def load_example_solution(i, facts_key, facts, n, m, domain_size, solver_options, relation_uni, record_workload=False, stages=None, variants=VARIANTS, early_abort=False, reuse_feasible=False):
+    """Return the solver results of an example, from the stage cache `stages` when stored there."""
+    store = get_stage_store(stages) if stages else None
+    # Results of all variants keep the key they had before variants could be selected
+    selection = [] if variants == VARIANTS else [variants]
+    if early_abort:
+        selection.append('early_abort')
+    if reuse_feasible:
+        selection.append('reuse_feasible')
+    solve_key = stage_key(SOLVE_STAGE_VERSION, facts_key, domain_size, solver_options, relation_uni, *selection)
+    solved = store.get('solve', solve_key) if store else None
+    if solved is None:
+        solved = solve_example(i, facts, n, m, domain_size, solver_options, relation_uni, record_workload, variants, early_abort, reuse_feasible)
+        if store:
+            store.put('solve', solve_key, {name: value for name, value in solved.items() if name != 'records'})
+    return solved
 
-def get_distance_relation_2_sd(pos1, pos2, room_dimensions):
-    # Calculate Euclidean distance between two objects
-    x1, _, z1 = pos1
-    x2, _, z2 = pos2
 
-    # Calculate Euclidean distance between two objects on the x-z plane
-    distance = ((x1 - x2)**2 + (z1 - z2)**2)**0.5
+def skipped_result(i):
+    return {'example_id': i, 'skipped': True, 'valid': False, 'descriptions': None, 'facts': None, 'records': [], 'timings': {}}
 
-    # Max distance as the diagonal of the room on the x-z plane
-    # max_distance = (room_dimensions**2 + room_dimensions**2)**0.5
-    max_distance = room_dimensions
 
-    # Determine the thresholds for 'close', 'medium', and 'far'
-    close_threshold = max_distance / 2
+def example_stream(seed, i, n, m):
+    """The example's random stream and its first draw, which picks the yes/no question (also solved)."""
+    rng = example_rng(seed, i, n, m)
+    return rng, rng.sample(YN_RELATION_CANDIDATES, k =1)[0]
 
-    # Determine the distance relation
-    if distance <= close_threshold:
-        # print('short')
-        return "at a short distance", "CL2"  #, at a short distance , closely situated  , very close  , nearby
-    elif distance > close_threshold:
-        return "at a far distance", "FR2" # , at a far distance.
-    
 
-def symbol_spatial_relationship(pos1, pos2):
+def process_example(i, example, asset_mapping, boundingBox_mapping, n, m, domain_sizes, solver_options, seed, record_workload=False, stages=None, variants=VARIANTS, outputs=None, early_abort=False, reuse_feasible=False):
     """
-    For generating stor
+    Generate descriptions, facts and solver answers for one example, for each of the `domain_sizes`.
+
+    The work runs in three stages (build_example_facts, solve_example, render_example);
+    the facts are built once and solved and rendered for every domain size.
+    With `stages`, the path of a stage cache, stored facts and solver results are reused.
+    Only the `variants` are solved, and only keys matching the `outputs` patterns written.
+    With `early_abort`, examples found invalid by solve_example's probes are not rendered.
+    Returns {domain size: result}.
     """
-    x1, y1, z1 = pos1
-    x2, y2, z2 = pos2
-
-    horizontal_relation = ""
-    if x1 < x2:
-        horizontal_relation = "W"
-    elif x1 > x2:
-        horizontal_relation = "E"
-
-    vertical_relation = ""
-    if z1 < z2:
-        vertical_relation = "S"
-    elif z1 > z2:
-        vertical_relation = "N" #"front" typically refers to the direction you are facing
-
-    if horizontal_relation and vertical_relation:
-        return f"{vertical_relation}{horizontal_relation}"
-    elif horizontal_relation or vertical_relation:
-        return horizontal_relation if horizontal_relation else vertical_relation
+    facts_key, facts = load_example_facts(i, example, asset_mapping, boundingBox_mapping, n, m, stages)
+    facts_times = stage_times.take()
+    if facts['skipped']:
+        results = {domain_size: skipped_result(i) for domain_size in domain_sizes}
     else:
-        return "O"
+        results = {}
+        for domain_size in domain_sizes:
+            # Each domain size renders from a fresh stream, as a run of that domain size alone would
+            rng, relation_uni = example_stream(seed, i, n, m)
+            solved = load_example_solution(i, facts_key, facts, n, m, domain_size, solver_options, relation_uni, record_workload, stages, variants, early_abort, reuse_feasible)
+            with stage_times.timer('render'):
+                results[domain_size] = render_example(i, facts, solved, relation_uni, rng, variants, outputs)
+            results[domain_size]['timings'] = stage_times.take()
+    # Facts are built once for all domain sizes and counted with the first, as is the profile of all
+    merge_times(results[domain_sizes[0]]['timings'], facts_times)
+    results[domain_sizes[0]]['profile'] = stage_times.take_profile()
+    return results
+
+
+# Asset mappings of pool workers, set once per process by init_example_worker
+worker_mappings = {}
+
+def init_example_worker(asset_mapping, boundingBox_mapping, profiling=None):
+    worker_mappings['asset'] = asset_mapping
+    worker_mappings['boundingBox'] = boundingBox_mapping
+    if profiling:
+        enable_profiling(*profiling)
+
+def process_example_task(task):
+    i, example, n, m, domain_sizes, solver_options, seed, record_workload, stages, variants, outputs, early_abort, reuse_feasible = task
+    return process_example(i, example, worker_mappings['asset'], worker_mappings['boundingBox'], n, m, domain_sizes, solver_options, seed, record_workload, stages, variants, outputs, early_abort, reuse_feasible)
+
+def facts_task(task):
+    i, example, n, m, stages = task
+    facts_key, facts = load_example_facts(i, example, worker_mappings['asset'], worker_mappings['boundingBox'], n, m, stages)
+    return facts_key, facts, stage_times.take(), stage_times.take_profile()
+
+def solve_task(task):
+    solved = load_example_solution(*task)
+    return solved, stage_times.take(), stage_times.take_profile()
+
+def render_task(task):
+    i, facts, solved, relation_uni, rng, variants, outputs = task
+    with stage_times.timer('render'):
+        result = render_example(i, facts, solved, relation_uni, rng, variants, outputs)
+    return result, stage_times.take(), stage_times.take_profile()
+
+def init_cell_worker(examples, asset_mapping, boundingBox_mapping, profiling=None):
+    init_example_worker(asset_mapping, boundingBox_mapping, profiling)
+    worker_mappings['data'] = {'example': examples}
+
+def run_cell_task(task):
+    """
+    Run a chunk of (n, m) cells of one n in a pool worker, m ascending so the solver memo is reused.
+    Returns (n, m, results, workload records, wall) of each cell.
+    """
+    n, cells, solver_options, seed, record_workload, data_version, output_format, part, stages, variants, outputs, early_abort, reuse_feasible = task
+    finished = []
+    for m, domain_ids in cells:
+        started = time.perf_counter()
+        recorder = WorkloadBuffer() if record_workload else None
+        writers, checkpoints = open_domain_writers(data_version, n, m, domain_ids, part) if output_format == 'jsonl' else (None, None)
+        results = generate_descriptions_facts(worker_mappings['data'], worker_mappings['asset'], worker_mappings['boundingBox'], n, m, domain_ids, solver_options, recorder, None, seed, writers, checkpoints, stages, variants=variants, outputs=outputs, early_abort=early_abort, reuse_feasible=reuse_feasible)
+        close_domain_writers(writers, checkpoints)
+        finished.append((n, m, results, recorder or [], time.perf_counter() - started))
+    return finished
+
+
+def new_cell_results():
+    """Empty (descriptions, facts, answers_length, times, times_yn, skip ids, solution ids, dropped ids, stage times, profile) of a cell."""
+    return [], [], {}, {}, {}, [], [], [], {}, new_profile()
+
+
+def collect_result(result, cell_results, recorder=None, writers=None, checkpoint=None):
+    """Add the result of one example to `cell_results` (see new_cell_results), or write it to `writers`."""
+    with stage_times.timer('write'):
+        store_result(result, cell_results, recorder, writers, checkpoint)
+    example_times = merge_times(result['timings'], stage_times.take())
+    cell_results[8][result['example_id']] = example_times
+    merge_profiles(merge_profiles(cell_results[9], result.get('profile')), stage_times.take_profile())
+    example_done(example_times)
+
+
+def store_result(result, cell_results, recorder=None, writers=None, checkpoint=None):
+    descriptions_list, facts_list, answers_length, times, times_yn, skip_id_list, solution_id_list, dropped_id_list, stage_totals, profile = cell_results
+    i = result['example_id']
+    for record in result['records']:
+        recorder.write(record)
+    if result['skipped']:
+        if result.get('dropped'):
+            dropped_id_list.append(i)
+            print('dropped:', i, result['dropped'])
+        else:
+            skip_id_list.append(i)
+            print('skip:', i)
+        if checkpoint:
+            checkpoint.mark(checkpoint_entry(i, dropped=bool(result.get('dropped'))), writers)
+        return
     
+    answers = result['answers_length']
+    print(*(answers.values() if isinstance(answers, dict) else answers))
+    if result['valid']:
+        solution_id_list.append(i)
+    answers_length[i] = result['answers_length']
+    times[i] = result['times']
+    times_yn[i] = result['times_yn']
+    if writers:
+        if result['descriptions']:
+            writers['description'].write(result['descriptions'])
+        if result['facts']:
+            writers['facts'].write(result['facts'])
+        checkpoint.mark(checkpoint_entry(i, result['answers_length'], result['times'], result['times_yn'], result['valid']), writers)
+        return
+    if result['descriptions']:
+        descriptions_list.append(result['descriptions'])
+    if result['facts']:
+        facts_list.append(result['facts'])
 
-def generate_example_descriptions(example, asset_mapping, boundingBox_mapping, n, m):
-    """Generate descriptions for all components in an example, including spatial relations between objects."""
-    descriptions = {}
-    facts_object = []
-    facts_layout = []
-    facts_o2= []
-    facts_tpp = []
-    facts_d2 = []
-    facts_d3 = []
 
-    # Describe rooms, doors, walls, and windows
-    for room in example.get('rooms', []):
-        descriptions['room'] = describe_room(room)
+def pending_domains(domain_ids):
+    """Example ids of {domain size: example ids}, each with the domain sizes it is pending for, in id order."""
+    pending = {}
+    for domain_size, example_ids in domain_ids.items():
+        for i in example_ids:
+            pending.setdefault(i, []).append(domain_size)
+    return sorted(pending.items())
 
-    # Extract maximum dimensions for the room
-    parts = example.get('doors', [])[0]["wall0"].split('|')
-    room_dimensions = max([float(part) for part in parts[-4:]])
 
-    # Describe objects
-    objects_all = example.get('objects', [])
-    objects = []
-    object_ids, object_counts = {}, {}  # Dictionary to store object counts
-    
-    for obj in objects_all:
-        # Count objects
-        object_type = format_object_type(obj.get('assetId'), asset_mapping)
-        if object_type in object_counts:
-            update_object_counts(object_type, object_ids, object_counts)
-        else:
-            update_object_counts(object_type, object_ids, object_counts)
-    
-    objects_all.sort(key=lambda obj: object_counts[format_object_type(obj.get('assetId'), asset_mapping)])
-
-    if len(objects_all) >= n:
-        # objects = random.sample(objects_all, n)
-        objects = objects_all[:n]
-        objects.sort(key=lambda obj: object_counts[format_object_type(obj.get('assetId'), asset_mapping)])
-        object_descriptions, object_facts, object_room_relations_descriptions, object_room_facts, object_room_relations_descriptions_tpp, object_room_facts_tpp = describe_objects(objects, asset_mapping, boundingBox_mapping, room_dimensions)
-        facts_object.extend(object_facts)
-        facts_layout.extend(object_room_facts)
-        facts_tpp.extend(object_room_facts_tpp)
-
-        descriptions['object'] = object_descriptions
-        descriptions['object_room'] = object_room_relations_descriptions
-        descriptions['object_room_tpp'] = object_room_relations_descriptions_tpp
-        objects_relations_descriptions, objects_facts, objects_facts_d2, objects_facts_d3, query = describe_two_objects_relations(objects, room_dimensions, asset_mapping, m)
-        descriptions.update(objects_relations_descriptions)
-
-        facts_o2.extend(objects_facts)
-        facts_d2.extend(objects_facts_d2)
-        facts_d3.extend(objects_facts_d3)   
-        
-        return descriptions, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query
+def collect_results(results, domain_results, recorder=None, writers=None, checkpoints=None):
+    """collect_result for the {domain size: result} of one example."""
+    for domain_size, result in results.items():
+        collect_result(result, domain_results[domain_size], recorder, writers and writers[domain_size], checkpoints and checkpoints[domain_size])
 
-    else:      
-        return '', '', '', '', '', '', '', ''
-    
 
-def generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, test_num, test_num_start, k_start, domain_size):
-    """Generate descriptions for all examples in '.json', excluding those with empty descriptions."""
-    descriptions_list = []
-    facts_list = []
-    times = {}
-    times_yn = {}
-    answers_length = {}
-    skip_id_list = []
-    solution_id_list = []
-    
-    conversion_dict_sd = {
-    'N': 'front',
-    'S': 'behind',
-    'E': 'right',
-    'W': 'left',
-    'O': 'overlap'
-    }
-    
-    conversion_dict_td = {
-    'N': 'north',
-    'S': 'south',
-    'E': 'east',
-    'W': 'west',
-    'O': 'overlap'
-    }
-    
-    ful_k = k_start
-    
-    for i, example in enumerate(data['example'][test_num_start:], start=test_num_start):
-        restory = True
-        ful_k = ful_k + 1
+async def run_cell_pipeline(data, n, m, domain_ids, solver_options, recorder, executor, workers, seed, writers, checkpoints, stages, domain_results, queue_size, variants=VARIANTS, outputs=None, early_abort=False, reuse_feasible=False):
+    """
+    Run the examples of a cell through an asyncio pipeline: facts, solve, render, write.
 
-        descriptions, facts_object, facts_layout, facts_tpp, facts_o2, facts_d2, facts_d3, query = generate_example_descriptions(example, asset_mapping, boundingBox_mapping, n, m)
-        
-        if not descriptions:
-            skip_id_list.append(i)
-            print('skip:', i)
-            if ful_k == test_num:
-                return descriptions_list, facts_list, answers_length, times, times_yn, skip_id_list, solution_id_list
-            continue
-        
-        test_layout = {
-            'example_id': i,
-            'facts': facts_object + facts_layout,
-            'query': query,
-        }
-        test_layout_tpp = {
-            'example_id': i,
-            'facts':  facts_object + facts_layout + facts_tpp,
-            'query': query, 
-        }
-        test_o2 = {
-            'example_id': i,
-            'facts': facts_object + facts_o2,
-            'query': query,
-        }
-        test_o2_d2 = {
-            'example_id': i,
-            'facts': facts_object + facts_o2 + facts_d2,
-            'query': query, 
-        }
-        test_o2_d3 = {
-            'example_id': i,
-            'facts': facts_object + facts_o2 + facts_d3,
-            'query': query, 
-        }            
-        test_layout_o2  = {
-            'example_id': i,
-            'facts': facts_object  +  facts_layout + facts_o2,
-            'query': query, 
-        }         
-        test_layout_o2_d2 = {
-            'example_id': i,
-            'facts': facts_object  + facts_layout + facts_o2 + facts_d2,
-            'query': query, 
-        }
-        test_layout_o2_d3 = {
-            'example_id': i,
-            'facts': facts_object  + facts_layout + facts_o2 + facts_d3,
-            'query': query, 
-        }  
-        
-        result_layout, time_layout = solve_all_candidates(test_layout, domain_size)
-        result_layout_tpp, time_layout_tpp = solve_all_candidates(test_layout_tpp, domain_size)
-        result_o2, time_o2 = solve_all_candidates(test_o2, domain_size)
-        result_o2_d2, time_o2_d2 = solve_all_candidates(test_o2_d2, domain_size)
-        result_o2_d3, time_o2_d3 = solve_all_candidates(test_o2_d3, domain_size)   
-        result_layout_o2, time_layout_o2 = solve_all_candidates(test_layout_o2, domain_size)
-        result_layout_o2_d2, time_layout_o2_d2 = solve_all_candidates(test_layout_o2_d2, domain_size)
-        result_layout_o2_d3, time_layout_o2_d3 = solve_all_candidates(test_layout_o2_d3, domain_size)               
-        
-        print(len(result_layout), len(result_layout_tpp), len(result_o2), len(result_o2_d2), len(result_o2_d3), len(result_layout_o2), len(result_layout_o2_d2), len(result_layout_o2_d3))
+    Facts, solver results and renders are computed in `executor` (a pool of `workers`
+    processes set up by init_example_worker) and writing runs in a thread, so solving,
+    rendering and disk writes overlap. The domain sizes of an example are solved and
+    rendered concurrently. Results are collected in example order.
+    """
+    loop = asyncio.get_running_loop()
+    writer = ThreadPoolExecutor(1)
+    written = {}
+    next_position = 0
+
+    async def facts(task):
+        position, (i, domain_sizes) = task
+        item = {'position': position, 'i': i, 'domain_sizes': domain_sizes}
+        task = (i, data['example'][i], n, m, stages)
+        item['facts_key'], item['facts'], item['times'], item['profile'] = await loop.run_in_executor(executor, facts_task, task)
+        return item
+
+    async def solve(item):
+        i = item['i']
+        if item['facts']['skipped']:
+            item['results'] = {domain_size: skipped_result(i) for domain_size in item['domain_sizes']}
+            item['results'][item['domain_sizes'][0]]['timings'] = item['times']
+            item['results'][item['domain_sizes'][0]]['profile'] = item['profile']
+            return item
+        # Same draws as process_example: the yes/no relation first, the rest while rendering
+        item['streams'] = {domain_size: example_stream(seed, i, n, m) for domain_size in item['domain_sizes']}
+        tasks = [
+            (i, item['facts_key'], item['facts'], n, m, domain_size, solver_options, relation_uni, recorder is not None, stages, variants, early_abort, reuse_feasible)
+            for domain_size, (rng, relation_uni) in item['streams'].items()
+        ]
+        solved = await asyncio.gather(*(loop.run_in_executor(executor, solve_task, task) for task in tasks))
+        item['solved'] = dict(zip(item['streams'], solved))
+        return item
+
+    async def render(item):
+        if 'results' in item:
+            return item
+        tasks = [
+            (item['i'], item['facts'], item['solved'][domain_size][0], relation_uni, rng, variants, outputs)
+            for domain_size, (rng, relation_uni) in item['streams'].items()
+        ]
+        rendered = await asyncio.gather(*(loop.run_in_executor(executor, render_task, task) for task in tasks))
+        item['results'] = {}
+        for domain_size, (result, render_times, render_profile) in zip(item['streams'], rendered):
+            solved, solve_times, solve_profile = item['solved'][domain_size]
+            result['timings'] = merge_times(render_times, solve_times)
+            item['profile'] = merge_profiles(merge_profiles(item['profile'], solve_profile), render_profile)
+            item['results'][domain_size] = result
+        # Facts are built once for all domain sizes and counted with the first, as is the profile of all
+        merge_times(item['results'][item['domain_sizes'][0]]['timings'], item['times'])
+        item['results'][item['domain_sizes'][0]]['profile'] = item['profile']
+        return item
+
+    def write(item):
+        # Runs in the single writer thread; results that arrive early wait for their predecessors
+        nonlocal next_position
+        written[item['position']] = item['results']
+        while next_position in written:
+            collect_results(written.pop(next_position), domain_results, recorder, writers, checkpoints)
+            next_position += 1
+
+    async def write_stage(item):
+        await loop.run_in_executor(writer, write, item)
+
+    pipeline = Pipeline([
+        Stage('facts', facts, workers),
+        Stage('solve', solve, workers),
+        Stage('render', render, workers),
+        Stage('write', write_stage),
+    ], queue_size)
+    try:
+        await pipeline.run(enumerate(pending_domains(domain_ids)))
+    finally:
+        writer.shutdown()
+    print(pipeline.report())
 
-        if len(result_layout) > 0 and len(result_layout_tpp) > 0 and len(result_o2) > 0  and len(result_o2_d2) > 0 and len(result_o2_d3) > 0 and len(result_layout_o2) > 0 and len(result_layout_o2_d2) > 0 and len(result_layout_o2_d3) > 0:                
-            restory = False
 
-        if descriptions and restory == False:  
-            solution_id_list.append(i)
-        if descriptions:  # Check if descriptions is not empty
-            answers_length[i] = [len(result_layout), len(result_layout_tpp),len(result_o2), len(result_o2_d2),len(result_o2_d3), len(result_layout_o2), len(result_layout_o2_d2),len(result_layout_o2_d3)]
-            times[i] = [time_layout, time_layout_tpp, time_o2, time_o2_d2, time_o2_d3, time_layout_o2, time_layout_o2_d2, time_layout_o2_d3]            
-            
-            relation_candidates =['north', 'south', 'east', 'west','north-west', 'north-east', 'south-west', 'south-east']
-            results_list_layout = []
-            if len(result_o2) > 0:
-                for k in result_layout:
-                    if len(k) == 1:
-                        results_list_layout.append(conversion_dict_td[k])
-                    else:
-                        results_list_layout.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-            descriptions['question_fr'] = f"Where is the {query[0][0]} positioned in relation to the {query[0][2]}?"                
-            descriptions['solver_fr_layout'] = results_list_layout
-                    
-            results_list_layout_tpp = []        
-            if len(result_layout_tpp) > 0:
-                for k in result_layout_tpp:
-                    if len(k) == 1:
-                        results_list_layout_tpp.append(conversion_dict_td[k])
-                    else:
-                        results_list_layout_tpp.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-            descriptions['solver_fr_layout_tpp'] = results_list_layout_tpp 
-            
-            # for comparing top-down view and south-door view
-            results_list_o2_td = []
-            results_list_o2_sd = []
-            if len(result_o2) > 0:
-                for k in result_o2:
-                    if len(k) == 1:
-                        results_list_o2_td.append(conversion_dict_td[k])
-                        results_list_o2_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_o2_td.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_o2_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_o2_td'] = results_list_o2_td  
-            descriptions['solver_fr_o2_sd'] = results_list_o2_sd
-            
-            results_list_o2_d2 = []
-            results_list_o2_d2_sd = []
-            if len(result_o2_d2) > 0:
-                for k in result_o2_d2:
-                    if len(k) == 1:
-                        results_list_o2_d2.append(conversion_dict_td[k])
-                        results_list_o2_d2_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_o2_d2.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_o2_d2_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_o2_d2'] = results_list_o2_d2
-            descriptions['solver_fr_o2_d2_sd'] = results_list_o2_d2_sd
-            
-            
-            results_list_o2_d3 = []
-            results_list_o2_d3_sd = []
-            if len(result_o2_d3) > 0:
-                for k in result_o2_d3:
-                    if len(k) == 1:
-                        results_list_o2_d3.append(conversion_dict_td[k])
-                        results_list_o2_d3_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_o2_d3.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_o2_d3_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_o2_d3'] = results_list_o2_d3
-            descriptions['solver_fr_o2_d3_sd'] = results_list_o2_d3_sd
-            
-            
-            # for comparing o2 without and with layout descriptions
-            results_list_layout_o2=[]
-            results_list_layout_o2_sd=[]
-            if len(result_layout_o2) > 0:
-                for k in result_layout_o2:
-                    if len(k) == 1:
-                        results_list_layout_o2.append(conversion_dict_td[k])
-                        results_list_layout_o2_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_layout_o2.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_layout_o2_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_layout_o2'] = results_list_layout_o2
-            descriptions['solver_fr_layout_o2_sd'] = results_list_layout_o2_sd
-
-
-            results_list_layout_o2_d2 = []
-            results_list_layout_o2_d2_sd = []
-            if len(result_layout_o2_d2) > 0:
-                for k in result_layout_o2_d2:
-                    if len(k) == 1:
-                        results_list_layout_o2_d2.append(conversion_dict_td[k])
-                        results_list_layout_o2_d2_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_layout_o2_d2.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_layout_o2_d2_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_layout_o2_d2'] = results_list_layout_o2_d2
-            descriptions['solver_fr_layout_o2_d2_sd'] = results_list_layout_o2_d2_sd
-
-
-            results_list_layout_o2_d3 = []
-            results_list_layout_o2_d3_sd = []
-            if len(result_layout_o2_d3) > 0:
-                for k in result_layout_o2_d3:
-                    if len(k) == 1:
-                        results_list_layout_o2_d3.append(conversion_dict_td[k])
-                        results_list_layout_o2_d3_sd.append(conversion_dict_sd[k])
-                    else:
-                        results_list_layout_o2_d3.append(f"{conversion_dict_td[k[0]]}-{conversion_dict_td[k[1]]}")
-                        results_list_layout_o2_d3_sd.append(f"{conversion_dict_sd[k[0]]}-{conversion_dict_sd[k[1]]}")
-            descriptions['solver_fr_layout_o2_d3'] = results_list_layout_o2_d3
-            descriptions['solver_fr_layout_o2_d3_sd'] = results_list_layout_o2_d3_sd
-
-
-            replacements = {
-                'north-east': 'in front of and to the right of',
-                'east': 'to the right of',
-                'west': 'to the left of',
-                'north-west': 'in front of and to the left of',
-                'south-east': 'behind and to the right of',
-                'south-west': 'behind and to the left of',
-                'north': 'in front of',
-                'south': 'behind'
-            }
-            
-            relation_uni = random.sample(relation_candidates, k =1)[0]
-            descriptions['question_yn_uni'] = f"Could the {query[0][0]} be placed to the {relation_uni} of the {query[0][2]}?" if relation_uni != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
-            descriptions['question_yn_uni_sd'] = f"Could the {query[0][0]} be positioned {replacements[relation_uni]} of the {query[0][2]}?" if relation_uni != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
-            descriptions['answer_yn_uni_layout'] = "Yes" if relation_uni in  results_list_layout else "No"
-            descriptions['answer_yn_uni_layout_tpp'] = "Yes" if relation_uni in  results_list_layout_tpp else "No"
-            descriptions['answer_yn_uni_o2_td'] = "Yes" if relation_uni in  results_list_o2_td else "No"
-            descriptions['answer_yn_uni_o2_d2'] = "Yes" if relation_uni in  results_list_o2_d2 else "No"
-            descriptions['answer_yn_uni_o2_d3'] = "Yes" if relation_uni in  results_list_o2_d3 else "No"
-            descriptions['answer_yn_uni_layout_o2_td'] = "Yes" if relation_uni in  results_list_layout_o2 else "No"
-            descriptions['answer_yn_uni_layout_o2_d2'] = "Yes" if relation_uni in  results_list_layout_o2_d2 else "No"
-            descriptions['answer_yn_uni_layout_o2_d3'] = "Yes" if relation_uni in  results_list_layout_o2_d3 else "No"
-
-            query_yn_uni_logic = [(query[0][0], abbreviate_direction(relation_uni) ,query[0][2])]
- 
-            _, time_layout_yn = solve_single_candidate(test_layout, relation_uni, domain_size)
-            _, time_layout_tpp_yn = solve_single_candidate(test_layout_tpp, relation_uni, domain_size)
-            _, time_o2_yn = solve_single_candidate(test_o2, relation_uni, domain_size)
-            _, time_o2_d2_yn = solve_single_candidate(test_o2_d2, relation_uni, domain_size)
-            _, time_o2_d3_yn = solve_single_candidate(test_o2_d3, relation_uni, domain_size)   
-            _, time_layout_o2_yn = solve_single_candidate(test_layout_o2, relation_uni, domain_size)
-            _, time_layout_o2_d2_yn = solve_single_candidate(test_layout_o2_d2, relation_uni, domain_size)
-            _, time_layout_o2_d3_yn = solve_single_candidate(test_layout_o2_d3, relation_uni, domain_size)   
-
-            times_yn[i] = [time_layout_yn, time_layout_tpp_yn, time_o2_yn, time_o2_d2_yn, time_o2_d3_yn, time_layout_o2_yn, time_layout_o2_d2_yn, time_layout_o2_d3_yn]            
-
-
-            # for comparing wether can take full use of tpp
-            if len(results_list_layout_tpp) != len(results_list_layout) and len(results_list_layout_tpp) > 0:
-                answer_ = 'Yes' if len(results_list_layout) == 9 else random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_layout, k =1)
-                else:
-                    filtered_candidates = [item for item in relation_candidates if item not in results_list_layout]
-                    relation_ =  random.sample(filtered_candidates, k =1)
-                descriptions['question_yn_layout'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                               
-                descriptions['answer_yn_layout'] = answer_
-                descriptions['answer_yn_layout_tpp'] = "Yes" if relation_[0] in results_list_layout_tpp else "No"                                
-
-            # for comparing distance info with pure o2
-            if len(results_list_o2_d2) != len(results_list_o2_td) and len(results_list_o2_d2) > 0:
-                answer_ = random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_o2_d2, k =1)
-                else:
-                    unique_elements_list = [item for item in results_list_o2_td if item not in results_list_o2_d2]
-                    relation_ =  random.sample(unique_elements_list, k =1)
-                relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
-                descriptions['question_use_d2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
-                descriptions['question_use_d2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
-                descriptions['answer_use_d2'] = answer_
-                descriptions['answer_use_d2_sd'] = answer_
-                descriptions['answer_without_use_d2'] = "Yes" if relation_[0] in results_list_o2_td else "No"
-                descriptions['answer_without_use_d2_sd'] = "Yes" if relation_[0] in results_list_o2_td else "No"
-                
-            # for comparing distance info with pure o3
-            if len(results_list_o2_d3) != len(results_list_o2_td) and len(results_list_o2_d3) > 0:
-                answer_ = random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_o2_d3, k =1)
-                else:
-                    unique_elements_list = list( set(results_list_o2_td) - set(results_list_o2_d3))
-                    relation_ =  random.sample(unique_elements_list, k =1)
-                relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
-                descriptions['question_use_d3'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"   if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                             
-                descriptions['question_use_d3_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
-                descriptions['answer_use_d3'] = answer_
-                descriptions['answer_use_d3_sd'] = answer_
-                descriptions['answer_without_use_d3'] = "Yes" if relation_[0] in results_list_o2_td else "No"
-                descriptions['answer_without_use_d3_sd'] = "Yes" if relation_[0] in results_list_o2_td else "No"
-        
-            # for comparing wether can take full use of layout and o2
-            if Counter(results_list_layout_o2) != Counter(results_list_layout) and Counter(results_list_layout_o2) != Counter(results_list_o2_td)  and len(results_list_layout_o2) > 0:
-                answer_ = random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_layout_o2, k =1)
-                else:
-                    unique_elements_list = list((set(results_list_layout) | set(results_list_o2_td)) - set(results_list_layout_o2))
-                    relation_ =  random.sample(unique_elements_list, k =1) 
-                relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
-                descriptions['question_use_layout_o2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"               
-                descriptions['question_use_layout_o2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?" if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
-                descriptions['answer_use_layout_o2'] = answer_ 
-                descriptions['answer_use_layout_o2_sd'] = answer_ 
-                descriptions['answer_with_layout_without_o2'] =  "Yes" if relation_[0] in results_list_layout else "No"
-                descriptions['answer_with_layout_without_o2_sd'] = "Yes" if relation_[0] in results_list_layout else "No"       
-                descriptions['answer_without_layout_with_o2'] =  "Yes" if relation_[0] in results_list_o2_td else "No"
-                descriptions['answer_without_layout_with_o2_sd'] =  "Yes" if relation_[0] in results_list_o2_td else "No"
-                
-            # for comparing distance_2 info with and without layout                    
-            if Counter(results_list_layout_o2_d2) != Counter(results_list_layout) and Counter(results_list_layout_o2_d2) != Counter(results_list_o2_d2) and len(results_list_layout_o2_d2) > 0:
-                answer_ = random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_layout_o2_d2, k =1)
-                else:
-                    unique_elements_list = list((set(results_list_layout) | set(results_list_o2_d2)) - set(results_list_layout_o2_d2))
-                    relation_ =  random.sample(unique_elements_list, k =1)
-                relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
-                descriptions['question_use_layout_o2_d2'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                               
-                descriptions['question_use_layout_o2_d2_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
-                descriptions['answer_use_layout_o2_d2'] = answer_
-                descriptions['answer_use_layout_o2_d2_sd'] = answer_
-                descriptions['answer_without_layout_with_o2_d2'] = "Yes" if relation_[0] in results_list_layout_o2_d2 else "No"
-                descriptions['answer_without_layout_with_o2_d2_sd'] = "Yes" if relation_[0] in results_list_layout_o2_d2 else "No"
-                descriptions['answer_with_layout_without_o2_d2'] = "Yes" if relation_[0] in results_list_layout else "No"
-                descriptions['answer_with_layout_without_o2_d2_sd'] = "Yes" if relation_[0] in results_list_layout else "No"                
-                
-            # for comparing distance_3 info with and without layout                    
-            if Counter(results_list_layout_o2_d3) != Counter(results_list_layout) and Counter(results_list_layout_o2_d3) != Counter(results_list_o2_d3) and len(results_list_layout_o2_d3) > 0:
-                answer_ = random.sample(['Yes', 'No'], k =1)[0]
-                if answer_ == 'Yes':
-                    relation_ =  random.sample(results_list_layout_o2_d3, k =1)
-                else:
-                    unique_elements_list = list((set(results_list_layout) | set(results_list_o2_d3)) - set(results_list_layout_o2_d3))
-                    relation_ =  random.sample(unique_elements_list, k =1)
-                relation_sd = relation_[0].replace('north','in front of').replace('south','behind').replace('east','to the right of').replace('west','to the left of').replace('-', ' and ')
-                descriptions['question_use_layout_o2_d3'] = f"Could the {query[0][0]} be placed to the {relation_[0]} of the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                              
-                descriptions['question_use_layout_o2_d3_sd'] = f"Could the {query[0][0]} be placed {relation_sd} the {query[0][2]}?"  if relation_[0] != 'overlap' else f"Could the {query[0][0]} be placed in the same location as the {query[0][2]}?"                                
-                descriptions['answer_use_layout_o2_d3'] = answer_
-                descriptions['answer_use_layout_o2_d3_sd'] = answer_
-                descriptions['answer_without_layout_with_o2_d3'] = "Yes" if relation_[0] in results_list_layout_o2_d3 else "No"
-                descriptions['answer_without_layout_with_o2_d3_sd'] = "Yes" if relation_[0] in results_list_layout_o2_d3 else "No"
-                descriptions['answer_with_layout_without_o2_d3'] = "Yes" if relation_[0] in results_list_layout else "No"
-                descriptions['answer_with_layout_without_o2_d3_sd'] = "Yes" if relation_[0] in results_list_layout else "No"   
-
-
-            descriptions_list.append({
-                'example_id': i,
-                'descriptions': descriptions,
-            })
-
-        if facts_object and restory == False:  # Check if descriptions is not empty
-            facts_list.append({
-                'example_id': i,
-                
-                'query_o2': [(tup[0], tup[-1]) for tup in query],  ##    
-                'query_o2_yn': query_yn_uni_logic, ## 
-
-                'facts_layout': facts_object + facts_layout,               
-                'solver_fr_layout': result_layout,
-                
-                'facts_layout_tpp': facts_object + facts_layout + facts_tpp,                
-                'solver_fr_layout_tpp': result_layout_tpp,           
-                
-                'facts_o2': facts_object + facts_o2,
-                'solver_fr_o2': result_o2,
-                
-                'facts_o2_d2': facts_object + facts_o2 + facts_d2,
-                'solver_fr_o2_d2': result_o2_d2,       
-                
-                'facts_o2_d3': facts_object + facts_o2 + facts_d3,
-                'solver_fr_o2_d3': result_o2_d3,
-
-                'facts_layout_o2': facts_object  + facts_layout + facts_o2,
-                'solver_fr_layout_o2': result_layout_o2,  
-                                
-                'facts_layout_o2_d2': facts_object  + facts_layout + facts_o2 + facts_d2,
-                'solver_fr_layout_o2_d2': result_layout_o2_d2,   
-
-                'facts_layout_o2_d3': facts_object  + facts_layout + facts_o2 + facts_d3,
-                'solver_fr_layout_o2_d3': result_layout_o2_d3,           
-                
-                'answers_length_layout': len(result_layout),
-                'answers_length_layout_tpp': len(result_layout_tpp),
-                'answers_length_o2': len(result_o2),
-                'answers_length_o2_d2': len(result_o2_d2),
-                'answers_length_o2_d3': len(result_o2_d3),
-                'answers_length_layout_o2': len(result_o2),
-                'answers_length_layout_o2_d2': len(result_layout_o2_d2),
-                'answers_length_layout_o2_d3': len(result_layout_o2_d3),              
-
-                'time_layout': time_layout,
-                'time_layout_tpp': time_layout_tpp,
-                'time_o2': time_o2,
-                'time_o2_d2': time_o2_d2,
-                'time_o2_d3': time_o2_d3,
-                'time_layout_o2': time_layout_o2,
-                'time_layout_o2_d2': time_layout_o2_d2,
-                'time_layout_o2_d3': time_layout_o2_d3,               
-
-                
-                'time_layout_yn': time_layout_yn,
-                'time_layout_tpp_yn': time_layout_tpp_yn,
-                'time_o2_yn': time_o2_yn,
-                'time_o2_d2_yn': time_o2_d2_yn,
-                'time_o2_d3_yn': time_o2_d3_yn,
-                'time_layout_o2_yn': time_layout_o2_yn,
-                'time_layout_o2_d2_yn': time_layout_o2_d2_yn,
-                'time_layout_o2_d3_yn': time_layout_o2_d3_yn,                            
-            })
-            
-                        
-        if ful_k == test_num:
-            return descriptions_list, facts_list, answers_length, times, times_yn, skip_id_list, solution_id_list
-    # return descriptions_list, facts_list, answers_length, times, skip_id_list
+def generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, domain_ids, solver_options=None, recorder=None, executor=None, seed=0, writers=None, checkpoints=None, stages=None, pipeline=None, workers=1, variants=VARIANTS, outputs=None, early_abort=False, reuse_feasible=False):
+    """
+    Generate descriptions for the examples of `domain_ids`, {domain size: example ids}, excluding those with empty descriptions.
+
+    Each example's facts are built once and solved for every domain size it is listed
+    under. With an `executor` (a process pool set up by init_example_worker) the examples
+    are processed in parallel; results are merged in example order. With `pipeline`, a
+    queue size, they go through run_cell_pipeline instead. With `writers` and `checkpoints`
+    (see open_domain_writers) descriptions and facts are appended to the writers instead
+    of returned, and each example is logged once written. Returns {domain size: cell results}.
+    """
+    domain_results = {domain_size: new_cell_results() for domain_size in domain_ids}
+    solver_options = solver_options or {}
+    
+    if pipeline:
+        asyncio.run(run_cell_pipeline(data, n, m, domain_ids, solver_options, recorder, executor, workers, seed, writers, checkpoints, stages, domain_results, pipeline, variants, outputs, early_abort, reuse_feasible))
+        return domain_results
+    examples = pending_domains(domain_ids)
+    if executor:
+        tasks = ((i, data['example'][i], n, m, domain_sizes, solver_options, seed, recorder is not None, stages, variants, outputs, early_abort, reuse_feasible) for i, domain_sizes in examples)
+        results = executor.map(process_example_task, tasks)
+    else:
+        results = (process_example(i, data['example'][i], asset_mapping, boundingBox_mapping, n, m, domain_sizes, solver_options, seed, recorder is not None, stages, variants, outputs, early_abort, reuse_feasible) for i, domain_sizes in examples)
+    
+    for example_results in results:
+        collect_results(example_results, domain_results, recorder, writers, checkpoints)
+    
+    return domain_results
 
 
 def cache_exists(file_path):
@@ -1335,108 +1504,338 @@ def save_answers(answers_lengths, answers_file):
         answers_lengths_str_keys = {'_'.join(map(str, key)): value for key, value in answers_lengths.items()}
         json.dump(answers_lengths_str_keys, outfile, indent=4)
 
+# Logic files holding one entry per (n, m) cell, shared by the whole sweep
+AGGREGATED_OUTPUTS = list(AGGREGATED_FILES)
+
+def get_output_files(data_version, n, m, domain_size, output_format='json', part=None):
+    """
+    Paths of the Text/Logic files of an (n, m) cell and of the aggregated Logic files.
+
+    Partial runs write to their own directory `part` under Data/<data_version>:
+    variants-<digest> for a selection of variants or outputs, and shards/<name> (below
+    it, if any) for a shard or a queue worker; see merge_shards.py.
+    """
+    d = domain_size[0] * domain_size[1]
+    root = f'./Data/{data_version}' if part is None else f'./Data/{data_version}/{part}'
+    files = {
+        'description': f'{root}/Text/n{n}_m{m}_d{d}.{output_format}',
+        'facts': f'{root}/Logic/n{n}_m{m}_d{d}.{output_format}',
+        'checkpoint': f'{root}/Logic/n{n}_m{m}_d{d}.{output_format}.checkpoint',
+        'store': f'{root}/Logic/results.sqlite',
+        'profile': f'{root}/Logic/profiles/n{n}_m{m}',
+    }
+    for name, file_name in AGGREGATED_FILES.items():
+        files[name] = f'{root}/Logic/' + file_name.format(d=d)
+    return files
+
+def parse_shard(value):
+    """Parse a --shard value 'k/N' into (k, N), with 0 <= k < N."""
+    k, N = map(int, value.split('/'))
+    if not 0 <= k < N:
+        raise ValueError(f"shard index must be in [0, {N})")
+    return k, N
+
+def parse_domain_size(value):
+    """Parse a --domain_sizes value 'WxH' into (W, H)."""
+    width, height = map(int, value.lower().split('x'))
+    return width, height
+
+def checkpoint_entry(example_id, answers_length=None, times=None, times_yn=None, valid=False, dropped=False):
+    """Checkpoint log entry of a processed example; skipped and dropped examples have no answers."""
+    entry = {'example_id': example_id, 'skipped': answers_length is None}
+    if dropped:
+        entry['dropped'] = True
+    if answers_length is not None:
+        entry.update(valid=valid, answers_length=answers_length, times=times, times_yn=times_yn)
+    return entry
+
+def restore_cell_results(entries):
+    """Rebuild the aggregated outputs of a cell from its checkpoint entries."""
+    cell_results = {'answers': {}, 'times': {}, 'times_yn': {}, 'skip_id': [], 'solution_id': [], 'dropped_id': []}
+    for i, entry in sorted(entries.items()):
+        if entry['skipped']:
+            cell_results['dropped_id' if entry.get('dropped') else 'skip_id'].append(i)
+            continue
+        cell_results['answers'][i] = entry['answers_length']
+        cell_results['times'][i] = entry['times']
+        cell_results['times_yn'][i] = entry['times_yn']
+        if entry['valid']:
+            cell_results['solution_id'].append(i)
+    return cell_results
+
+def legacy_cell_complete(files, test_num):
+    """A cell written before checkpoint logs existed is complete if it ends with example test_num - 1."""
+    if not (cache_exists(files['description']) and cache_exists(files['facts'])):
+        return False
+    all_descriptions = load_cache(files['description'])
+    return bool(all_descriptions) and all_descriptions[-1].get("example_id") == test_num - 1
+
+def open_cell_writers(data_version, n, m, domain_size, part=None):
+    """Open append-only JSON-lines writers and the checkpoint log for the Text/Logic files of an (n, m) cell."""
+    files = get_output_files(data_version, n, m, domain_size, 'jsonl', part)
+    writers = {'description': JsonlWriter(files['description']), 'facts': JsonlWriter(files['facts'])}
+    return writers, CheckpointLog(files['checkpoint'])
+
+def close_cell_writers(writers, checkpoint=None):
+    if checkpoint:
+        checkpoint.close(writers)
+    for writer in (writers or {}).values():
+        writer.close()
+
+def open_domain_writers(data_version, n, m, domain_sizes, part=None):
+    """open_cell_writers for each domain size: ({domain size: writers}, {domain size: checkpoint log})."""
+    opened = {domain_size: open_cell_writers(data_version, n, m, domain_size, part) for domain_size in domain_sizes}
+    return {domain_size: writers for domain_size, (writers, checkpoint) in opened.items()}, {domain_size: checkpoint for domain_size, (writers, checkpoint) in opened.items()}
+
+def close_domain_writers(writers, checkpoints=None):
+    for domain_size in (writers or {}):
+        close_cell_writers(writers[domain_size], checkpoints[domain_size])
+
+def finish_cell(data_version, n, m, domain_size, results, done, aggregated, output_format='json', store=None, part=None):
+    """
+    Merge the results of an (n, m) cell into its files and the aggregated outputs, then save them.
+
+    `done` holds the checkpoint entries of examples finished by earlier runs. JSON-lines
+    cells were written and checkpointed while running, so only the aggregated outputs
+    are saved for them. With a results `store` only this cell's aggregated outputs are
+    written, to the store instead of the JSON files.
+    """
+    streamed = output_format == 'jsonl'
+    files = get_output_files(data_version, n, m, domain_size, output_format, part)
+    all_descriptions, all_facts, answers_length, times, times_yn, skip_id_list, solution_id_list, dropped_id_list, stage_totals, profile = results
+    cell_results = dict(zip(AGGREGATED_OUTPUTS, [answers_length, times, times_yn, skip_id_list, solution_id_list, dropped_id_list]))
+    if done:
+        if not streamed:
+            all_descriptions = [record for record in load_cache(files['description']) if record['example_id'] in done] + all_descriptions
+            all_facts = [record for record in load_cache(files['facts']) if record['example_id'] in done] + all_facts
+        for name, value in cell_results.items():
+            previous = aggregated[name].setdefault((n, m), type(value)())
+            if isinstance(value, dict):
+                previous.update(value)
+            else:
+                previous += value
+    else:
+        for name, value in cell_results.items():
+            aggregated[name][n, m] = value
+    
+    if not streamed:
+        save_descriptions_facts(all_descriptions, files['description'])
+        save_descriptions_facts(all_facts, files['facts'])
+        checkpoint = CheckpointLog(files['checkpoint'])
+        solution_ids, dropped_ids = set(solution_id_list), set(dropped_id_list)
+        for i in sorted(skip_id_list + dropped_id_list + list(answers_length)):
+            if i in answers_length:
+                checkpoint.mark(checkpoint_entry(i, answers_length[i], times[i], times_yn[i], i in solution_ids))
+            else:
+                checkpoint.mark(checkpoint_entry(i, dropped=i in dropped_ids))
+        checkpoint.close()
+    if store:
+        store.replace_cell(data_version, domain_size[0] * domain_size[1], n, m, {name: aggregated[name][n, m] for name in AGGREGATED_OUTPUTS})
+        return
+    for name in AGGREGATED_OUTPUTS:
+        save_answers(aggregated[name], files[name])
+
+def sweep_cells(n_range, m_range):
+    """(n, m) cells of the sweep."""
+    cells = []
+    for n in n_range:  # Iterate n from 3 to 10  3, 11
+        if n > 2:
+            m_range = range(n-1, n*(n-1)//2)
+        for m in m_range:
+            cells.append((n, m))
+    return cells
+
+def prepare_cell(data_version, n, m, domain_size, example_ids, aggregated, output_format='json', part=None, test_num=None):
+    """
+    Return the examples of `example_ids` still to process in a cell and the checkpoint entries of the finished ones.
+
+    JSON-lines records written after the last checkpoint commit are dropped, and the
+    cell's aggregated outputs are rebuilt from its checkpoint log.
+    """
+    files = get_output_files(data_version, n, m, domain_size, output_format, part)
+    done = read_checkpoint(files['checkpoint'])
+    if not done and output_format == 'json' and part is None and legacy_cell_complete(files, test_num):
+        return [], done
+    example_ids = [i for i in example_ids if i not in done]
+    if example_ids:
+        if output_format == 'jsonl':
+            # Drop records written after the last checkpoint commit; they are redone
+            truncate_outputs(done, {'description': files['description'], 'facts': files['facts']})
+        if done:
+            for name, value in restore_cell_results(done).items():
+                aggregated[name][n, m] = value
+    return example_ids, done
+
 def main(args):
     # Extract the arguments
     data_version = args.data_version
     test_num = args.test_num
     test_num_start = args.test_num_start
-    domain_size = tuple(args.domain_size)
+    domain_sizes = [tuple(domain_size) for domain_size in args.domain_sizes] if args.domain_sizes else [tuple(args.domain_size)]
     n_range = args.n_range
     m_range = args.m_range
+    solver_options = {'ordering': args.ordering, 'normalize': args.normalize}
+    variants = select_variants(args.variants, args.outputs)
+    if variants != VARIANTS:
+        print(f"solving variants: {', '.join(variants) or 'none'}")
+    # Queue workers append their cell files batch by batch; merge_shards.py writes them as JSON
+    output_format = 'jsonl' if args.queue else args.output_format
+    streamed = output_format == 'jsonl'
+    metrics = RunMetrics(args.metrics)
+    if args.progress:
+        enable_progress()
+    if args.profile:
+        enable_profiling(args.profile, args.profile_tools)
     
-    directory = './Meta/SD-100'  # Replace with the path to your JSON files
-    read_and_concatenate_json_files(directory, data_version)
-    
-    file_paths = {
-    	'example': f'./Data/{data_version}/{data_version}.json', 
-    	'material': './databases/material-database.json',
-    	'objects': './databases/object-groups.json',
-    	'receptacles': './databases/receptacles.json',
-    	'assets': './databases/asset-database.json'
-    }  
-
-    data = load_data(file_paths)
-    asset_mapping = build_asset_mapping(data['assets'])
-    boundingBox_mapping = build_boundingBox_mapping(data['assets'])
-
-    answers_lengths = {}
-    times_take = {}
-    times_yn_take = {}
-    skip_id_dic = {}
-    solution_id_dic = {}
+    with stage_times.timer('load'):
+        directory = './Meta/SD-100'  # Replace with the path to your JSON files
+        read_and_concatenate_json_files(directory, data_version)
+        
+        file_paths = {
+        	'example': f'./Data/{data_version}/{data_version}.json', 
+        }  
+
+        data = load_data(file_paths)
+        # Only asset types and bounding boxes are used, read from the compiled index of the asset database
+        assets = AssetIndex('./databases/asset-database.json').load()
+    metrics.add_stages(stage_times.take())
+    asset_mapping = AssetTypes(assets)
+    boundingBox_mapping = AssetBoundingBoxes(assets)
+    recorder = WorkloadRecorder(args.record) if args.record else None
+    # The async pipeline always solves in a pool, so a single worker still overlaps with rendering and writing
+    pipeline = args.queue_size if args.pipeline == 'async' and args.cell_workers <= 1 else None
+    executor = ProcessPoolExecutor(args.workers, initializer=init_example_worker, initargs=(asset_mapping, boundingBox_mapping, run_metrics.profiling)) if (args.workers > 1 or pipeline) and args.cell_workers <= 1 else None
+
+    # Runs of selected variants or outputs keep their own files and checkpoints, apart from full runs
+    selection = f'variants-{stage_key(variants, args.outputs)[:8]}' if variants != VARIANTS or args.outputs else None
+    if selection:
+        os.makedirs(f'./Data/{data_version}/{selection}', exist_ok=True)
+        with open(f'./Data/{data_version}/{selection}/selection.json', 'w') as outfile:
+            json.dump({'variants': variants, 'outputs': args.outputs}, outfile, indent=4)
+        print(f"writing to ./Data/{data_version}/{selection}")
+    if args.shard:
+        part = f'shards/shard_{args.shard[0]}_of_{args.shard[1]}'
+    elif args.queue:
+        worker_id = args.worker_id or default_worker_id()
+        part = f'shards/worker_{worker_id}'
+    else:
+        part = None
+    if selection:
+        part = f'{selection}/{part}' if part else selection
+    # Aggregated outputs and results store of each domain size
+    stores, aggregated = {}, {}
+    for domain_size in domain_sizes:
+        files = get_output_files(data_version, None, None, domain_size, part=part)
+        stores[domain_size] = ResultsStore(files['store']) if args.results == 'sqlite' else None
+        aggregated[domain_size] = {}
+        for name in AGGREGATED_OUTPUTS:
+            aggregated[domain_size][name] = load_answers(files[name]) if os.path.exists(files[name]) and not stores[domain_size] else {}
     
+    # Work left in each (n, m) cell and domain size: (example ids still to process, checkpoint entries of finished examples)
+    target_ids = range(test_num_start, min(len(data['example']), test_num_start + test_num))
+    if args.shard:
+        # Examples are dealt round-robin by id, so every shard gets a similar mix
+        target_ids = [i for i in target_ids if i % args.shard[1] == args.shard[0]]
+    if args.queue:
+        # Every worker queues the whole sweep (units already queued are kept), then claims batches
+        domain_size, = domain_sizes
+        queue = WorkQueue(args.queue, args.lease)
+        d = domain_size[0] * domain_size[1]
+        cells = {cell: list(target_ids) for cell in sweep_cells(n_range, m_range)}
+        costs, calibrated = estimate_cell_costs({cell: len(example_ids) for cell, example_ids in cells.items()}, domain_size, f'./Data/{data_version}/Logic')
+        queue.add(data_version, d, {cell: (example_ids, costs[cell] / max(len(example_ids), 1)) for cell, example_ids in cells.items()})
+        heartbeat = queue.start_heartbeat(worker_id)
+    else:
+        pending = {}
+        for n, m in sweep_cells(n_range, m_range):
+            for domain_size in domain_sizes:
+                example_ids, done = prepare_cell(data_version, n, m, domain_size, target_ids, aggregated[domain_size], output_format, part, test_num)
+                if example_ids:
+                    pending.setdefault((n, m), {})[domain_size] = (example_ids, done)
+        
+        # Cells are scheduled by their cost summed over the domain sizes
+        costs, calibrated = {cell: 0.0 for cell in pending}, True
+        for domain_size in domain_sizes:
+            cells = {cell: len(domains[domain_size][0]) for cell, domains in pending.items() if domain_size in domains}
+            domain_costs, domain_calibrated = estimate_cell_costs(cells, domain_size, f'./Data/{data_version}/Logic')
+            for cell, cost in domain_costs.items():
+                costs[cell] += cost
+            calibrated = calibrated and domain_calibrated
+        progress = SweepProgress(costs)
+        print(f"{len(pending)} cells to run, estimated solver time: {sum(costs.values()):.0f}{'s' if calibrated else ' (model units)'}")
     
-    for n in n_range:  # Iterate n from 3 to 10  3, 11
-        if n > 2:
-            m_range = range(n-1, n*(n-1)//2)
-        for m in m_range:
+    def finish_domains(n, m, domain_results, domains, wall):
+        started = time.perf_counter()
+        with stage_times.timer('write'):
+            for domain_size, results in domain_results.items():
+                finish_cell(data_version, n, m, domain_size, results, domains[domain_size][1], aggregated[domain_size], output_format, stores[domain_size], part)
+        example_times = [times for results in domain_results.values() for times in results[8].values()]
+        metrics.add_cell(n, m, example_times, wall + time.perf_counter() - started, stage_times.take())
+        metrics.write()
+        if run_metrics.profiling:
+            profile = stage_times.take_profile() or new_profile()
+            for results in domain_results.values():
+                profile = merge_profiles(profile, results[9])
+            path = get_output_files(data_version, n, m, domain_sizes[0], part=part)['profile']
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_profile(profile, path, f'n={n} m={m}')
+
+    if args.queue:
+        while True:
+            claimed = queue.claim(data_version, d, worker_id, args.claim_batch)
+            if not claimed:
+                break
+            for (n, m), claimed_ids in claimed.items():
+                print('n:', n, 'm:', m, 'examples:', claimed_ids[0], '-', claimed_ids[-1])
+                example_ids, done = prepare_cell(data_version, n, m, domain_size, claimed_ids, aggregated[domain_size], output_format, part)
+                if example_ids:
+                    started = time.perf_counter()
+                    domains = {domain_size: (example_ids, done)}
+                    writers, checkpoints = open_domain_writers(data_version, n, m, domains, part) if streamed else (None, None)
+                    results = generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, {domain_size: example_ids}, solver_options, recorder, executor, args.seed, writers, checkpoints, args.stage_cache, pipeline, args.workers, variants, args.outputs, args.early_abort, args.reuse_feasible)
+                    close_domain_writers(writers, checkpoints)
+                    finish_domains(n, m, results, domains, time.perf_counter() - started)
+                queue.complete(data_version, d, n, m, claimed_ids, worker_id)
+            counts = queue.counts(data_version, d)
+            print(f"units pending: {counts['pending']}, claimed: {counts['claimed']}, done: {counts['done']}")
+        heartbeat.set()
+        queue.close()
+    elif args.cell_workers > 1:
+        # Most expensive chunks of consecutive m first; a chunk's cells run in one worker, examples serially
+        cell_executor = ProcessPoolExecutor(args.cell_workers, initializer=init_cell_worker, initargs=(data['example'], asset_mapping, boundingBox_mapping, run_metrics.profiling))
+        futures = [
+            cell_executor.submit(run_cell_task, (n, [(m, {domain_size: example_ids for domain_size, (example_ids, done) in pending[n, m].items()}) for _, m in cells], solver_options, args.seed, recorder is not None, data_version, output_format, part, args.stage_cache, variants, args.outputs, args.early_abort, args.reuse_feasible))
+            for n, cells in schedule_cells(list(pending), costs, args.cell_workers)
+        ]
+        for future in as_completed(futures):
+            for n, m, results, records, wall in future.result():
+                print('n:', n, 'm:', m)
+                for record in records:
+                    recorder.write(record)
+                finish_domains(n, m, results, pending[n, m], wall)
+                progress.finish((n, m))
+        cell_executor.shutdown()
+    else:
+        for (n, m), domains in pending.items():
             print('n:', n, 'm:', m)
-            description_file = f'./Data/{data_version}/Text/n{n}_m{m}_d{domain_size[0]*domain_size[1]}.json'
-            facts_file = f'./Data/{data_version}/Logic/n{n}_m{m}_d{domain_size[0]*domain_size[1]}.json'
-            answers_file = f'./Data/{data_version}/Logic/answers_lengths_d{domain_size[0]*domain_size[1]}.json'
-            times_file = f'./Data/{data_version}/Logic/times_fr_take_d{domain_size[0]*domain_size[1]}.json'
-            times_yn_file = f'./Data/{data_version}/Logic/times_yn_take_d{domain_size[0]*domain_size[1]}.json'
-            skip_id_file = f'./Data/{data_version}/Logic/skip_id_d{domain_size[0]*domain_size[1]}.json'
-            solution_id_file = f'./Data/{data_version}/Logic/solution_id_d{domain_size[0]*domain_size[1]}.json'
-            # Check if cache exists
-            if cache_exists(description_file) and cache_exists(facts_file):
-                # Load cache
-                all_descriptions = load_cache(description_file)
-                all_facts = load_cache(facts_file)
-                # if len(all_descriptions) == test_num:
-                if all_descriptions[-1].get("example_id") == test_num - 1:
-                    answers_lengths = load_answers(answers_file)
-                    times_take = load_answers(times_file)
-                    times_yn_take = load_answers(times_yn_file)
-                    skip_id_dic = load_answers(skip_id_file)
-                    solution_id_dic  = load_answers(solution_id_file)
-                else:
-                    test_num_start = all_descriptions[-1]['example_id'] + 1
-                    k_start = len(all_descriptions)
-                    all_descriptions_new, all_facts_new, answers_length_new, times_take_new, times_take_yn_new, skip_id_list_new, solution_id_list_new = generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, test_num, test_num_start, k_start, domain_size)
-                    all_descriptions += all_descriptions_new
-                    all_facts += all_facts_new
-                    answers_lengths = load_answers(answers_file)
-                    times_take = load_answers(times_file)
-                    times_yn_take = load_answers(times_yn_file)
-                    skip_id_dic = load_answers(skip_id_file)
-                    solution_id_dic= load_answers(solution_id_file)
-                    answers_length = answers_lengths[n,m] 
-                    times_take_ = times_take[n,m] 
-                    times_yn_take_ = times_yn_take[n,m] 
-                    skip_id_list = skip_id_dic[n,m] 
-                    solution_id_list = solution_id_dic[n,m] 
-                    answers_length.update(answers_length_new)
-                    times_take_.update(times_take_new)
-                    times_yn_take_.update(times_take_yn_new)
-                    skip_id_list += (skip_id_list_new)
-                    solution_id_list += (solution_id_list_new)
-                    answers_lengths[n,m]  = answers_length
-                    times_take[n,m]  = times_take_
-                    times_yn_take[n,m]  = times_yn_take_
-                    skip_id_dic[n,m]  = skip_id_list
-                    solution_id_dic[n,m]  = solution_id_list
-            else:
-                k_start = 0
-                all_descriptions, all_facts, answers_length, times, times_yn, skip_id_list, solution_id_list = generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, test_num, test_num_start, k_start, domain_size)
-                if os.path.exists(answers_file):
-                    answers_lengths = load_answers(answers_file)
-                    times_take = load_answers(times_file)
-                    times_yn_take = load_answers(times_yn_file)
-                    skip_id_dic = load_answers(skip_id_file)
-                    solution_id_dic  = load_answers(solution_id_file)
-                answers_lengths[n,m]  = answers_length
-                times_take[n,m]  = times
-                times_yn_take[n,m]  = times_yn
-                skip_id_dic[n,m]  = skip_id_list
-                solution_id_dic[n,m]  = solution_id_list
-            save_descriptions_facts(all_descriptions, description_file)
-            save_descriptions_facts(all_facts, facts_file)
-            save_answers(answers_lengths, answers_file)
-            save_answers(times_take, times_file)
-            save_answers(times_yn_take, times_yn_file)
-            save_answers(skip_id_dic, skip_id_file)
-            save_answers(solution_id_dic, solution_id_file)
+            started = time.perf_counter()
+            writers, checkpoints = open_domain_writers(data_version, n, m, domains, part) if streamed else (None, None)
+            results = generate_descriptions_facts(data, asset_mapping, boundingBox_mapping, n, m, {domain_size: example_ids for domain_size, (example_ids, done) in domains.items()}, solver_options, recorder, executor, args.seed, writers, checkpoints, args.stage_cache, pipeline, args.workers, variants, args.outputs, args.early_abort, args.reuse_feasible)
+            close_domain_writers(writers, checkpoints)
+            finish_domains(n, m, results, domains, time.perf_counter() - started)
+            progress.finish((n, m))
+
+    if recorder:
+        recorder.close()
+    if executor:
+        executor.shutdown()
+    for store in stores.values():
+        if store:
+            store.close()
+    if args.stage_cache and args.stage_cache in stage_stores:
+        stages = stage_stores[args.stage_cache]
+        print('stage cache hits:', stages.hits, 'misses:', stages.misses)
+    metrics.write()
 
 
 if __name__ == '__main__':
@@ -1446,10 +1845,37 @@ if __name__ == '__main__':
     parser.add_argument('--test_num', type=int, default=1, help="Number of test cases to process.")
     parser.add_argument('--test_num_start', type=int, default=0, help="Index to start processing test cases.")
     parser.add_argument('--domain_size', type=tuple, default=(12, 12), help="Size of the domain grid as two integers (width, height).")
+    parser.add_argument('--domain_sizes', type=parse_domain_size, nargs='+', default=None, help="Several domain sizes as WxH (e.g. 12x12 20x20 50x50), solved in one pass from the same facts and text; overrides --domain_size.")
     parser.add_argument('--n_range', type=list, default=[5], help="Number of objects to consider.")
     parser.add_argument('--m_range', type=list, default=[4,5,6,7,8,9], help="Number of object pairs to consider.")
+    parser.add_argument('--ordering', type=str, default='default', choices=['default', 'query'], help="Solver variable/value ordering: python-constraint's default or query-aware heuristics.")
+    parser.add_argument('--normalize', action='store_true', help="Normalize fact sets (dedupe, inverse folding, transitive reduction) before solving.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes used to handle examples in parallel.")
+    parser.add_argument('--cell_workers', type=int, default=1, help="Number of processes running (n, m) cells in parallel, in chunks of consecutive m, most expensive chunk first.")
+    parser.add_argument('--pipeline', type=str, default='serial', choices=['serial', 'async'], help="Process each cell's examples one after another, or in an asyncio pipeline overlapping fact building, solving, rendering and writing.")
+    parser.add_argument('--queue_size', type=int, default=8, help="Bound of each queue between stages of the async pipeline.")
+    parser.add_argument('--seed', type=int, default=0, help="Global seed; each example draws from its own stream seeded by (seed, example_id, n, m).")
+    parser.add_argument('--record', type=str, default=None, help="Append every solver problem, answer and time to this gzipped JSON-lines replay log.")
+    parser.add_argument('--output_format', type=str, default='json', choices=['json', 'jsonl'], help="Write Text/Logic cell files as pretty-printed JSON, or append one JSON line per example.")
+    parser.add_argument('--shard', type=parse_shard, default=None, help="Process only shard k/N (0 <= k < N) of the examples, writing to Data/<data_version>/shards; merge with merge_shards.py.")
+    parser.add_argument('--queue', type=str, default=None, help="SQLite work queue shared by several workers; each claims (example_id, n, m) units and writes to Data/<data_version>/shards/worker_<id>.")
+    parser.add_argument('--worker_id', type=str, default=None, help="Name of this queue worker (default: hostname-pid).")
+    parser.add_argument('--claim_batch', type=int, default=10, help="Number of units a queue worker claims at a time.")
+    parser.add_argument('--lease', type=float, default=300, help="Seconds without a heartbeat after which a worker's claimed units are re-queued.")
+    parser.add_argument('--stage_cache', type=str, default=None, help="SQLite file storing the facts and solver results of each example, keyed by their inputs; re-runs reuse them and only redo later stages.")
+    parser.add_argument('--variants', type=str, nargs='+', default=None, choices=VARIANTS, help="Fact variants to solve and write (default: all, or those the --outputs keys need).")
+    parser.add_argument('--outputs', type=str, nargs='+', default=None, help="Keys to write to the Text/Logic files, as fnmatch patterns such as 'solver_fr_o2_d3*' (default: all).")
+    parser.add_argument('--reuse_feasible', action='store_true', help="Only re-check the relations still feasible at a smaller m of the same example; times_fr_take then holds these narrowed solve times.")
+    parser.add_argument('--early_abort', action='store_true', help="Check first that every variant has a feasible relation, one solve per variant with the fewest facts first, and skip the other solves and the Text record of examples that fail.")
+    parser.add_argument('--metrics', type=str, default=None, help="Write wall/CPU seconds per stage, examples per second and latency percentiles, per (n, m) cell and in total, to this JSON file after every cell.")
+    parser.add_argument('--progress', action='store_true', help="Print a progress line with throughput and latency percentiles as examples finish, and a summary per cell.")
+    parser.add_argument('--profile', type=str, nargs='+', default=None, help="Profile these stages (fnmatch patterns such as describe 'solve_*' render write) and write a .prof file and a top-allocations report per (n, m) cell to Logic/profiles.")
+    parser.add_argument('--profile_tools', type=str, nargs='+', default=['cprofile'], choices=['cprofile', 'tracemalloc'], help="Profilers run under --profile: cProfile for call stats, tracemalloc for allocations (slower).")
+    parser.add_argument('--results', type=str, default='json', choices=['json', 'sqlite'], help="Keep answer lengths, times, skip and solution ids in the aggregated JSON files or in a SQLite store.")
     
     args = parser.parse_args()
+    if args.queue and args.domain_sizes and len(args.domain_sizes) > 1:
+        parser.error("--queue runs a single domain size")
     
     # Pass the parsed arguments to the main function
     main(args)
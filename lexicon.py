@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Words used to render objects in generate_vary_m_n.py, worked out once per object type.
+
+Lexicon maps an assetId to the display name of its object type ("TV stand",
+"alarm clock"), its plural as used in "some alarm clocks: " and its indefinite
+article. Entries of all types of the asset mapping are built up front, and
+those of unknown asset ids (rendered from the id itself) on first use.
+"""
+
+import re
+from typing import NamedTuple
+
+# Display names that do not follow the CamelCase split
+NAME_EXCEPTIONS = {'tvstand': 'TV stand', 'cd': 'CD', 'tabletopdecor': 'tabletop decor'}
+
+
+def display_name(object_type):
+    """'AlarmClock' -> 'alarm clock', except for NAME_EXCEPTIONS."""
+    if object_type.lower() in NAME_EXCEPTIONS:
+        return NAME_EXCEPTIONS[object_type.lower()]
+    words = re.findall('[A-Z][a-z]*', object_type)
+    return ' '.join(words).lower()
+
+
+class LexiconEntry(NamedTuple):
+    name: str
+    plural: str
+    article: str
+
+
+def lexicon_entry(object_type):
+    name = display_name(object_type)
+    return LexiconEntry(name, f'{name}s', 'an' if name[:1] in ('a', 'e', 'i', 'o', 'u') else 'a')
+
+
+class Lexicon:
+    """Lexicon entries by assetId, for the object types of `asset_mapping` (assetId -> object type)."""
+
+    def __init__(self, asset_mapping):
+        self.asset_mapping = asset_mapping
+        types = {object_type: lexicon_entry(object_type) for object_type in set(asset_mapping.values())}
+        self.entries = {asset_id: types[object_type] for asset_id, object_type in asset_mapping.items()}
+
+    def entry(self, asset_id):
+        entry = self.entries.get(asset_id)
+        if entry is None:
+            entry = self.entries[asset_id] = lexicon_entry(self.asset_mapping.get(asset_id, asset_id))
+        return entry
+
+    def name(self, asset_id):
+        return self.entry(asset_id).name
+
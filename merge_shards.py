@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Merge the outputs of sharded generate_vary_m_n.py runs (--shard k/N) or of
+queue workers (--queue) into the canonical Text/Logic files of a dataset:
+
+    python merge_shards.py Data/SD-100 --domain_size 12 12
+
+Cell files are merged in example_id order and written as pretty-printed JSON,
+whether the shards wrote JSON or JSON lines. An example written by several
+workers (after a re-queued claim) is kept once. The aggregated answers/times/skip/
+solution/dropped files are merged per (n, m) cell, from each shard's JSON files or its
+results store. Shards of a run of selected variants or outputs are merged within
+its directory, e.g. Data/SD-100/variants-<digest>.
+"""
+
+import argparse
+import json
+import os
+import re
+from pathlib import Path
+
+from results_store import ResultsStore, AGGREGATED_FILES, VALUE_OUTPUTS
+from stream_output import read_jsonl
+
+SHARD_DIR = re.compile(r'shard_(\d+)_of_(\d+)$')
+
+
+def find_shards(data_dir):
+    """Return {name: directory} of the shard and queue worker directories of a dataset directory."""
+    shards_dir = Path(data_dir, 'shards')
+    if not shards_dir.is_dir():
+        return {}
+    return {path.name: path for path in sorted(shards_dir.iterdir()) if path.is_dir()}
+
+
+def check_shards(shards):
+    """Warn about shard sets that do not cover every k of their N."""
+    indices = [tuple(map(int, match.groups())) for match in map(SHARD_DIR.match, shards) if match]
+    for N in sorted({N for k, N in indices}):
+        missing = sorted(set(range(N)) - {k for k, n in indices if n == N})
+        if missing:
+            print(f"warning: shards {', '.join(f'{k}/{N}' for k in missing)} not found")
+
+
+def read_records(path):
+    if path.suffix == '.jsonl':
+        return read_jsonl(path)
+    with path.open() as file:
+        return json.load(file)
+
+
+def load_aggregated(path):
+    """Load an aggregated Logic file as {(n, m): {example_id: value}} or {(n, m): [example_id, ...]}."""
+    with open(path) as file:
+        data = json.load(file)
+    aggregated = {}
+    for key, value in data.items():
+        n, m = map(int, key.split('_'))
+        aggregated[n, m] = {int(i): v for i, v in value.items()} if isinstance(value, dict) else [int(i) for i in value]
+    return aggregated
+
+
+def merge_cell_files(shards, data_dir, domain_area):
+    """Merge the per-cell Text/Logic files of all shards; returns the number of files written."""
+    cell_file = re.compile(rf'n\d+_m\d+_d{domain_area}\.jsonl?$')
+    cells = {}
+    for shard_dir in shards.values():
+        for folder in ('Text', 'Logic'):
+            for path in (shard_dir / folder).glob(f'n*_m*_d{domain_area}.json*'):
+                if cell_file.match(path.name):
+                    cells.setdefault((folder, path.name.split('.')[0]), []).append(path)
+
+    for (folder, stem), paths in sorted(cells.items()):
+        records = {}
+        for path in paths:
+            for record in read_records(path):
+                records[record['example_id']] = record
+        output = Path(data_dir, folder, f'{stem}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with output.open('w') as outfile:
+            json.dump([records[i] for i in sorted(records)], outfile, indent=4)
+    return len(cells)
+
+
+def merge_aggregated(shards, data_dir, domain_area):
+    """Merge the aggregated outputs of all shards into the dataset's Logic files, cell by cell."""
+    data_dir = Path(data_dir).resolve()
+    data_version = data_dir.parent.name if data_dir.name.startswith('variants-') else data_dir.name
+    stores = {}
+    for shard, shard_dir in shards.items():
+        store_path = shard_dir / 'Logic' / 'results.sqlite'
+        if store_path.exists():
+            stores[shard] = ResultsStore(str(store_path))
+
+    for name, file_name in AGGREGATED_FILES.items():
+        output = Path(data_dir, 'Logic', file_name.format(d=domain_area))
+        merged = load_aggregated(output) if output.exists() else {}
+        shard_cells = {}
+        for shard, shard_dir in shards.items():
+            path = shard_dir / 'Logic' / file_name.format(d=domain_area)
+            if shard in stores:
+                results = stores[shard].load(name, data_version, domain_area)
+            elif path.exists():
+                results = load_aggregated(path)
+            else:
+                continue
+            for cell, value in results.items():
+                if name in VALUE_OUTPUTS:
+                    shard_cells.setdefault(cell, {}).update(value)
+                else:
+                    shard_cells.setdefault(cell, set()).update(value)
+        for cell, value in shard_cells.items():
+            merged[cell] = {i: value[i] for i in sorted(value)} if name in VALUE_OUTPUTS else sorted(value)
+
+        output.parent.mkdir(parents=True, exist_ok=True)
+        with output.open('w') as outfile:
+            json.dump({f'{n}_{m}': merged[n, m] for n, m in sorted(merged)}, outfile, indent=4)
+
+    for store in stores.values():
+        store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge sharded generate_vary_m_n.py outputs into the canonical Text/Logic files.")
+    parser.add_argument('data_dir', help="Dataset directory, e.g. Data/SD-100 or Data/SD-100/variants-<digest>.")
+    parser.add_argument('--domain_size', type=int, nargs=2, default=[12, 12], metavar=('W', 'H'), help="Domain size of the files to merge.")
+    args = parser.parse_args()
+
+    shards = find_shards(args.data_dir)
+    if not shards:
+        raise SystemExit(f"no shards found in {os.path.join(args.data_dir, 'shards')}")
+    check_shards(shards)
+    domain_area = args.domain_size[0] * args.domain_size[1]
+    cell_files = merge_cell_files(shards, args.data_dir, domain_area)
+    merge_aggregated(shards, args.data_dir, domain_area)
+    print(f"merged {len(shards)} shards into {cell_files} cell files and the aggregated Logic files")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Capture and replay of real solver workloads.
+
+generate_vary_m_n.py --record appends every solver problem to a gzipped
+JSON-lines log; this script re-runs such a log with any solver backend and
+compares answers and solver times with the recorded ones.
+"""
+
+import argparse
+import gzip
+import json
+import time
+from solver import solve_all_candidates, solve_single_candidate, solve_any_candidate, parse_request_example, LatencyStats, SOLVER_BACKENDS
+
+
+def make_record(kind, variant, example, n, m, domain_size, solver_options, result, solve_time, relation=None, candidates=None, feasible=()):
+    """
+    Build one replay log record; `kind` is 'fr' (all candidates), 'yn' (single candidate) or
+    'probe' (any candidate, see solve_any_candidate). An 'fr' solve restricted to `candidates`,
+    or skipping the `feasible` relations already found by a probe, is replayed the same way.
+    """
+    record = {
+        'kind': kind,
+        'variant': variant,
+        'example_id': example['example_id'],
+        'n': n,
+        'm': m,
+        'domain_size': list(domain_size),
+        'options': solver_options,
+        'facts': example['facts'],
+        'query': example['query'],
+        'positions': example.get('positions'),
+        'relation': relation,
+        'result': result,
+        'time': solve_time,
+    }
+    if candidates is not None:
+        record['candidates'] = list(candidates)
+    if feasible:
+        record['feasible'] = list(feasible)
+    return record
+
+
+class WorkloadRecorder:
+    """Appends solver problems with their observed answer and time to a replay log."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, 'at')
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+
+    def record(self, *args, **kwargs):
+        self.write(make_record(*args, **kwargs))
+
+    def close(self):
+        self.file.close()
+
+
+class WorkloadBuffer(list):
+    """Collects records in memory, e.g. in a worker process, for a WorkloadRecorder to write later."""
+
+    def write(self, record):
+        self.append(record)
+
+
+def read_workload(path):
+    """Yield the records of a replay log."""
+    with gzip.open(path, 'rt') as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def replay_workload(path, options, limit=None):
+    """Re-solve a replay log; return recorded and replayed latencies, mismatches and the slowest problems."""
+    recorded, replayed = LatencyStats(), LatencyStats()
+    mismatches = []
+    slowest = []
+    for k, record in enumerate(read_workload(path)):
+        if limit is not None and k >= limit:
+            break
+        example = parse_request_example(record)
+        domain_size = tuple(record['domain_size'])
+        if record['kind'] == 'fr':
+            answer, solve_time = solve_all_candidates(example, domain_size, candidates=record.get('candidates'), feasible=record.get('feasible', ()), **options)
+        elif record['kind'] == 'probe':
+            answer, solve_time = solve_any_candidate(example, domain_size, **options)
+        else:
+            answer, solve_time = solve_single_candidate(example, record['relation'], domain_size, **options)
+
+        for stats, seconds in ((recorded, record['time']), (replayed, solve_time)):
+            stats.record(record['kind'], seconds)
+            stats.record(f"{record['kind']}_{record['variant']}", seconds)
+        # Probes may find any feasible relation; only whether there is one must match
+        matches = (answer is None) == (record['result'] is None) if record['kind'] == 'probe' else answer == record['result']
+        if not matches:
+            mismatches.append({'index': k, 'example_id': record['example_id'], 'n': record['n'], 'm': record['m'],
+                               'variant': record['variant'], 'recorded': record['result'], 'replayed': answer})
+        slowest.append((record['time'], solve_time, k, record['example_id'], record['n'], record['m'], record['kind'], record['variant']))
+    slowest.sort(reverse=True)
+    return recorded.summary(), replayed.summary(), mismatches, slowest
+
+
+def main(args):
+    options = SOLVER_BACKENDS[args.backend]
+    start_time = time.perf_counter()
+    recorded, replayed, mismatches, slowest = replay_workload(args.log, options, args.limit)
+    wall_time = time.perf_counter() - start_time
+
+    for op in sorted(recorded):
+        if '_' in op:
+            continue
+        speedup = recorded[op]['mean'] / replayed[op]['mean'] if replayed[op]['mean'] else float('inf')
+        print(f"{op}: {recorded[op]['count']} problems, mean {recorded[op]['mean']:.4f}s -> {replayed[op]['mean']:.4f}s ({speedup:.2f}x), "
+              f"p99 {recorded[op]['p99']:.4f}s -> {replayed[op]['p99']:.4f}s")
+    print(f"Mismatched answers: {len(mismatches)}")
+    for recorded_time, replayed_time, k, example_id, n, m, kind, variant in slowest[:args.top]:
+        print(f"  slowest #{k}: example {example_id} n={n} m={m} {kind} {variant}: {recorded_time:.4f}s -> {replayed_time:.4f}s")
+
+    if args.output:
+        report = {
+            'log': args.log,
+            'backend': args.backend,
+            'wall_time': wall_time,
+            'recorded': recorded,
+            'replayed': replayed,
+            'mismatches': mismatches,
+            'slowest': [dict(zip(['recorded_time', 'replayed_time', 'index', 'example_id', 'n', 'm', 'kind', 'variant'], s)) for s in slowest[:args.top]],
+        }
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=4)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Replay a recorded solver workload.")
+    parser.add_argument('log', type=str, help="Replay log written by generate_vary_m_n.py --record.")
+    parser.add_argument('--backend', type=str, default='default', choices=list(SOLVER_BACKENDS), help="Solver backend to replay with.")
+    parser.add_argument('--limit', type=int, default=None, help="Replay only the first N problems.")
+    parser.add_argument('--top', type=int, default=10, help="Number of slowest recorded problems to list.")
+    parser.add_argument('--output', type=str, default=None, help="Optional path of a JSON report.")
+
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite store for the per-example answer lengths, timings, skip ids, solution ids
+and dropped ids of generate_vary_m_n.py.
+
+With --results sqlite each finished (n, m) cell is written in one transaction
+instead of rewriting the aggregated JSON files for the whole sweep. Run this
+script to export the store to those JSON files:
+
+    python results_store.py Data/SD-100/Logic/results.sqlite --data_version SD-100 --domain_size 12 12
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+
+# Aggregated Logic files, named by domain area d; the layout every consumer of the dataset expects
+AGGREGATED_FILES = {
+    'answers': 'answers_lengths_d{d}.json',
+    'times': 'times_fr_take_d{d}.json',
+    'times_yn': 'times_yn_take_d{d}.json',
+    'skip_id': 'skip_id_d{d}.json',
+    'solution_id': 'solution_id_d{d}.json',
+    'dropped_id': 'dropped_id_d{d}.json',
+}
+
+# Outputs holding a value per example; the others are lists of example ids
+VALUE_OUTPUTS = ['answers', 'times', 'times_yn']
+
+
+class ResultsStore:
+    """Results keyed by (data_version, domain, n, m, example_id), one table per aggregated output."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        with self.connection:
+            # Finished cells, so cells without any skip or solution id are still exported
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS cells (data_version TEXT, domain INTEGER, n INTEGER, m INTEGER, "
+                "PRIMARY KEY (data_version, domain, n, m)) WITHOUT ROWID"
+            )
+            for name in AGGREGATED_FILES:
+                value_column = ', value TEXT NOT NULL' if name in VALUE_OUTPUTS else ''
+                self.connection.execute(
+                    f"CREATE TABLE IF NOT EXISTS {name} (data_version TEXT, domain INTEGER, n INTEGER, m INTEGER, example_id INTEGER{value_column}, "
+                    "PRIMARY KEY (data_version, domain, n, m, example_id)) WITHOUT ROWID"
+                )
+
+    def replace_cell(self, data_version, domain, n, m, cell_results):
+        """Replace all results of an (n, m) cell in a single transaction."""
+        key = (data_version, domain, n, m)
+        with self.connection:
+            self.connection.execute("INSERT OR IGNORE INTO cells VALUES (?, ?, ?, ?)", key)
+            for name, value in cell_results.items():
+                self.connection.execute(f"DELETE FROM {name} WHERE data_version = ? AND domain = ? AND n = ? AND m = ?", key)
+                if name in VALUE_OUTPUTS:
+                    rows = [key + (int(i), json.dumps(v)) for i, v in value.items()]
+                    self.connection.executemany(f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?, ?)", rows)
+                else:
+                    rows = [key + (int(i),) for i in value]
+                    self.connection.executemany(f"INSERT INTO {name} VALUES (?, ?, ?, ?, ?)", rows)
+
+    def load(self, name, data_version, domain):
+        """Return {(n, m): {example_id: value}} or {(n, m): [example_id, ...]} like load_answers."""
+        select = "n, m, example_id, value" if name in VALUE_OUTPUTS else "n, m, example_id"
+        rows = self.connection.execute(
+            f"SELECT {select} FROM {name} WHERE data_version = ? AND domain = ? ORDER BY n, m, example_id", (data_version, domain)
+        )
+        cells = self.connection.execute(
+            "SELECT n, m FROM cells WHERE data_version = ? AND domain = ? ORDER BY n, m", (data_version, domain)
+        )
+        results = {cell: {} if name in VALUE_OUTPUTS else [] for cell in cells}
+        for row in rows:
+            if name in VALUE_OUTPUTS:
+                results.setdefault(row[:2], {})[row[2]] = json.loads(row[3])
+            else:
+                results.setdefault(row[:2], []).append(row[2])
+        return results
+
+    def export_json(self, data_version, domain, logic_dir):
+        """Write the aggregated JSON files of a data version and domain area to `logic_dir`."""
+        for name, file_name in AGGREGATED_FILES.items():
+            results = {f'{n}_{m}': value for (n, m), value in self.load(name, data_version, domain).items()}
+            with open(os.path.join(logic_dir, file_name.format(d=domain)), 'w') as outfile:
+                json.dump(results, outfile, indent=4)
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a results store to the aggregated Logic JSON files.")
+    parser.add_argument('store', help="Path of the SQLite results store.")
+    parser.add_argument('--data_version', type=str, default='SD-100', help="Data version to export.")
+    parser.add_argument('--domain_size', type=int, nargs=2, default=[12, 12], metavar=('W', 'H'), help="Domain size to export.")
+    parser.add_argument('--output_dir', type=str, default=None, help="Directory of the JSON files (default: the store's directory).")
+    args = parser.parse_args()
+
+    output_dir = args.output_dir or os.path.dirname(args.store) or '.'
+    os.makedirs(output_dir, exist_ok=True)
+    store = ResultsStore(args.store)
+    store.export_json(args.data_version, args.domain_size[0] * args.domain_size[1], output_dir)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
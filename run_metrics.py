@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stage timers and throughput metrics of generate_vary_m_n.py runs.
+
+Code run under `stage_times.timer(stage)` adds its wall and CPU seconds to the
+stage. Each thread of each process keeps its own times; take() hands those
+gathered since the last call to the example result they belong to, so times
+measured in pool workers travel back with the results. RunMetrics aggregates
+them per (n, m) cell (seconds per stage, examples per second and percentiles of
+the per-example latency, the wall time of all stages of an example) and writes
+them as JSON. With enable_progress, a progress line is printed as examples finish.
+
+With enable_profiling, the stages matching its patterns also run under cProfile
+and/or tracemalloc. Profiles and allocation differences are handed over with
+take_profile() like the times, merged per cell with merge_profiles and written
+by write_profile as a .prof file (for pstats or snakeviz) and a text report of
+the top allocations.
+"""
+
+import cProfile
+import fnmatch
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Stage patterns and tools ('cprofile', 'tracemalloc') set by enable_profiling
+profiling = None
+# Frames kept per traced allocation, allocation sites kept per stage and example, and lines of the report
+TRACEMALLOC_FRAMES = 1
+ALLOCATION_LIMIT = 50
+ALLOCATION_REPORT = 30
+
+
+def enable_profiling(stages, tools=('cprofile',)):
+    global profiling
+    profiling = (list(stages), set(tools))
+    if 'tracemalloc' in profiling[1] and not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+def profiled(stage):
+    return profiling is not None and any(fnmatch.fnmatchcase(stage, pattern) for pattern in profiling[0])
+
+
+def new_profile():
+    """Empty profile data: cProfile stats, {(stage, file, line): [size, count]} allocated and {stage: peak bytes}."""
+    return {'stats': {}, 'allocations': {}, 'peaks': {}}
+
+def merge_profiles(total, profile):
+    if not profile:
+        return total
+    total = total or new_profile()
+    for function, stat in profile['stats'].items():
+        total['stats'][function] = pstats.add_func_stats(total['stats'].get(function, (0, 0, 0, 0, {})), stat)
+    for site, (size, count) in profile['allocations'].items():
+        site_total = total['allocations'].setdefault(site, [0, 0])
+        site_total[0] += size
+        site_total[1] += count
+    for stage, peak in profile['peaks'].items():
+        total['peaks'][stage] = max(total['peaks'].get(stage, 0), peak)
+    return total
+
+
+class ProfileStats:
+    """cProfile stats in the form pstats.Stats loads them from."""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def write_profile(profile, path, title):
+    """Write the cProfile stats of `profile` to `path`.prof and its top allocations to `path`.alloc.txt."""
+    if profile['stats']:
+        pstats.Stats(ProfileStats(dict(profile['stats']))).dump_stats(f'{path}.prof')
+    if not profile['allocations'] and not profile['peaks']:
+        return
+    allocations = sorted(profile['allocations'].items(), key=lambda item: -item[1][0])
+    with open(f'{path}.alloc.txt', 'w') as file:
+        file.write(f"Top allocations of {title}: memory still allocated at the end of each profiled stage, summed over examples\n\n")
+        file.write(f"{'stage':<24} {'KiB':>12} {'blocks':>10}  location\n")
+        for (stage, filename, lineno), (size, count) in allocations[:ALLOCATION_REPORT]:
+            file.write(f"{stage:<24} {size / 1024:>12.1f} {count:>10}  {filename}:{lineno}\n")
+        file.write("\nPeak traced memory of a stage run, in KiB\n\n")
+        for stage, peak in sorted(profile['peaks'].items()):
+            file.write(f"{stage:<24} {peak / 1024:>12.1f}\n")
+
+
+class StageTimes(threading.local):
+    def __init__(self):
+        self.times = {}
+        self.profiler = None
+        self.profile = None
+        self.profiling = False
+
+    @contextmanager
+    def timer(self, stage):
+        profile = self.start_profile() if profiled(stage) else None
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - wall, time.thread_time() - cpu)
+            if profile is not None:
+                self.stop_profile(stage, profile)
+
+    def start_profile(self):
+        if self.profiling:
+            # Nested stages are profiled as part of the outer one
+            return None
+        self.profiling = True
+        started = {}
+        if 'tracemalloc' in profiling[1]:
+            # Only blocks allocated during the stage are traced, which keeps its snapshot small
+            tracemalloc.clear_traces()
+            started['tracemalloc'] = True
+        if 'cprofile' in profiling[1]:
+            self.profiler = self.profiler or cProfile.Profile()
+            try:
+                self.profiler.enable()
+                started['cprofile'] = True
+            except ValueError:
+                # Another profiler is active (Python 3.12+ allows one per process); time only
+                pass
+        return started
+
+    def stop_profile(self, stage, started):
+        self.profiling = False
+        if started.get('cprofile'):
+            self.profiler.disable()
+        self.profile = self.profile or new_profile()
+        if started.get('tracemalloc'):
+            self.profile['peaks'][stage] = max(self.profile['peaks'].get(stage, 0), tracemalloc.get_traced_memory()[1])
+            filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+            statistics = tracemalloc.take_snapshot().filter_traces(filters).statistics('lineno')
+            for statistic in statistics[:ALLOCATION_LIMIT]:
+                frame = statistic.traceback[0]
+                site = self.profile['allocations'].setdefault((stage, frame.filename, frame.lineno), [0, 0])
+                site[0] += statistic.size
+                site[1] += statistic.count
+
+    def take_profile(self):
+        """Return the profile data gathered since the last take_profile() of this thread, or None."""
+        if self.profiler:
+            self.profiler.create_stats()
+            self.profile = self.profile or new_profile()
+            self.profile['stats'] = self.profiler.stats
+            self.profiler = None
+        profile, self.profile = self.profile, None
+        return profile
+
+    def add(self, stage, wall, cpu):
+        total = self.times.setdefault(stage, [0.0, 0.0])
+        total[0] += wall
+        total[1] += cpu
+
+    def take(self):
+        """Return {stage: [wall, cpu]} timed since the last take() of this thread."""
+        times, self.times = self.times, {}
+        return times
+
+stage_times = StageTimes()
+
+
+def merge_times(total, times):
+    for stage, (wall, cpu) in times.items():
+        stage_total = total.setdefault(stage, [0.0, 0.0])
+        stage_total[0] += wall
+        stage_total[1] += cpu
+    return total
+
+
+def percentiles(values):
+    """p50/p95/p99 by nearest rank (the ceil(q * n)-th smallest value) and the max of `values`."""
+    values = sorted(values)
+    if not values:
+        return {}
+    # -(-a // b) is ceil(a / b) in integers, without float rounding at exact ranks
+    return {
+        **{f'p{percent}': values[-(-percent * len(values) // 100) - 1] for percent in (50, 95, 99)},
+        'max': values[-1],
+    }
+
+
+def stage_summary(times):
+    return {stage: {'wall': wall, 'cpu': cpu} for stage, (wall, cpu) in sorted(times.items())}
+
+
+class ProgressLine:
+    """Prints examples done, throughput and latency percentiles, at most every `interval` seconds."""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.start = self.printed = time.perf_counter()
+        self.latencies = []
+
+    def update(self, latency):
+        self.latencies.append(latency)
+        now = time.perf_counter()
+        if now - self.printed >= self.interval:
+            self.printed = now
+            print(self.line(now))
+
+    def line(self, now):
+        latency = percentiles(self.latencies)
+        return (
+            f"progress: {len(self.latencies)} examples, {len(self.latencies) / (now - self.start):.1f} examples/s, "
+            f"latency p50 {latency['p50']:.3f}s p95 {latency['p95']:.3f}s p99 {latency['p99']:.3f}s"
+        )
+
+
+progress_line = None
+
+def enable_progress(interval=1.0):
+    global progress_line
+    progress_line = ProgressLine(interval)
+
+def example_done(times):
+    """Report the {stage: [wall, cpu]} of a finished example to the progress line, if enabled."""
+    if progress_line:
+        progress_line.update(sum(wall for wall, cpu in times.values()))
+
+
+class RunMetrics:
+    """Stage times, throughput and latencies of a run, per (n, m) cell and in total, written to `path`."""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.stages = {}
+        self.latencies = []
+        self.cells = {}
+
+    def add_stages(self, times):
+        """Add times of stages outside the examples of a cell, such as loading the data."""
+        merge_times(self.stages, times)
+
+    def add_cell(self, n, m, example_times, wall, cell_times=None):
+        """
+        Add a finished cell: `example_times` lists the {stage: [wall, cpu]} of each example
+        result, `wall` is the cell's wall time and `cell_times` the times of its cell-level stages.
+        """
+        stages = merge_times({}, cell_times or {})
+        latencies = []
+        for times in example_times:
+            merge_times(stages, times)
+            latencies.append(sum(stage_wall for stage_wall, stage_cpu in times.values()))
+        merge_times(self.stages, stages)
+        self.latencies += latencies
+        cell = self.cells.setdefault(f'{n}_{m}', {'n': n, 'm': m, 'examples': 0, 'wall': 0.0, 'stages': {}, 'latencies': []})
+        cell['examples'] += len(latencies)
+        cell['wall'] += wall
+        merge_times(cell['stages'], stages)
+        cell['latencies'] += latencies
+        if progress_line:
+            print(f"cell n={n} m={m}: {len(latencies)} examples in {wall:.2f}s, {len(latencies) / wall if wall else 0.0:.1f} examples/s")
+
+    def summary(self):
+        wall = time.perf_counter() - self.start
+        return {
+            'wall': wall,
+            'cpu': time.process_time() - self.cpu_start,
+            'examples': len(self.latencies),
+            'examples_per_second': len(self.latencies) / wall if wall else 0.0,
+            'stages': stage_summary(self.stages),
+            'latency': percentiles(self.latencies),
+            'cells': {
+                key: {
+                    'n': cell['n'],
+                    'm': cell['m'],
+                    'examples': cell['examples'],
+                    'wall': cell['wall'],
+                    'examples_per_second': cell['examples'] / cell['wall'] if cell['wall'] else 0.0,
+                    'stages': stage_summary(cell['stages']),
+                    'latency': percentiles(cell['latencies']),
+                }
+                for key, cell in self.cells.items()
+            },
+        }
+
+    def write(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'w') as file:
+            json.dump(self.summary(), file, indent=4)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pairwise spatial relations of all objects of a scene, computed at once with NumPy.
+
+SceneRelations holds, for every ordered pair (i, j) of objects, the direction
+of i relative to j and their distance on the x-z plane, with the close/medium/far
+labels derived from it. Directions compare x (west/east) and z (south/north);
+the three-way labels split the room diagonal in thirds (`<=` each third), and
+the two-way labels halve the room size, with a strict `<` for the top-down
+descriptions and `<=` for the south-door ones at the halfway threshold.
+"""
+
+import numpy as np
+
+# Direction tables indexed by [north/south][east/west]: 0 for south/west (smaller
+# z/x than the other object), 1 for the same coordinate, 2 for north/east
+DIRECTION_SYMBOLS = [['SW', 'S', 'SE'], ['W', 'O', 'E'], ['NW', 'N', 'NE']]
+DIRECTIONS_TD = [
+    ['south-west', 'south', 'south-east'],
+    ['west', 'at the same position', 'east'],
+    ['north-west', 'north', 'north-east'],
+]
+DIRECTIONS_SD = [
+    ['behind and to the left of', 'behind', 'behind and to the right of'],
+    ['to the left of', 'at the same position', 'to the right of'],
+    ['in front of and to the left of', 'in front of', 'in front of and to the right of'],
+]
+ANSWERS_SD = [
+    ['behind-left', 'behind', 'behind-right'],
+    ['left', 'at the same position', 'right'],
+    ['front-left', 'front', 'front-right'],
+]
+
+DISTANCES_3 = [("at a short distance", "CL3"), ("at a moderate distance", "MD3"), ("at a far distance", "FR3")]
+DISTANCES_2 = [("at a short distance", "CL2"), ("at a far distance", "FR2")]
+
+# Relative distance to a threshold below which a pair's distance is recomputed in pure Python
+THRESHOLD_MARGIN = 1e-9
+
+
+class SceneRelations:
+    """Relations between the objects at `positions` ((x, y, z) tuples) in a room of size `room_dimensions`."""
+
+    def __init__(self, positions, room_dimensions):
+        coordinates = np.array(positions, dtype=float).reshape(len(positions), 3)
+        x, z = coordinates[:, 0], coordinates[:, 2]
+        self.vertical = np.sign(z[:, None] - z[None, :]).astype(np.int8) + 1
+        self.horizontal = np.sign(x[:, None] - x[None, :]).astype(np.int8) + 1
+        self.distance = ((x[:, None] - x[None, :]) ** 2 + (z[:, None] - z[None, :]) ** 2) ** 0.5
+
+        max_distance_3 = (room_dimensions**2 + room_dimensions**2)**0.5
+        close_threshold, medium_threshold = max_distance_3 / 3, 2 * max_distance_3 / 3
+        half = room_dimensions / 2
+
+        # NumPy squares and roots may round the last bit differently from Python's float power,
+        # so distances next to a threshold are recomputed with it, as the published datasets were
+        near = np.zeros(self.distance.shape, dtype=bool)
+        for threshold in (close_threshold, medium_threshold, half):
+            near |= np.abs(self.distance - threshold) <= THRESHOLD_MARGIN * max(abs(threshold), 1.0)
+        for i, j in zip(*np.nonzero(near)):
+            (x1, _, z1), (x2, _, z2) = positions[i], positions[j]
+            self.distance[i, j] = ((x1 - x2)**2 + (z1 - z2)**2)**0.5
+
+        self.distance_3 = (self.distance > close_threshold).astype(np.int8) + (self.distance > medium_threshold)
+        self.distance_2 = (self.distance >= half).astype(np.int8)
+        self.distance_2_sd = (self.distance > half).astype(np.int8)
+
+    def direction(self, i, j):
+        return self.vertical[i, j], self.horizontal[i, j]
+
+    def symbol(self, i, j):
+        vertical, horizontal = self.direction(i, j)
+        return DIRECTION_SYMBOLS[vertical][horizontal]
+
+    def sd(self, i, j):
+        vertical, horizontal = self.direction(i, j)
+        return DIRECTIONS_SD[vertical][horizontal]
+
+    def td(self, i, j):
+        vertical, horizontal = self.direction(i, j)
+        return DIRECTIONS_TD[vertical][horizontal]
+
+    def answer_sd(self, i, j):
+        vertical, horizontal = self.direction(i, j)
+        return ANSWERS_SD[vertical][horizontal]
+
+    def distance_relation_3(self, i, j):
+        return DISTANCES_3[self.distance_3[i, j]]
+
+    def distance_relation_2(self, i, j):
+        return DISTANCES_2[self.distance_2[i, j]]
+
+    def distance_relation_2_sd(self, i, j):
+        return DISTANCES_2[self.distance_2_sd[i, j]]
@@ -6,11 +6,19 @@ Created on Thu Apr 18, 2024
 @author: Fangjun
 """
 
-from constraint import Problem
+from constraint import Problem, BacktrackingSolver
+from functools import lru_cache
+import argparse
+import json
+import os
+import socket
+import socketserver
+import threading
 import time
 import numpy as np
 
 # Domain size for the grid (width, height)
+@lru_cache(maxsize=None)
 def generate_grid_points(domain_size= (12, 12), res= 1):
     x_values = np.arange(0, domain_size[0], res)
     y_values = np.arange(0, domain_size[1], res)
@@ -76,6 +84,7 @@ def far_2(pos1, pos2, domain_size):
     return distance > boundary_distance
 
 # Directional constraints dictionary
+@lru_cache(maxsize=None)
 def get_direction_constraints(domain_size):
     return {
         'N': north,
@@ -115,18 +124,222 @@ def generate_abbreviation(direction):
     return ''.join(word[0].upper() for word in direction.split('-'))
 
 
-def solve_single_candidate(example,relation_description, domain_size):
+# Fact-set normalization
+INVERSE_RELATIONS = {
+    'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E',
+    'NE': 'SW', 'SW': 'NE', 'NW': 'SE', 'SE': 'NW', 'O': 'O',
+    'CL3': 'CL3', 'MD3': 'MD3', 'FR3': 'FR3', 'CL2': 'CL2', 'FR2': 'FR2',
+}
+
+# (x sign, y sign) of obj1 relative to obj2
+DIRECTION_SIGNS = {
+    'N': (0, 1), 'S': (0, -1), 'E': (1, 0), 'W': (-1, 0),
+    'NE': (1, 1), 'NW': (-1, 1), 'SE': (1, -1), 'SW': (-1, -1), 'O': (0, 0),
+}
+
+# Lower rank = checked first: tight, cheap direction tests before the distance tests.
+# Unary room facts are pruned up front by the solver.
+RELATION_TIGHTNESS = {
+    'O': 0, 'N': 1, 'S': 1, 'E': 1, 'W': 1, 'NE': 2, 'NW': 2, 'SE': 2, 'SW': 2,
+    'FR3': 3, 'CL3': 3, 'CL2': 4, 'FR2': 4, 'MD3': 5,
+}
+
+
+def compose_sign(a, b):
+    """Compose two axis signs along a path; None if the result is undetermined."""
+    if a == 0:
+        return b
+    if b == 0 or a == b:
+        return a
+    return None
+
+
+def direction_implied(fact, direction_facts):
+    """Check whether a direction fact follows from a chain of the other direction facts."""
+    obj1, relation, obj2 = fact
+    target = DIRECTION_SIGNS[relation]
+    edges = {}
+    for other in direction_facts:
+        if other == fact:
+            continue
+        a, r, b = other
+        sx, sy = DIRECTION_SIGNS[r]
+        edges.setdefault(a, []).append((b, (sx, sy)))
+        edges.setdefault(b, []).append((a, (-sx, -sy)))
+
+    # Walk outwards from obj1 keeping the composed signs of obj1 relative to each node
+    seen = set()
+    frontier = [(obj1, (0, 0))]
+    while frontier:
+        node, (sx, sy) = frontier.pop()
+        for neighbour, (ex, ey) in edges.get(node, []):
+            # obj1 -> node -> neighbour: obj1 rel node is (sx, sy), node rel neighbour is (ex, ey)
+            state = (neighbour, (compose_sign(sx, ex), compose_sign(sy, ey)))
+            if None in state[1] or state in seen:
+                continue
+            if neighbour == obj2 and state[1] == target:
+                return True
+            seen.add(state)
+            frontier.append(state)
+    return False
+
+
+def normalize_facts(facts):
+    """
+    Return an equivalent, smaller fact list.
+
+    Duplicates and inverse pairs (e.g. A N B and B S A) are folded into one
+    canonical fact, INR is dropped for objects constrained by other facts, direction
+    facts implied by a chain of other direction facts are dropped, and the rest are
+    ordered from tightest to loosest.
+    """
+    canonical = []
+    seen = set()
+    for obj1, relation, obj2 in facts:
+        if obj2 != 'room' and obj2 < obj1:
+            obj1, relation, obj2 = obj2, INVERSE_RELATIONS[relation], obj1
+        if (obj1, relation, obj2) not in seen:
+            seen.add((obj1, relation, obj2))
+            canonical.append((obj1, relation, obj2))
+
+    constrained = set()
+    for obj1, relation, obj2 in canonical:
+        if relation != 'INR':
+            constrained.update(obj for obj in (obj1, obj2) if obj != 'room')
+    canonical = [fact for fact in canonical if fact[1] != 'INR' or fact[0] not in constrained]
+
+    direction_facts = [fact for fact in canonical if fact[1] in DIRECTION_SIGNS]
+    for fact in direction_facts[:]:
+        if direction_implied(fact, direction_facts):
+            direction_facts.remove(fact)
+    kept = set(direction_facts)
+    canonical = [fact for fact in canonical if fact[1] not in DIRECTION_SIGNS or fact in kept]
+
+    return sorted(canonical, key=lambda fact: -1 if fact[2] == 'room' else RELATION_TIGHTNESS[fact[1]])
+
+
+# Query-aware search heuristics
+class QueryAwareSolver(BacktrackingSolver):
+    """
+    Backtracking solver that branches on the query objects first, then on the
+    variable with the fewest remaining values (ties broken by degree), and tries
+    values closest to the hinted positions first.
+    """
+
+    def __init__(self, priority=(), hints=None, forwardcheck=True):
+        super().__init__(forwardcheck)
+        self._priority = {variable: rank for rank, variable in enumerate(priority)}
+        self._hints = hints or {}
+
+    def order_values(self, domains):
+        # Values are popped from the end, so the nearest value goes last
+        for variable, hint in self._hints.items():
+            if variable in domains:
+                domains[variable].sort(key=lambda pos: -((pos[0] - hint[0]) ** 2 + (pos[1] - hint[1]) ** 2))
+
+    def getSolutionIter(self, domains, constraints, vconstraints):
+        forwardcheck = self._forwardcheck
+        assignments = {}
+        queue = []
+        self.order_values(domains)
+        no_priority = len(self._priority)
+
+        while True:
+            # Query objects first, then MRV with the degree heuristic as tie-break
+            lst = [
+                (self._priority.get(variable, no_priority), len(domains[variable]), -len(vconstraints[variable]), variable)
+                for variable in domains if variable not in assignments
+            ]
+            if lst:
+                variable = min(lst)[-1]
+                values = domains[variable][:]
+                if forwardcheck:
+                    pushdomains = [domains[x] for x in domains if x not in assignments and x != variable]
+                else:
+                    pushdomains = None
+            else:
+                # No unassigned variables. We've got a solution.
+                yield assignments.copy()
+                if not queue:
+                    return
+                variable, values, pushdomains = queue.pop()
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+
+            while True:
+                # Backtrack until a variable with values left is found
+                if not values:
+                    del assignments[variable]
+                    while queue:
+                        variable, values, pushdomains = queue.pop()
+                        if pushdomains:
+                            for domain in pushdomains:
+                                domain.popState()
+                        if values:
+                            break
+                        del assignments[variable]
+                    else:
+                        return
+
+                assignments[variable] = values.pop()
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.pushState()
+
+                for constraint, variables in vconstraints[variable]:
+                    if not constraint(variables, domains, assignments, pushdomains):
+                        break
+                else:
+                    break
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+
+            queue.append((variable, values, pushdomains))
+
+
+def create_problem(example, ordering='default'):
+    """
+    Create an empty Problem for an example.
+
+    :param ordering: 'default' keeps python-constraint's ordering, 'query' uses QueryAwareSolver.
+    """
+    if ordering == 'default':
+        return Problem()
+    if ordering != 'query':
+        raise ValueError(f"Unknown ordering: {ordering}")
+    priority = []
+    if example.get('query') and isinstance(example['query'][-1], tuple):
+        priority = [obj for obj in (example['query'][-1][0], example['query'][-1][-1]) if obj != 'room']
+    return Problem(QueryAwareSolver(priority, example.get('positions')))
+
+
+# Named solver configurations, passed to the solve functions as keyword arguments
+SOLVER_BACKENDS = {
+    'default': {'ordering': 'default', 'normalize': False},
+    'default_normalized': {'ordering': 'default', 'normalize': True},
+    'query': {'ordering': 'query', 'normalize': False},
+    'query_normalized': {'ordering': 'query', 'normalize': True},
+}
+
+
+def solve_single_candidate(example,relation_description, domain_size, ordering='default', normalize=False):
     relation_candidate = generate_abbreviation(relation_description)
+    domain_size = tuple(domain_size)
     all_objects = set(obj for fact in example['facts'] for obj in [fact[0], fact[2]] if obj != "room")
+    facts = normalize_facts(example['facts']) if normalize else example['facts']
     
     grid_points = generate_grid_points(domain_size)
     direction_constraints = get_direction_constraints(domain_size)
 
-    problem = Problem()
+    problem = create_problem(example, ordering)
     for obj in all_objects:
         problem.addVariable(obj, grid_points)
     
-    for fact in example['facts']:
+    for fact in facts:
         obj1, relation, obj2 = fact
         if obj2 == "room":
             problem.addConstraint(direction_constraints[relation], [obj1])
@@ -150,21 +363,68 @@ def solve_single_candidate(example,relation_description, domain_size):
     
     
 
-def solve_all_candidates(example, domain_size):
-    relation_candidates = ['N', 'S', 'E', 'W', 'NE', 'NW', 'SE', 'SW', 'O']
+RELATION_CANDIDATES = ['N', 'S', 'E', 'W', 'NE', 'NW', 'SE', 'SW', 'O']
+
+def solve_any_candidate(example, domain_size, ordering='default', normalize=False):
+    """
+    Return (relation of the query objects in one solution of the facts, or None, solve time).
+
+    The candidates of solve_all_candidates cover every relative position of two objects,
+    so this single solve tells whether any of them is feasible.
+    """
+    domain_size = tuple(domain_size)
+    if not (example.get('query') and isinstance(example['query'][-1], tuple)) or example['query'][-1][-1] == 'room':
+        return None, 0.0
+    all_objects = set(obj for fact in example['facts'] for obj in [fact[0], fact[2]] if obj != "room")
+    facts = normalize_facts(example['facts']) if normalize else example['facts']
+
+    grid_points = generate_grid_points(domain_size)
+    direction_constraints = get_direction_constraints(domain_size)
+
+    problem = create_problem(example, ordering)
+    for obj in all_objects:
+        problem.addVariable(obj, grid_points)
+
+    for fact in facts:
+        obj1, relation, obj2 = fact
+        if obj2 == "room":
+            problem.addConstraint(direction_constraints[relation], [obj1])
+        else:
+            problem.addConstraint(direction_constraints[relation], [obj1, obj2])
+
+    start_time = time.time()
+    solution = problem.getSolution()
+    solution_time = time.time() - start_time
+    if not solution:
+        return None, solution_time
+    pos1, pos2 = solution[example['query'][-1][0]], solution[example['query'][-1][-1]]
+    return next(relation for relation in RELATION_CANDIDATES if direction_constraints[relation](pos1, pos2)), solution_time
+
+
+def solve_all_candidates(example, domain_size, ordering='default', normalize=False, candidates=None, feasible=()):
+    # `candidates` restricts the check to relations known to be feasible for a subset of the facts,
+    # relations in `feasible` are known to be feasible for these facts and are not solved again
+    relation_candidates = RELATION_CANDIDATES
+    if candidates is not None:
+        relation_candidates = [relation for relation in relation_candidates if relation in candidates]
     solvable_relations = []    
+    domain_size = tuple(domain_size)
     all_objects = set(obj for fact in example['facts'] for obj in [fact[0], fact[2]] if obj != "room")
+    facts = normalize_facts(example['facts']) if normalize else example['facts']
     
     grid_points = generate_grid_points(domain_size)
     direction_constraints = get_direction_constraints(domain_size)
     start_time = time.time()
 
     for relation in relation_candidates:
-        problem = Problem()
+        if relation in feasible:
+            solvable_relations.append(relation)
+            continue
+        problem = create_problem(example, ordering)
         for obj in all_objects:
             problem.addVariable(obj, grid_points)
 
-        for fact in example['facts']:
+        for fact in facts:
             obj1, relation_type, obj2 = fact
             if obj2 == "room":
                 problem.addConstraint(direction_constraints[relation_type], [obj1])
@@ -184,3 +444,166 @@ def solve_all_candidates(example, domain_size):
     solution_time = time.time() - start_time
     return solvable_relations, solution_time
 
+
+# Long-running solver daemon
+class SolverCache:
+    """Thread-safe LRU cache of solver answers, shared by all domain sizes."""
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                value = self.entries.pop(key)
+                self.entries[key] = value
+                return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            if len(self.entries) > self.max_size:
+                del self.entries[next(iter(self.entries))]
+
+
+class LatencyStats:
+    """Per-operation request latencies, kept in memory for percentile reporting."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.lock = threading.Lock()
+
+    def record(self, op, seconds):
+        with self.lock:
+            self.latencies.setdefault(op, []).append(seconds)
+
+    def summary(self):
+        # Only the daemon reports percentiles, so the solver itself does not depend on run_metrics
+        from run_metrics import percentiles
+        with self.lock:
+            latencies = {op: list(values) for op, values in self.latencies.items()}
+        return {
+            op: {'count': len(values), 'mean': sum(values) / len(values), **percentiles(values)}
+            for op, values in latencies.items()
+        }
+
+
+def parse_request_example(request):
+    """Convert a JSON request into an example dict with tuple facts and queries."""
+    example = {
+        'example_id': request.get('example_id'),
+        'facts': [tuple(fact) for fact in request['facts']],
+        'query': [tuple(query) for query in request.get('query', [])],
+    }
+    if request.get('positions'):
+        example['positions'] = {obj: tuple(pos) for obj, pos in request['positions'].items()}
+    return example
+
+
+def handle_request(request, cache, stats, default_domain_size=(12, 12)):
+    """
+    Answer one daemon request.
+
+    A request has the shape of an `example` dict plus optional 'domain_size', 'ordering',
+    'normalize' and 'relation' keys. With 'relation' the request is a yes/no check
+    (solve_single_candidate), otherwise all candidates are solved. {'op': 'stats'}
+    returns latency and cache statistics.
+    """
+    start_time = time.perf_counter()
+    if request.get('op') == 'stats':
+        return {'stats': stats.summary(), 'cache': {'size': len(cache.entries), 'hits': cache.hits, 'misses': cache.misses}}
+
+    example = parse_request_example(request)
+    domain_size = tuple(request.get('domain_size') or default_domain_size)
+    ordering = request.get('ordering', 'default')
+    normalize = request.get('normalize', False)
+    relation = request.get('relation')
+    op = 'single' if relation else 'all'
+    key = (op, domain_size, ordering, normalize, relation, tuple(example['facts']), tuple(example['query']))
+
+    cached = cache.get(key)
+    if cached is None:
+        if relation:
+            answer, solve_time = solve_single_candidate(example, relation, domain_size, ordering, normalize)
+        else:
+            answer, solve_time = solve_all_candidates(example, domain_size, ordering, normalize)
+        cache.put(key, (answer, solve_time))
+    else:
+        answer, solve_time = cached
+
+    stats.record(op, time.perf_counter() - start_time)
+    return {'example_id': example['example_id'], 'answer': answer, 'time': solve_time, 'cached': cached is not None}
+
+
+class SolverRequestHandler(socketserver.StreamRequestHandler):
+    """Reads JSON-lines requests from a connection and writes one JSON line per answer."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                response = handle_request(json.loads(line), self.server.cache, self.server.stats, self.server.domain_size)
+            except Exception as e:
+                response = {'error': f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class SolverServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, domain_size=(12, 12), cache_size=100000):
+        super().__init__(socket_path, SolverRequestHandler)
+        self.cache = SolverCache(cache_size)
+        self.stats = LatencyStats()
+        self.domain_size = domain_size
+
+
+def serve(socket_path, domain_sizes=((12, 12),), cache_size=100000):
+    """Warm the relation tables for the given domain sizes and serve requests until interrupted."""
+    for domain_size in domain_sizes:
+        generate_grid_points(domain_size)
+        get_direction_constraints(domain_size)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with SolverServer(socket_path, domain_sizes[0], cache_size) as server:
+        print(f"Solver listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            print(json.dumps(server.stats.summary(), indent=4))
+            os.remove(socket_path)
+
+
+def query_server(socket_path, request):
+    """Send one request to a running solver daemon and return the decoded response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile('rwb') as stream:
+            stream.write((json.dumps(request) + '\n').encode())
+            stream.flush()
+            return json.loads(stream.readline())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Spatial constraint solver.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve JSON-lines solver requests on a Unix domain socket.")
+    serve_parser.add_argument('--socket', type=str, default='/tmp/roomspace-solver.sock', help="Path of the Unix domain socket.")
+    serve_parser.add_argument('--domain_size', type=int, nargs=2, action='append', help="Domain size to warm up (repeatable); the first is the default.")
+    serve_parser.add_argument('--cache_size', type=int, default=100000, help="Maximum number of cached answers.")
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        domain_sizes = [tuple(d) for d in args.domain_size] if args.domain_size else [(12, 12)]
+        serve(args.socket, domain_sizes, args.cache_size)
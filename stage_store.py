@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persisted outputs of the generate_vary_m_n.py pipeline stages.
+
+Examples go through three stages: scene -> facts, facts -> solver results and
+results -> questions/text. With --stage_cache the outputs of the first two are
+stored in a SQLite file under a digest of everything they depend on, so a run
+that only changes the question or text code re-renders from stored facts and
+solver results instead of solving again. Bump a stage's version in
+generate_vary_m_n.py when its code changes, which invalidates its entries and
+those of the stages after it.
+
+    python stage_store.py Data/SD-100/stages.sqlite
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+
+
+def stage_key(*inputs):
+    """Digest of a stage's inputs; tuples and lists hash alike, as they do once stored as JSON."""
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+class StageStore:
+    """Stage outputs keyed by (stage, digest of the stage inputs)."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts (stage TEXT, key TEXT, value TEXT NOT NULL, PRIMARY KEY (stage, key)) WITHOUT ROWID"
+            )
+        self.hits = {}
+        self.misses = {}
+
+    def get(self, stage, key):
+        row = self.connection.execute("SELECT value FROM artifacts WHERE stage = ? AND key = ?", (stage, key)).fetchone()
+        counts = self.hits if row else self.misses
+        counts[stage] = counts.get(stage, 0) + 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, stage, key, value):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?)", (stage, key, json.dumps(value)))
+
+    def counts(self):
+        """Return {stage: number of stored outputs}."""
+        return dict(self.connection.execute("SELECT stage, COUNT(*) FROM artifacts GROUP BY stage"))
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what a stage cache holds.")
+    parser.add_argument('store', help="Path of the SQLite stage cache.")
+    args = parser.parse_args()
+
+    store = StageStore(args.store)
+    for stage, count in sorted(store.counts().items()):
+        print(f"{stage}: {count} outputs")
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
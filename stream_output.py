@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Append-only JSON-lines output for generate_vary_m_n.py.
+
+With --output_format jsonl every example's descriptions and facts are appended
+to n{n}_m{m}_d{d}.jsonl files as soon as they are produced, instead of
+rewriting whole pretty-printed JSON files after each (n, m) cell. Run this
+script on a data directory to convert the JSON-lines files back to the legacy
+JSON files:
+
+    python stream_output.py Data/SD-100
+
+CheckpointLog records which examples of a cell are safely on disk, so an
+interrupted run resumes exactly where it stopped.
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+
+class JsonlWriter:
+    """Append one JSON record per line, fsyncing every `fsync_every` records and on close."""
+
+    def __init__(self, path, fsync_every=100):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        truncate_partial_line(path)
+        self.file = open(path, 'a')
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        # Byte offset of the end of the last record; json.dumps output is ASCII
+        self.offset = os.path.getsize(path)
+
+    def write(self, record):
+        line = json.dumps(record) + '\n'
+        self.file.write(line)
+        self.offset += len(line)
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+
+class CheckpointLog:
+    """
+    Append-only log of the examples completed in one (n, m, domain size) cell.
+
+    Entries are committed in batches of `commit_every`, after the output writers
+    they refer to are synced, so every logged example is on disk. With writers
+    each entry also stores their offsets, which lets a restart cut off records
+    written after the last commit.
+    """
+
+    def __init__(self, path, commit_every=100):
+        self.writer = JsonlWriter(path, fsync_every=commit_every)
+        self.entries = read_checkpoint(path)
+        self.commit_every = commit_every
+        self.pending = []
+
+    def mark(self, entry, writers=None):
+        if writers:
+            entry['offsets'] = {name: writer.offset for name, writer in writers.items()}
+        self.entries[entry['example_id']] = entry
+        self.pending.append(entry)
+        if len(self.pending) >= self.commit_every:
+            self.commit(writers)
+
+    def commit(self, writers=None):
+        for writer in (writers or {}).values():
+            writer.sync()
+        for entry in self.pending:
+            self.writer.write(entry)
+        self.writer.sync()
+        self.pending = []
+
+    def close(self, writers=None):
+        self.commit(writers)
+        self.writer.close()
+
+
+def read_checkpoint(path):
+    """Return {example_id: entry} of the committed entries of a checkpoint log."""
+    if not os.path.exists(path):
+        return {}
+    return {entry['example_id']: entry for entry in read_jsonl(path)}
+
+
+def truncate_outputs(entries, paths):
+    """Cut the output files in `paths` ({name: path}) back to the end of the last checkpointed record."""
+    offsets = [entry['offsets'] for entry in entries.values() if 'offsets' in entry]
+    for name, path in paths.items():
+        end = max((offset[name] for offset in offsets), default=0)
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            with open(path, 'rb+') as file:
+                file.truncate(end)
+
+
+def truncate_partial_line(path, block_size=65536):
+    """Drop an incomplete last line left behind by an interrupted run."""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as file:
+        # Only the tail is read, so reopening a long file stays cheap
+        end = file.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(position - block_size, 0)
+            file.seek(start)
+            block = file.read(position - start)
+            if position == end and block.endswith(b'\n'):
+                return
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                file.truncate(start + newline + 1)
+                return
+            position = start
+        file.truncate(0)
+
+
+def read_jsonl(path):
+    """Read all complete records of a JSON-lines file."""
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.endswith('\n')]
+
+
+def convert_to_json(jsonl_path, json_path):
+    """Write the records of a JSON-lines file as the legacy pretty-printed JSON list."""
+    with open(json_path, 'w') as outfile:
+        json.dump(read_jsonl(jsonl_path), outfile, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON-lines Text/Logic files to the legacy JSON files.")
+    parser.add_argument('data_dir', help="Dataset directory, e.g. Data/SD-100.")
+    args = parser.parse_args()
+
+    for jsonl_path in sorted(Path(args.data_dir).glob('*/*.jsonl')):
+        json_path = jsonl_path.with_suffix('.json')
+        convert_to_json(jsonl_path, json_path)
+        print(f"{jsonl_path} -> {json_path}")
+
+
+if __name__ == '__main__':
+    main()
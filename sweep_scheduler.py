@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cost-aware scheduling of the (n, m) sweep in generate_vary_m_n.py.
+
+Cell costs come from earlier timing files (times_fr_take_d*.json and
+times_yn_take_d*.json) when available, otherwise from a simple model in n, m
+and the domain size, calibrated on whatever history exists.
+"""
+
+import json
+import re
+import statistics
+import time
+from pathlib import Path
+
+
+def model_cost(n, m, domain_area):
+    """Relative per-example cost: every pair fact and object multiplies the search over the grid."""
+    return domain_area * m * n ** 2
+
+
+def variant_times(times):
+    """Solver times of an example's variants: a list of all of them, or {variant: time} of the selected ones."""
+    return times.values() if isinstance(times, dict) else times
+
+
+def load_timing_history(logic_dir):
+    """Return {(n, m, domain_area): mean solver seconds per example} from earlier runs."""
+    history = {}
+    for times_file in Path(logic_dir).glob('times_fr_take_d*.json'):
+        domain_area = int(re.search(r'_d(\d+)\.json$', times_file.name).group(1))
+        yn_file = times_file.with_name(times_file.name.replace('times_fr_take', 'times_yn_take'))
+        with times_file.open() as file:
+            times_fr = json.load(file)
+        times_yn = {}
+        if yn_file.exists():
+            with yn_file.open() as file:
+                times_yn = json.load(file)
+        for key, per_example in times_fr.items():
+            if not per_example:
+                continue
+            n, m = map(int, key.split('_'))
+            per_example_yn = times_yn.get(key, {})
+            totals = [sum(variant_times(t)) + sum(variant_times(per_example_yn.get(example_id, []))) for example_id, t in per_example.items()]
+            history[n, m, domain_area] = sum(totals) / len(totals)
+    return history
+
+
+def estimate_cell_costs(cells, domain_size, logic_dir):
+    """
+    Estimate the solver seconds of each (n, m) cell.
+
+    :param cells: Dictionary mapping (n, m) to the number of examples still to process.
+    Cells with history use their own mean per-example time; the others use
+    model_cost scaled by the median ratio of observed to modelled cost.
+    """
+    domain_area = domain_size[0] * domain_size[1]
+    history = load_timing_history(logic_dir)
+    ratios = [seconds / model_cost(n, m, area) for (n, m, area), seconds in history.items()]
+    scale = statistics.median(ratios) if ratios else None
+
+    costs = {}
+    for (n, m), examples in cells.items():
+        if (n, m, domain_area) in history:
+            per_example = history[n, m, domain_area]
+        elif scale is not None:
+            per_example = scale * model_cost(n, m, domain_area)
+        else:
+            per_example = model_cost(n, m, domain_area)
+        costs[n, m] = per_example * examples
+    return costs, scale is not None
+
+
+def schedule_cells(cells, costs, workers):
+    """
+    Cells split into chunks of consecutive m of one n, as [(n, [(n, m), ...])], most
+    expensive chunk first, so that no large chunk is left as a straggler. A chunk runs in
+    one process with m ascending, where the solver memo of an (example, n) reuses the
+    answers of smaller m; chunks are kept to about a share of the sweep's cost per
+    `workers`, so every worker gets work even for a single n.
+    """
+    target = sum(costs[cell] for cell in cells) / (2 * workers)
+    chunks = []
+    for n, m in sorted(cells):
+        chunk = chunks[-1] if chunks else None
+        if chunk is None or chunk[0] != n or sum(costs[cell] for cell in chunk[1]) + costs[n, m] > target:
+            chunk = (n, [])
+            chunks.append(chunk)
+        chunk[1].append((n, m))
+    return sorted(chunks, key=lambda chunk: sum(costs[cell] for cell in chunk[1]), reverse=True)
+
+
+class SweepProgress:
+    """Tracks finished cells and extrapolates an ETA from the estimated costs done so far."""
+
+    def __init__(self, costs):
+        self.costs = costs
+        self.remaining = dict(costs)
+        self.done_cost = 0
+        self.start_time = time.time()
+
+    def finish(self, cell):
+        self.done_cost += self.remaining.pop(cell)
+        elapsed = time.time() - self.start_time
+        remaining_cost = sum(self.remaining.values())
+        eta = remaining_cost * elapsed / self.done_cost if self.done_cost else float('nan')
+        done = len(self.costs) - len(self.remaining)
+        print(f"cells done: {done}/{len(self.costs)}, elapsed: {elapsed:.0f}s, ETA: {eta:.0f}s")
+        return eta
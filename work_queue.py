@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+SQLite work queue of (example_id, n, m) units for generate_vary_m_n.py.
+
+Any number of workers sharing the queue file (on one machine, or on several
+machines sharing a filesystem with working file locks) claim units in small
+batches, most expensive first. Each worker refreshes a heartbeat for its claims;
+claims whose heartbeat is older than the lease are put back in the queue, so
+workers can be added or stopped at any time. Run this script to see progress:
+
+    python work_queue.py Data/SD-100/queue.sqlite
+"""
+
+import argparse
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue:
+    """Units keyed by (data_version, domain, n, m, example_id), each pending, claimed or done."""
+
+    def __init__(self, path, lease=300):
+        self.path = path
+        self.lease = lease
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = self.connect()
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS units (data_version TEXT, domain INTEGER, n INTEGER, m INTEGER, example_id INTEGER, "
+            "cost REAL, state TEXT NOT NULL DEFAULT 'pending', worker TEXT, heartbeat REAL, "
+            "PRIMARY KEY (data_version, domain, n, m, example_id)) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS units_state ON units (state, cost)")
+
+    def connect(self):
+        # Autocommit; transactions that must not interleave use BEGIN IMMEDIATE
+        return sqlite3.connect(self.path, timeout=60, isolation_level=None)
+
+    def add(self, data_version, domain, cells):
+        """Queue the units of `cells` ({(n, m): (example ids, cost per example)}) not queued yet."""
+        rows = [(data_version, domain, n, m, i, cost) for (n, m), (example_ids, cost) in cells.items() for i in example_ids]
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.executemany("INSERT OR IGNORE INTO units (data_version, domain, n, m, example_id, cost) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self.connection.execute("COMMIT")
+
+    def claim(self, data_version, domain, worker, batch=10):
+        """
+        Claim up to `batch` pending units, re-queuing stale claims first.
+
+        Returns {(n, m): [example_id, ...]}; the batch is taken from the most expensive cell left.
+        """
+        now = time.time()
+        key = (data_version, domain)
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            self.connection.execute(
+                "UPDATE units SET state = 'pending', worker = NULL WHERE state = 'claimed' AND heartbeat < ? AND data_version = ? AND domain = ?",
+                (now - self.lease,) + key,
+            )
+            cell = self.connection.execute(
+                "SELECT n, m FROM units WHERE state = 'pending' AND data_version = ? AND domain = ? ORDER BY cost DESC, n, m LIMIT 1", key
+            ).fetchone()
+            if cell is None:
+                self.connection.execute("COMMIT")
+                return {}
+            example_ids = [row[0] for row in self.connection.execute(
+                "SELECT example_id FROM units WHERE state = 'pending' AND data_version = ? AND domain = ? AND n = ? AND m = ? ORDER BY example_id LIMIT ?",
+                key + cell + (batch,),
+            )]
+            self.connection.executemany(
+                "UPDATE units SET state = 'claimed', worker = ?, heartbeat = ? WHERE data_version = ? AND domain = ? AND n = ? AND m = ? AND example_id = ?",
+                [(worker, now) + key + cell + (i,) for i in example_ids],
+            )
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return {cell: example_ids}
+
+    def complete(self, data_version, domain, n, m, example_ids, worker):
+        """Mark units done, unless they were re-queued and claimed by another worker meanwhile."""
+        self.connection.execute("BEGIN IMMEDIATE")
+        self.connection.executemany(
+            "UPDATE units SET state = 'done', heartbeat = ? WHERE data_version = ? AND domain = ? AND n = ? AND m = ? AND example_id = ? AND (worker = ? OR state = 'pending')",
+            [(time.time(), data_version, domain, n, m, i, worker) for i in example_ids],
+        )
+        self.connection.execute("COMMIT")
+
+    def counts(self, data_version=None, domain=None):
+        """Return {state: number of units}, over all units or those of one data version and domain."""
+        if data_version is None:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM units GROUP BY state")
+        else:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM units WHERE data_version = ? AND domain = ? GROUP BY state", (data_version, domain))
+        return {'pending': 0, 'claimed': 0, 'done': 0, **dict(rows)}
+
+    def start_heartbeat(self, worker, interval=None):
+        """Refresh the heartbeat of `worker`'s claims from a background thread; returns its stop event."""
+        stop = threading.Event()
+        interval = interval or self.lease / 3
+
+        def beat():
+            connection = self.connect()
+            while not stop.wait(interval):
+                connection.execute("UPDATE units SET heartbeat = ? WHERE state = 'claimed' AND worker = ?", (time.time(), worker))
+            connection.close()
+
+        threading.Thread(target=beat, daemon=True).start()
+        return stop
+
+    def close(self):
+        self.connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the progress of a generate_vary_m_n.py work queue.")
+    parser.add_argument('queue', help="Path of the SQLite work queue.")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.queue)
+    counts = queue.counts()
+    workers = queue.connection.execute("SELECT worker, COUNT(*), MAX(heartbeat) FROM units WHERE state = 'claimed' GROUP BY worker").fetchall()
+    queue.close()
+    print(f"pending: {counts['pending']}, claimed: {counts['claimed']}, done: {counts['done']}")
+    for worker, claimed, heartbeat in workers:
+        print(f"  {worker}: {claimed} claimed, last heartbeat {time.time() - heartbeat:.0f}s ago")
+
+
+if __name__ == '__main__':
+    main()